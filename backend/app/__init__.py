@@ -13,7 +13,35 @@ mail = Mail()
 # Google maps API access
 import os
 from app.metrics.map import GMapsAPI
-gmaps = GMapsAPI(os.getenv('FLASK_APP_BACKEND_GMAPS_API_KEY'))
+from app.metrics.util import PooledSession, CONNECT_TIMEOUT, READ_TIMEOUT
+
+connect_timeout = float(os.getenv('FLASK_APP_HTTP_CONNECT_TIMEOUT', CONNECT_TIMEOUT))
+read_timeout = float(os.getenv('FLASK_APP_HTTP_READ_TIMEOUT', READ_TIMEOUT))
+
+# Walking routes of recent trips, served stale while they are refreshed
+from app.metrics.cache import DirectionsCache
+directions_cache = None
+if int(os.getenv('FLASK_APP_DIRECTIONS_CACHE_SIZE', 1024)) > 0:
+    directions_cache = DirectionsCache(ttl=float(os.getenv('FLASK_APP_DIRECTIONS_CACHE_TTL', 60 * 60)),
+                                       stale=float(os.getenv('FLASK_APP_DIRECTIONS_CACHE_STALE', 24 * 60 * 60)),
+                                       max_entries=int(os.getenv('FLASK_APP_DIRECTIONS_CACHE_SIZE', 1024)),
+                                       precision=int(os.getenv('FLASK_APP_DIRECTIONS_PRECISION', 4)))
+
+# Addresses geocoded before or preloaded from OpenData, asked before Google
+geocode_store = None
+if os.getenv('FLASK_APP_GEOCODE_DB'):
+    from app.metrics.geocode import GeocodeStore
+    geocode_store = GeocodeStore(os.getenv('FLASK_APP_GEOCODE_DB'))
+
+# Polygon of each route: simplification of its line and buffer style, see RouteShape
+from app.metrics.util import RouteShape
+route_shape = RouteShape(tolerance=float(os.getenv('FLASK_APP_ROUTE_SIMPLIFY', 0)),
+                         resolution=int(os.getenv('FLASK_APP_ROUTE_BUFFER_RESOLUTION', 16)),
+                         cap_style=os.getenv('FLASK_APP_ROUTE_BUFFER_CAP', 'round'),
+                         join_style=os.getenv('FLASK_APP_ROUTE_BUFFER_JOIN', 'round'))
+
+gmaps = GMapsAPI(os.getenv('FLASK_APP_BACKEND_GMAPS_API_KEY'), PooledSession(4, connect_timeout, read_timeout), connect_timeout, read_timeout,
+                 directions_cache, geocode_store, route_shape)
 
 status = gmaps.create_conn()
 if not status:
@@ -21,11 +49,91 @@ if not status:
 
 # Algorithm solver
 from app.metrics.algorithm import RatingAlgorithms
-algos = RatingAlgorithms()
-
-# Open data threaded access
-from app.metrics.opendata import DataThreadPool
-datapool = DataThreadPool()
+algos = RatingAlgorithms(os.getenv('FLASK_APP_LIGHT_BACKEND', 'polygon'))
+
+# Open data threaded access, or a local snapshot of it when one is configured
+tile_cache = None
+tile_level = 0
+corridor_queries = False
+prefetch_padding = None
+snapshot_path = os.getenv('FLASK_APP_SNAPSHOT_PATH')
+if snapshot_path and not os.path.exists(snapshot_path):
+    # Not downloaded yet, e.g. while python -m app.metrics.snapshot imports the app to download it
+    print('Snapshot {} not found, querying OpenData instead'.format(snapshot_path))
+    snapshot_path = None
+
+if snapshot_path:
+    from app.metrics.snapshot import SnapshotDataSource
+    datapool = SnapshotDataSource.load(snapshot_path)
+else:
+    from app.metrics.opendata import DataThreadPool, MAX_RECORD_COUNT
+    from app.metrics.cache import LRUCache
+    from app.metrics.map import START_TILE_LEVEL, TileSplits
+
+    # Query results per map tile, shared by every request of this worker
+    tile_cache = LRUCache(ttl=float(os.getenv('FLASK_APP_TILE_CACHE_TTL', 24 * 60 * 60)),
+                          max_bytes=int(os.getenv('FLASK_APP_TILE_CACHE_MB', 128)) * 1024 * 1024,
+                          sizeof=lambda features: features.nbytes)
+
+    # Start from coarse tiles and split the ones that exceed the transfer limit, remembered across requests
+    tile_level = START_TILE_LEVEL
+    tile_splits = TileSplits(MAX_RECORD_COUNT)
+
+    # Keep alive connections to the OpenData server, one per concurrent query
+    opendata_pool = int(os.getenv('FLASK_APP_OPENDATA_POOL', 15))
+
+    # Count the features of every start tile of the city in the background, so dense tiles are split before
+    # their first query instead of after a truncated one
+    if os.getenv('FLASK_APP_OPENDATA_DENSITY', 'off') == 'count':
+        from threading import Thread
+        from app.metrics.map import split_tiles
+        from app.metrics.opendata import OpenDataLondon, CITY_NE, CITY_SW, LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+
+        counter = OpenDataLondon(session=PooledSession(opendata_pool, connect_timeout, read_timeout), splits=tile_splits)
+
+        Thread(target=counter.measure_tiles, daemon=True,
+               args=((LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER), split_tiles(CITY_NE, CITY_SW, START_TILE_LEVEL), opendata_pool)).start()
+
+    # Query a corridor around each route instead of tiles over the bounding box of all routes
+    corridor_queries = os.getenv('FLASK_APP_OPENDATA_QUERY', 'tiles') == 'corridor'
+
+    # Decode OpenData responses while they are read instead of loading them whole
+    stream = os.getenv('FLASK_APP_OPENDATA_DECODE', 'json') == 'stream'
+
+    # Encoding of OpenData responses, see WIRE_FORMATS
+    wire = os.getenv('FLASK_APP_OPENDATA_FORMAT', 'json')
+
+    # Prefetch the tiles around both ends of a trip while its routes are requested, see trip_bounding_box
+    if os.getenv('FLASK_APP_OPENDATA_PREFETCH', '0.25') != 'off':
+        prefetch_padding = float(os.getenv('FLASK_APP_OPENDATA_PREFETCH', '0.25'))
+
+    # Corridor queries are only issued by the thread collector
+    if os.getenv('FLASK_APP_OPENDATA_COLLECTOR', 'threads') == 'async' and not corridor_queries:
+        from app.metrics.opendata import AsyncDataPool
+        datapool = AsyncDataPool(tile_cache, opendata_pool, read_timeout, tile_splits, stream, wire)
+    else:
+        # Query all layers of a box in one request through the map service, or each layer on its own
+        combined = os.getenv('FLASK_APP_OPENDATA_LAYERS', 'separate') == 'combined'
+
+        datapool = DataThreadPool(tile_cache, PooledSession(opendata_pool, connect_timeout, read_timeout), opendata_pool,
+                                  tile_splits, combined, stream, wire)
+
+# Precomputed safety grid of the whole city; routes are scored from it without any OpenData query
+safety_grid = None
+grid_path = os.getenv('FLASK_APP_SAFETY_GRID')
+if grid_path and not os.path.exists(grid_path):
+    # Not built yet, e.g. while python -m app.metrics.grid imports the app to build it
+    print('Safety grid {} not found, scoring from OpenData features instead'.format(grid_path))
+elif grid_path:
+    from app.metrics.grid import SafetyGrid
+    safety_grid = SafetyGrid.load(grid_path)
+
+# Metrics per route polyline. Live data has no version, so entries expire with the tile cache instead
+from app.metrics.cache import MetricsCache
+metrics_cache = None
+if int(os.getenv('FLASK_APP_METRICS_CACHE_SIZE', 4096)) > 0:
+    metrics_cache = MetricsCache(int(os.getenv('FLASK_APP_METRICS_CACHE_SIZE', 4096)),
+                                 tile_cache.ttl if tile_cache is not None else None)
 
 # Combined data
 from app.endpoints.combined import CombinedResource, CombinedListResource
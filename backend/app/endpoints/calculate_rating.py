@@ -6,8 +6,10 @@
 from flask import request as req
 from flask_restful import Resource
 
-from app import gmaps, datapool, algos
-from app.metrics.map import max_bounding_box, split_box
+from app import gmaps, datapool, algos, tile_cache, tile_level, corridor_queries, directions_cache, prefetch_padding, metrics_cache, safety_grid
+from app.metrics.map import max_bounding_box, split_tiles, trip_bounding_box
+from app.metrics.algorithm import RouteMetrics
+from app.metrics.opendata import DataThreadPool, LightSet
 from app.endpoints.util import HTTPHandler
 
 import time
@@ -40,6 +42,8 @@ class CalcRatingResource(Resource):
                             "lights": float,      Lights per km
                             "sidewalks": float,   Sidewalk availability ratio (Sidewalk distance/route distance)
                             "traffic": float,     Average daily traffic, weighted
+                            "dark_gap": float,    Longest stretch without a street light in km, null if unknown
+                            "sidewalk_gap": float, Longest stretch without a sidewalk in km, null if unknown
                             "duration": float,    Duration of route
                             "distance": float,    Distance of route
                         }, 
@@ -60,41 +64,98 @@ class CalcRatingResource(Resource):
 
         # If exception is thrown, JSON is improperly formatted
         try:
+            # Geocode both ends at once
+            start = time.time()
+            from_loc, to_loc = gmaps.locate(json_data['start'], json_data['end'])
+            print('To geocode: {}'.format(time.time()-start))
+
+            # Routes are scored from the safety grid when there is one; the debug plots still need the features
+            use_grid = safety_grid is not None and not json_data.get('debug')
+
+            # Start fetching the tiles around the trip while Google works out the routes
+            prefetch = None
+            if not use_grid and prefetch_padding is not None and not corridor_queries and hasattr(datapool, 'prefetch') and \
+               type(from_loc) != str and type(to_loc) != str:
+                prefetch_ne, prefetch_sw = trip_bounding_box(from_loc, to_loc, prefetch_padding)
+                prefetch = datapool.prefetch(split_tiles(prefetch_ne, prefetch_sw, tile_level), (prefetch_ne, prefetch_sw))
+
             # Grab routes based on start and end
             start = time.time()
-            routes = gmaps.walking_routes(json_data['start'], json_data['end'])
+            routes = gmaps.walking_routes(from_loc, to_loc)
             print('To get routes: {}'.format(time.time()-start))
 
-            # Calculate maximum bounding box and split that box into smaller boxes for query
-            start = time.time()
-            box_ne, box_sw = max_bounding_box(routes)
-            boxes = split_box(box_ne, box_sw, 25)
-            print('To create boxes: {}'.format(time.time()-start))
+            # The real area is known now; the collect below shares the tiles the prefetch is still fetching
+            # and queries the missing ones itself
+            if prefetch is not None:
+                prefetch.stop()
 
-            # Collect data from opendata portal
-            start = time.time()
-            lights, sidewalks, volumes = datapool.collect(boxes)
-            print('To collect data: {}'.format(time.time()-start))
+            if directions_cache is not None:
+                print('Directions cache: {}'.format(directions_cache.stats()))
 
-            # Calculate metrics
-            start = time.time()
-            light_density = algos.street_light_density(routes, lights)
-            sidewalk_density = algos.sidewalk_density(routes, sidewalks)
-            volume_density = algos.traffic_density(routes, volumes)
-            print('To run computations: {}'.format(time.time()-start))
-
-            data = []
-            for i in range(len(routes)):
-                r = 'Route {} has {:.2f} lights/km, {:.2f}% sidewalk availability, and {:.2f} cars per day on average'\
-                        .format(i+1, light_density[i], sidewalk_density[i]*100, volume_density[i])
-                
-                # Format JSON data
-                data.append( {"polyline": str(routes[i].polyline),\
-                        "lights": light_density[i],\
-                        "sidewalks": sidewalk_density[i],\
-                        "traffic": volume_density[i],\
-                        "duration": routes[i].duration,\
-                        "distance": routes[i].distance })
+            # Routes rated before from the same data need no OpenData at all. The debug plots need the data
+            version = safety_grid.version if use_grid else getattr(datapool, 'version', None)
+            cached = {}
+
+            if metrics_cache is not None and not json_data.get('debug'):
+                for rid, route in enumerate(routes):
+                    values = metrics_cache.get(route, version)
+                    if values is not None:
+                        cached[rid] = RouteMetrics(route, *values)
+
+                print('Metrics cache: {}'.format(metrics_cache.stats()))
+
+            missing = [route for rid, route in enumerate(routes) if rid not in cached]
+            computed = []
+
+            if missing and use_grid:
+                start = time.time()
+                computed = algos.compute_grid(missing, safety_grid)
+                print('To run grid computations: {}'.format(time.time()-start))
+
+            elif missing:
+                # Calculate maximum bounding box and cover it with tiles of the global grid for query
+                start = time.time()
+                box_ne, box_sw = max_bounding_box(missing)
+                boxes = split_tiles(box_ne, box_sw, tile_level)
+                print('To create boxes: {}'.format(time.time()-start))
+
+                # Collect data from opendata portal
+                start = time.time()
+                light_counts = None
+
+                if not corridor_queries:
+                    lights, sidewalks, volumes = datapool.collect(boxes, (box_ne, box_sw))
+                elif json_data.get('debug'):
+                    # The debug plots need every light
+                    lights, sidewalks, volumes = datapool.collect_routes(missing)
+                else:
+                    # Only the light density is needed, let the server count them
+                    light_counts, sidewalks, volumes = datapool.collect_routes(missing, count_lights=True)
+                    lights = LightSet()
+
+                print('To collect data: {}'.format(time.time()-start))
+
+                if tile_cache is not None:
+                    print('Tile cache: {}'.format(tile_cache.stats()))
+
+                if isinstance(datapool, DataThreadPool):
+                    print('OpenData pool: {}'.format(DataThreadPool.stats()))
+
+                # Calculate metrics
+                start = time.time()
+                computed = algos.compute_all(missing, lights, sidewalks, volumes, light_counts)
+                print('To run computations: {}'.format(time.time()-start))
+
+            if metrics_cache is not None:
+                for route_metrics in computed:
+                    metrics_cache.put(route_metrics.route, route_metrics, version)
+
+            # Back in the order of the routes
+            computed = iter(computed)
+            metrics = [cached[rid] if rid in cached else next(computed) for rid in range(len(routes))]
+
+            # Format JSON data
+            data = [m.to_json() for m in metrics]
 
             # Save figure data if debug mode is active
             if json_data.get('debug'):
@@ -121,13 +182,12 @@ class CalcRatingResource(Resource):
                     plt.figure(figsize=(20,10))
 
                     # Plot street lights
-                    lights = [l.coord.latlng for l in lights]
-                    plt.scatter(*zip(*lights), color='grey', s=1)
+                    plt.scatter(lights.x, lights.y, color='grey', s=1)
 
                     # Plot routes
                     for i in range(len(routes)):
                         x,y = routes[i].polygon.exterior.xy
-                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f} lights per km'.format(str(i+1), light_density[i]))
+                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f} lights per km'.format(str(i+1), metrics[i].lights))
 
                     # Add legend and save
                     plt.legend(loc="upper left")
@@ -137,14 +197,14 @@ class CalcRatingResource(Resource):
                     plt.figure(figsize=(20,10))
 
                     # Plot sidewalks
-                    for sidewalk in sidewalks:
-                        x, y = sidewalk.line.xy
+                    for line in sidewalks.lines:
+                        x, y = line.xy
                         plt.plot(x, y, color='grey', alpha=0.7, linewidth=1, solid_capstyle='round', zorder=2)
 
                     # Plot routes
                     for i in range(len(routes)):
                         x,y = routes[i].polygon.exterior.xy
-                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f}% sidewalk coverage'.format(str(i+1), sidewalk_density[i]*100))
+                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f}% sidewalk coverage'.format(str(i+1), metrics[i].sidewalks*100))
 
                     # Add legend and save
                     plt.legend(loc="upper left")
@@ -154,25 +214,25 @@ class CalcRatingResource(Resource):
                     plt.figure(figsize=(20,10))
 
                     # Assign color codes to different volumes of road
-                    for volume in volumes:
+                    for volume, line in zip(volumes.volumes, volumes.lines):
 
                         # Default color
                         c = 'black'
-                        if volume.volume > 1000 and volume.volume < 5000:
+                        if volume > 1000 and volume < 5000:
                             c = 'yellow'
-                        elif volume.volume > 5000:
+                        elif volume > 5000:
                             c = 'red'
                         else:
                             c = 'green'
                         
                         # Plot the line
-                        x, y = volume.line.xy
+                        x, y = line.xy
                         plt.plot(x, y, color=c, alpha=1.0, linewidth=1, solid_capstyle='round', zorder=2)
 
                     # Plot routes
                     for i in range(len(routes)):
                         x,y = routes[i].polygon.exterior.xy
-                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f} average cars per day'.format(str(i+1), volume_density[i]))
+                        plt.plot(x,y, color=colors[i%4], label='Route {} - {:.2f} average cars per day'.format(str(i+1), metrics[i].traffic))
 
                     # Add legend and save
                     plt.legend(loc="upper left")
@@ -5,18 +5,681 @@
         Contains the logic of all the algorithms that numerically analyze route safety metrics
 """
 
+import numpy as np
+import shapely
+
+from shapely.geometry import LineString
+from shapely.prepared import prep
+from app.metrics.util import SpatialIndex, POLYGON_BUFFER, ROUTE_SHAPE
+
+# Ways of deciding whether a light is on a route. See RatingAlgorithms
+LIGHT_BACKENDS = ('polygon', 'numpy')
+
+def route_vertices(route):
+    """
+        purpose:
+            Decoded vertices of a WalkingRoute or RouteSegment as an array
+        parameters:
+            route: WalkingRoute or RouteSegment object
+        return:
+            vertices: (M,2) float array of (LON, LAT)
+    """
+
+    return route.coords
+
+def points_near_polyline(points, vertices, distance, chunk=256):
+    """
+        purpose:
+            Vectorized point to polyline distance test. Equivalent to checking each point against the polyline
+            buffered by DISTANCE, without building the buffer or any shapely geometry
+        parameters:
+            points: (N,2) float array of points
+            vertices: (M,2) float array of polyline vertices, in the same axis order as POINTS
+            distance: Maximum distance from the polyline, in the same units as the coordinates
+            chunk: optional; number of segments to measure at once. Bounds memory at N x CHUNK
+        return:
+            near: (N,) bool array, True where the point is within DISTANCE of any segment
+    """
+
+    near = np.zeros(len(points), dtype=bool)
+
+    if len(points) == 0 or len(vertices) == 0:
+        return near
+
+    # Cheap rejection of everything outside of the buffered bounding box of the polyline
+    low = vertices.min(axis=0) - distance
+    high = vertices.max(axis=0) + distance
+    candidates = np.flatnonzero((points[:, 0] >= low[0]) & (points[:, 0] <= high[0]) &
+                                (points[:, 1] >= low[1]) & (points[:, 1] <= high[1]))
+
+    # A single vertex is a zero length segment
+    starts = vertices[:-1] if len(vertices) > 1 else vertices
+    ends = vertices[1:] if len(vertices) > 1 else vertices
+
+    limit = distance * distance
+
+    for i in range(0, len(starts), chunk):
+
+        if len(candidates) == 0:
+            break
+
+        px = points[candidates, 0][:, None]
+        py = points[candidates, 1][:, None]
+
+        ax = starts[i:i + chunk, 0][None, :]
+        ay = starts[i:i + chunk, 1][None, :]
+        abx = ends[i:i + chunk, 0][None, :] - ax
+        aby = ends[i:i + chunk, 1][None, :] - ay
+
+        # Project each point onto each segment and clamp to the segment ends
+        length2 = abx * abx + aby * aby
+        t = ((px - ax) * abx + (py - ay) * aby) / np.where(length2 > 0, length2, 1)
+        t = np.clip(t, 0, 1)
+
+        dx = px - (ax + t * abx)
+        dy = py - (ay + t * aby)
+        hit = (dx * dx + dy * dy <= limit).any(axis=1)
+
+        # Points already found do not need to be measured against the remaining segments
+        near[candidates[hit]] = True
+        candidates = candidates[~hit]
+
+    return near
+
+class RouteSegment:
+    """
+        purpose:
+            Run of vertices walked by one or more WalkingRoutes, scored once for all of them. Has the points,
+            line and polygon of a WalkingRoute so the IntersectionEngine and the light backends take it as one
+    """
+
+    def __init__(self, coords, polygon=None, shape=ROUTE_SHAPE):
+        """
+            parameters:
+                coords: (M,2) float array of (LON, LAT) vertices
+                polygon: optional; buffered line, when it is already known
+                shape: optional; RouteShape of the routes the segment belongs to
+        """
+
+        self.coords = coords
+        self.points = coords[:, ::-1]
+        self.line = LineString(coords)
+        self.polygon = polygon if polygon is not None else shape.buffer(self.line)
+
+def route_segments(routes):
+    """
+        purpose:
+            Split routes into the runs of vertices they share. Alternatives from Google usually walk the same
+            streets for most of their length; every run walked by the same set of routes becomes one segment,
+            so the shared parts are scored once. The segments of a route cover exactly its edges. Only routes of
+            a separable RouteShape are split, whose polygon is the union of the polygons of the segments, and only
+            among routes of the same buffer. Any other route is one segment with the polygon of the route
+        parameters:
+            routes: List of WalkingRoute objects
+        return:
+            (segments, members): List of RouteSegment objects, and the list of (segment position, forward) of every
+                                 route, where forward is False when the route walks the segment backwards
+    """
+
+    segments = []
+    members = [None] * len(routes)
+
+    # Routes split together, by resolution and distance of their buffer
+    groups = {}
+
+    for rid, route in enumerate(routes):
+        if route.shape.separable:
+            groups.setdefault((route.shape.resolution, route.shape.distance), []).append(rid)
+        else:
+            members[rid] = [(len(segments), True)]
+            segments.append(RouteSegment(route.coords, route.polygon, route.shape))
+
+    for rids in groups.values():
+        for rid, member in zip(rids, shared_runs([routes[rid] for rid in rids], segments)):
+            members[rid] = member
+
+    return segments, members
+
+def shared_runs(routes, segments):
+    """
+        purpose:
+            Cut routes into the runs of vertices walked by the same set of them, see route_segments
+        parameters:
+            routes: List of WalkingRoute objects of one separable RouteShape
+            segments: List of RouteSegment objects the new segments are appended to
+        return:
+            members: List of (segment position, forward) of every route
+    """
+
+    # Number every distinct vertex of the routes. Decoded polylines repeat shared vertices exactly
+    counts = [len(route.coords) for route in routes]
+    _, vertices = np.unique(np.concatenate([route.coords for route in routes]), axis=0, return_inverse=True)
+    vertices = np.split(vertices.ravel(), np.cumsum(counts)[:-1])
+    total = sum(counts)
+
+    # Edge between consecutive vertices, the same in either direction
+    edges = [(np.minimum(ids[:-1], ids[1:]) * total + np.maximum(ids[:-1], ids[1:])).tolist() for ids in vertices]
+
+    # Routes walking each edge
+    walkers = {}
+    for rid, route_edges in enumerate(edges):
+        for edge in route_edges:
+            walkers.setdefault(edge, set()).add(rid)
+
+    keys = {}
+    members = []
+
+    for rid, route in enumerate(routes):
+        ids = vertices[rid].tolist()
+
+        # Cut the route wherever the set of routes walking its edges changes. Runs share their end vertices
+        cuts = [i for i in range(1, len(edges[rid])) if walkers[edges[rid][i - 1]] != walkers[edges[rid][i]]]
+        bounds = [0] + cuts + [max(len(ids) - 1, 0)]
+
+        member = []
+        for start, end in zip(bounds, bounds[1:]):
+            run = tuple(ids[start:end + 1])
+
+            # The same run walked backwards is the same segment
+            key = min(run, run[::-1])
+            forward = key == run
+
+            if key not in keys:
+                coords = route.coords[start:end + 1]
+                keys[key] = len(segments)
+                segments.append(RouteSegment(coords if forward else coords[::-1], route.polygon if len(bounds) == 2 else None,
+                                             route.shape))
+
+            member.append((keys[key], forward))
+
+        members.append(member)
+
+    return members
+
+class LinearReference:
+    """
+        purpose:
+            Features in range of a line, located by their distance along it. Lights are positions on the line,
+            sidewalk and road parts are the spans of the line they run beside. Every feature is projected onto
+            the line once, then the metrics are read off the sorted positions and spans. The references of the
+            segments of a route join into the reference of the route
+        properties:
+            length - Length of the line, in degrees
+            lights - (ids, at): positions of the lights in their LightSet and their distance along the line
+            sidewalks - (ids, spans, along, sources): positions of the sidewalks in their LineSet, the (start, end)
+                        along the line of each part of them in range, the (start, end) of the part along its own
+                        sidewalk, and the position of the joined line that clipped it
+            roads - (ids, spans, along, sources): the same for the traffic volumes
+    """
+
+    def __init__(self, length, lights, sidewalks, roads):
+        self.length = length
+        self.lights = lights
+        self.sidewalks = sidewalks
+        self.roads = roads
+
+    @classmethod
+    def locate(cls, line, lights, light_ids, sidewalks, sidewalk_parts, volumes, road_parts):
+        """
+            purpose:
+                Project the features in range of a line onto it
+            parameters:
+                line: shapely LineString of (LON, LAT), e.g. of a RouteSegment
+                lights: LightSet
+                light_ids: positions in LIGHTS of the lights in range of LINE
+                sidewalks: LineSet of sidewalks
+                sidewalk_parts: List of (position, geometry) tuples of SIDEWALKS clipped to the buffer of LINE, as
+                                returned by IntersectionEngine.lines_within
+                volumes, road_parts: the same for the traffic volumes
+            return:
+                reference: LinearReference of LINE
+        """
+
+        ids = np.asarray(light_ids, dtype=np.int64)
+        at = shapely.line_locate_point(line, shapely.points(lights.coords[ids])) if len(ids) else np.zeros(0)
+
+        return cls(line.length, (ids, at), cls.__spans(line, sidewalks, sidewalk_parts), cls.__spans(line, volumes, road_parts))
+
+    @staticmethod
+    def __spans(line, features, clipped):
+        # Span of every part of the clipped features along LINE and along its own feature. Points where a
+        # feature only touches the buffer are dropped
+        if not clipped:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+
+        parts, index = shapely.get_parts([geometry for _, geometry in clipped], return_index=True)
+        lengths = shapely.length(parts)
+        keep = lengths > 0
+        parts, index, lengths = parts[keep], index[keep], lengths[keep]
+
+        ids = np.array([i for i, _ in clipped], dtype=np.int64)[index]
+        ends = (shapely.get_point(parts, 0), shapely.get_point(parts, -1))
+        lines = np.array([features.lines[i] for i in ids], dtype=object)
+
+        spans = np.sort(np.column_stack([shapely.line_locate_point(line, end) for end in ends]), axis=1)
+
+        # A part runs LENGTHS along its feature from whichever end comes first in the direction of the feature.
+        # On a ring that is the end the other one follows by about the part length, going around through the
+        # start of the ring when needed
+        total = shapely.length(lines)
+        closed = shapely.is_closed(lines)
+        first, last = (shapely.line_locate_point(lines, end) for end in ends)
+
+        forward = np.where(closed, (last - first) % np.where(closed, total, 1), last - first)
+        backward = np.where(closed, (first - last) % np.where(closed, total, 1), first - last)
+        start = np.where(np.abs(forward - lengths) <= np.abs(backward - lengths), first, last)
+
+        along = np.column_stack((start, start + lengths))
+
+        # Parts that go around through the start of a ring are measured as their two pieces
+        wrap = np.flatnonzero(closed & (along[:, 1] > total))
+        if len(wrap):
+            ids = np.concatenate((ids, ids[wrap]))
+            spans = np.concatenate((spans, spans[wrap]))
+            along = np.concatenate((along, np.column_stack((np.zeros(len(wrap)), along[wrap, 1] - total[wrap]))))
+            along[wrap, 1] = total[wrap]
+
+        return ids, spans, along, np.zeros(len(ids), dtype=np.int64)
+
+    def reversed(self):
+        """
+            purpose:
+                Reference of the same line walked from its end
+        """
+
+        def flip(layer):
+            ids, spans, along, sources = layer
+            return ids, self.length - spans[:, ::-1], along, sources
+
+        ids, at = self.lights
+
+        return LinearReference(self.length, (ids, self.length - at), flip(self.sidewalks), flip(self.roads))
+
+    @classmethod
+    def join(cls, references):
+        """
+            purpose:
+                Reference of the line made of consecutive lines, e.g. the segments of a route in walking order
+            parameters:
+                references: List of LinearReference objects
+            return:
+                reference: LinearReference
+        """
+
+        if len(references) == 1:
+            return references[0]
+
+        offsets = np.cumsum([0.0] + [reference.length for reference in references[:-1]])
+
+        lights = (np.concatenate([r.lights[0] for r in references]),
+                  np.concatenate([r.lights[1] + offset for r, offset in zip(references, offsets)]))
+
+        # Parts are tagged with the position of the line they were clipped by
+        def joined(layers):
+            return (np.concatenate([ids for ids, _, _, _ in layers]),
+                    np.concatenate([spans + offset for (_, spans, _, _), offset in zip(layers, offsets)]),
+                    np.concatenate([along for _, _, along, _ in layers]),
+                    np.concatenate([np.full(len(ids), position) for position, (ids, _, _, _) in enumerate(layers)]))
+
+        return cls(float(offsets[-1] + references[-1].length), lights,
+                   joined([r.sidewalks for r in references]), joined([r.roads for r in references]))
+
+    def light_count(self):
+        # A light near where two segments meet is in range of both
+        return len(np.unique(self.lights[0]))
+
+    def longest_unlit(self):
+        """
+            purpose:
+                Longest stretch of the line between two lights, or between an end and the closest light
+            return:
+                length: in degrees; the whole line when no light is in range
+        """
+
+        at = np.sort(np.clip(self.lights[1], 0, self.length))
+
+        return float(np.diff(np.concatenate(([0.0], at, [self.length]))).max())
+
+    def longest_without_sidewalk(self):
+        """
+            purpose:
+                Longest stretch of the line no sidewalk runs beside
+            return:
+                length: in degrees; the whole line when no sidewalk is in range
+        """
+
+        return self.__longest_gap(self.sidewalks[1])
+
+    def __longest_gap(self, spans):
+        # Longest part of [0, LENGTH] outside of every span, after sorting the spans by start
+        if len(spans) == 0:
+            return self.length
+
+        spans = spans[np.argsort(spans[:, 0], kind='stable')]
+        reach = np.maximum.accumulate(spans[:, 1])
+
+        gaps = np.concatenate(([spans[0, 0]], spans[1:, 0] - reach[:-1], [self.length - reach[-1]]))
+
+        return float(max(gaps.max(), 0.0))
+
+    def sidewalk_length(self):
+        """
+            purpose:
+                Total length of the sidewalks in range, each counted once
+            return:
+                length: in degrees
+        """
+
+        ids, lengths = self.__lengths(self.sidewalks)
+
+        return float(lengths.sum())
+
+    def traffic(self, volumes):
+        """
+            purpose:
+                Sum of the length in range of every road times its traffic volume
+            parameters:
+                volumes: LineSet the road parts were clipped from
+            return:
+                total: volume times degrees
+        """
+
+        ids, lengths = self.__lengths(self.roads)
+
+        return float((volumes.volumes[ids] * lengths).sum())
+
+    @staticmethod
+    def __lengths(layer):
+        # Length in range of each feature. Parts of one feature clipped by several segments overlap where the
+        # segments meet, so the union of the spans of those features along themselves is measured. The parts
+        # of a feature clipped by a single line never overlap and are summed
+        ids, _, along, sources = layer
+
+        if len(ids) == 0:
+            return ids, np.zeros(0)
+
+        features, owner = np.unique(ids, return_inverse=True)
+        lengths = np.bincount(owner, weights=along[:, 1] - along[:, 0], minlength=len(features))
+
+        # Features clipped by more than one line
+        lines = np.unique(np.column_stack((owner, sources)), axis=0)[:, 0]
+        shared = np.bincount(lines, minlength=len(features)) > 1
+
+        if not shared.any():
+            return features, lengths
+
+        # Spans of different features are moved apart so they can be merged in one sorted pass
+        merge = np.flatnonzero(shared[owner])
+        owner, along = owner[merge], along[merge]
+
+        shift = owner * (along.max() + 1)
+        order = np.lexsort((along[:, 0], owner))
+        starts, ends = (along[order] + shift[order, None]).T
+
+        reach = np.maximum.accumulate(ends)
+        first = np.concatenate(([True], starts[1:] > reach[:-1]))
+        blocks = np.flatnonzero(first)
+
+        lengths[shared] = np.bincount(owner[order][blocks], weights=np.maximum.reduceat(ends, blocks) - starts[blocks],
+                                      minlength=len(features))[shared]
+
+        return features, lengths
+
+class IntersectionEngine:
+    """
+        purpose:
+            Shared intersection engine for the route metrics. Each route polygon is prepared once,
+            features are rejected by envelope through a SpatialIndex, and the exact geometry checks are
+            only computed for the features that truly hit a route
+    """
+
+    def __init__(self, routes):
+        """
+            parameters:
+                routes: List of WalkingRoute objects
+        """
+
+        self.routes = routes
+
+        # Prepared polygons make the repeated intersects checks against the same route cheap
+        self.polygons = [prep(route.polygon) for route in routes]
+
+        # Clipped features per feature list, so every metric reading the same layer reuses the work
+        self.__clipped = {}
+
+    def points_within(self, rid, index):
+        """
+            purpose:
+                Find the indexed points that lie inside of a route polygon
+            parameters:
+                rid: Position of the route in ROUTES
+                index: SpatialIndex over shapely Points
+            return:
+                hits: Sorted list of positions into the index
+        """
+
+        # Envelope candidates first, then the exact check against the prepared polygon
+        return [i for i in index.query(self.routes[rid].polygon) if self.polygons[rid].contains(index.geometries[i])]
+
+    def lines_within(self, rid, index):
+        """
+            purpose:
+                Clip the indexed lines to a route polygon
+            parameters:
+                rid: Position of the route in ROUTES
+                index: SpatialIndex over shapely LineStrings
+            return:
+                clipped: List of (position, geometry) tuples, where position indexes the index and geometry is
+                         the part of the line that lies inside of the route polygon
+        """
+
+        polygon = self.routes[rid].polygon
+
+        # Envelope candidates first, then the exact check against the prepared polygon
+        return [(i, polygon.intersection(index.geometries[i])) for i in index.query(polygon)
+                    if self.polygons[rid].intersects(index.geometries[i])]
+
+    def clip(self, features):
+        """
+            purpose:
+                Clip line features to every route polygon
+            parameters:
+                features: LineSet of sidewalks or traffic volumes
+            return:
+                clipped: List per route of (position, geometry) tuples, where position indexes FEATURES and
+                         geometry is the part of the feature line that lies inside of the route polygon
+        """
+
+        key = id(features)
+        if key in self.__clipped and self.__clipped[key][0] is features:
+            return self.__clipped[key][1]
+
+        index = SpatialIndex(features.lines)
+
+        clipped = [self.lines_within(rid, index) for rid in range(len(self.routes))]
+
+        # Hold on to FEATURES as well so its id cannot be reused while cached
+        self.__clipped[key] = (features, clipped)
+
+        return clipped
+
+class RouteMetrics:
+    """
+        purpose:
+            Safety metrics of a single WalkingRoute, as computed by RatingAlgorithms.compute_all
+        properties:
+            route - WalkingRoute the metrics belong to
+            lights - Lights per km
+            sidewalks - Sidewalk availability ratio (Sidewalk distance/route distance)
+            traffic - Average daily traffic, weighted
+            dark_gap - Longest stretch of the route without a light in range, in km. None when unknown
+            sidewalk_gap - Longest stretch of the route without a sidewalk beside it, in km. None when unknown
+    """
+
+    def __init__(self, route, lights, sidewalks, traffic, dark_gap=None, sidewalk_gap=None):
+        self.route = route
+        self.lights = lights
+        self.sidewalks = sidewalks
+        self.traffic = traffic
+        self.dark_gap = dark_gap
+        self.sidewalk_gap = sidewalk_gap
+
+    def to_json(self):
+        """
+            purpose:
+                Format the metrics the way /api/calc_rating returns them
+        """
+
+        return {"polyline": str(self.route.polyline),
+                "lights": self.lights,
+                "sidewalks": self.sidewalks,
+                "traffic": self.traffic,
+                "dark_gap": self.dark_gap,
+                "sidewalk_gap": self.sidewalk_gap,
+                "duration": self.route.duration,
+                "distance": self.route.distance}
+
+    # String format
+    def __str__(self):
+        return '{:.2f} lights/km, {:.2f}% sidewalk availability, and {:.2f} cars per day on average'\
+                .format(self.lights, self.sidewalks*100, self.traffic)
+
+    # Representative format
+    def __repr__(self):
+        return 'RouteMetrics( {} )'.format(str(self))
+
 class RatingAlgorithms:
-    def __init__(self):
-        pass
+    def __init__(self, light_backend='polygon'):
+        """
+            parameters:
+                light_backend: optional; default 'polygon'. How lights are matched to routes
+                    'polygon' - lights are tested against the buffered route polygon through a SpatialIndex
+                    'numpy' - the distance from every light to the route line is measured with vectorized array math
+        """
+
+        if light_backend not in LIGHT_BACKENDS:
+            raise ValueError('Unknown light backend {}, expected one of {}'.format(light_backend, LIGHT_BACKENDS))
+
+        self.light_backend = light_backend
+
+    def __light_locator(self, lights, engine, index=None):
+        """
+            purpose:
+                Prepare LIGHTS once for the configured light backend
+            parameters:
+                lights: LightSet
+                engine: IntersectionEngine built for the routes
+                index: optional; SpatialIndex over the points of LIGHTS, only used by the polygon backend
+            return:
+                locate: function taking a route position and returning the sorted positions of the lights in range
+        """
+
+        if self.light_backend == 'numpy':
+            coords = lights.coords
+            return lambda rid: np.flatnonzero(points_near_polyline(coords, route_vertices(engine.routes[rid]), POLYGON_BUFFER)).tolist()
+
+        # Bulk load the lights once so each route only tests the lights near it
+        if index is None:
+            index = SpatialIndex(lights.points)
+
+        return lambda rid: engine.points_within(rid, index)
 
-    def street_light_density(self, routes, lights, verbose=False):
+    def compute_all(self, routes, lights, sidewalks, volumes, light_counts=None):
+        """
+            purpose:
+                Calculate every safety metric for each given route. Routes are split into the segments they share,
+                see route_segments, and every segment is scored once. Features are indexed and segment polygons
+                are prepared once, then shared by all three metrics
+            parameters:
+                routes: List of WalkingRoute objects
+                lights: LightSet
+                sidewalks: LineSet of sidewalks
+                volumes: LineSet of traffic volumes
+                light_counts: optional; number of lights in range of each route, e.g. counted by the server with
+                              OpenDataLondon.count_corridor. When given LIGHTS is not searched
+            return:
+                metrics: List of RouteMetrics, one per route
+        """
+
+        # Shared stretches of the routes are scored once
+        segments, members = route_segments(routes)
+        engine = IntersectionEngine(segments)
+
+        segment_lights = [()] * len(segments)
+        if light_counts is None:
+            locate_lights = self.__light_locator(lights, engine)
+            segment_lights = [locate_lights(sid) for sid in range(len(segments))]
+
+        sidewalk_index = SpatialIndex(sidewalks.lines)
+        volume_index = SpatialIndex(volumes.lines)
+
+        # Every feature in range of a segment is located along it once
+        references = [LinearReference.locate(segment.line, lights, segment_lights[sid], sidewalks, engine.lines_within(sid, sidewalk_index),
+                                             volumes, engine.lines_within(sid, volume_index))
+                          for sid, segment in enumerate(segments)]
+
+        metrics = []
+
+        for rid, route in enumerate(routes):
+
+            reference = LinearReference.join([references[sid] if forward else references[sid].reversed()
+                                                  for sid, forward in members[rid]])
+
+            # Degrees along the route line to km
+            km = route.distance / route.line.length
+
+            # Lights per km, and the longest dark stretch unless only the counts are known
+            if light_counts is not None:
+                light_density = light_counts[rid] / route.distance
+                dark_gap = None
+            else:
+                light_density = reference.light_count() / route.distance
+                dark_gap = reference.longest_unlit() * km
+
+            # Sidewalk length / route length
+            sidewalk_density = reference.sidewalk_length() / route.line.length
+            sidewalk_gap = reference.longest_without_sidewalk() * km
+
+            # Road volumes weighted by how much of the route each road covers
+            volume_density = reference.traffic(volumes) / route.line.length
+
+            metrics.append(RouteMetrics(route, light_density, sidewalk_density, volume_density, dark_gap, sidewalk_gap))
+
+        return metrics
+
+    def compute_grid(self, routes, grid):
+        """
+            purpose:
+                Same metrics as compute_all, read from a precomputed SafetyGrid instead of the features. Each
+                route sums the cells of its corridor, so no features are needed and the cost only depends on
+                the length of the route
+            parameters:
+                routes: List of WalkingRoute objects
+                grid: SafetyGrid object
+            return:
+                metrics: List of RouteMetrics, one per route
+        """
+
+        metrics = []
+
+        for route in routes:
+            light_count, sidewalk_len, volume_len = grid.totals(route_vertices(route))
+
+            metrics.append(RouteMetrics(route, light_count / route.distance, sidewalk_len / route.line.length,
+                                        volume_len / route.line.length))
+
+        return metrics
+
+    def street_light_density(self, routes, lights, verbose=False, index=None, engine=None):
         """
             purpose:
                 Calculate the traffic light density per km for each given route
             parameters:
                 routes: List of WalkingRoute objects
-                lights: List of StreetLight objects
+                lights: LightSet
                 verbose: optional; default False. If true, function returns all relevant data for debugging
+                index: optional; SpatialIndex over the points of LIGHTS. Pass one in to reuse it across calls with the polygon backend
+                engine: optional; IntersectionEngine built for ROUTES. Pass one in to share it with the other metrics
             return:
                 density: List of floats that represent lights/pm for each WalkingRoute
                 inrange: List of StreetLight objects that were in range of WalkingRoute
@@ -35,18 +698,22 @@ class RatingAlgorithms:
         # List of light densities
         density = [0] * len(routes)
 
+        if engine is None:
+            engine = IntersectionEngine(routes)
+
+        locate_lights = self.__light_locator(lights, engine, index)
+
         for rid, route in enumerate(routes):
-            
-            # For each route, iterate over all the walking routes
-            for light in lights:
 
-                if light.coord.point.within(route.polygon):
-                    inrange[rid].append(light)
-                else:
-                    outrange[rid].append(light)
+            hits = locate_lights(rid)
+
+            if verbose:
+                hit_set = set(hits)
+                inrange[rid] = [lights[i] for i in hits]
+                outrange[rid] = [lights[i] for i in range(len(lights)) if i not in hit_set]
 
             # calculate the density of lights based on length of routes and lights in range
-            density[rid] = len(inrange[rid]) / route.distance
+            density[rid] = len(hits) / route.distance
             
         if not verbose:
             return density
@@ -54,7 +721,7 @@ class RatingAlgorithms:
             return density, inrange, outrange
 
     # Percentage of path that has sidewalks
-    def sidewalk_density(self, routes, sidewalks, verbose=False):
+    def sidewalk_density(self, routes, sidewalks, verbose=False, engine=None):
         """
             purpose:
                 Calculate the ratio of available sidewalk coverage for each given route
@@ -65,8 +732,9 @@ class RatingAlgorithms:
                 A ratio of 2 means that the entire route has sidewalk coverage on both sides
             parameters:
                 routes: List of WalkingRoute objects
-                sidewalks: List of Sidewalk objects
+                sidewalks: LineSet of sidewalks
                 verbose: optional; default False. If true, function returns all relevant data for debugging
+                engine: optional; IntersectionEngine built for ROUTES. Pass one in to share it with traffic_density
             return:
                 ratio: List of floats that represent lights/pm for each WalkingRoute
                 total_len: List of floats that represent the total length of sidewalk in each route
@@ -89,25 +757,25 @@ class RatingAlgorithms:
         # List of sublists of Sidewalk objects that indiciate which sidewalks were out of range for what route
         outrange = [[] for _ in routes]
 
-        for rid, route in enumerate(routes):
+        if engine is None:
+            engine = IntersectionEngine(routes)
 
-            # For each route, iterate over all Sidewalk objects
-            for sidewalk in sidewalks:
-                
-                # Check to see if the sidewalk intersects the route at all
-                if route.polygon.intersects(sidewalk.line):
+        # Sidewalk line subsegments that reside within each route polygon
+        clipped = engine.clip(sidewalks)
 
-                    # Calculate the sidewalk line subsegment that resides within the route polygon
-                    sidewalk_in_route = route.polygon.intersection(sidewalk.line)
+        for rid, route in enumerate(routes):
 
-                    # Track the subsegment
-                    inrange[rid].append(sidewalk_in_route)
+            for _, sidewalk_in_route in clipped[rid]:
 
-                    # Accumulate total sidewalk length
-                    total_len[rid] += sidewalk_in_route.length
+                # Track the subsegment
+                inrange[rid].append(sidewalk_in_route)
 
-                else:
-                    outrange[rid].append(sidewalk.line)
+                # Accumulate total sidewalk length
+                total_len[rid] += sidewalk_in_route.length
+
+            if verbose:
+                hit_set = set(i for i, _ in clipped[rid])
+                outrange[rid] = [line for i, line in enumerate(sidewalks.lines) if i not in hit_set]
             
             # Ratio calculation; total sidewalk length / total route length
             ratio[rid] = (total_len[rid] / route.line.length)
@@ -117,15 +785,16 @@ class RatingAlgorithms:
         else:
             return ratio, total_len, inrange, outrange
 
-    def traffic_density(self, routes, roads, verbose=False):
+    def traffic_density(self, routes, roads, verbose=False, engine=None):
         """
             purpose:
                 Calculates the average daily traffic for each route based on the traffic entities
                 Simple weighted average calculation
             parameters:
                 routes: List of WalkingRoute objects
-                sidewalks: List of TrafficVolume objects
+                sidewalks: LineSet of traffic volumes
                 verbose: optional; default False. If true, will also return debugging information
+                engine: optional; IntersectionEngine built for ROUTES. Pass one in to share it with sidewalk_density
             return:
                 avg_volumes: list of floats representing the average traffic per day of each route
                 inrange: list of TrafficVolumes that are within range of each route
@@ -141,26 +810,25 @@ class RatingAlgorithms:
         # List of sublists of TrafficVolume objects that indiciate which sidewalks were in range for what route
         inrange = [[] for _ in routes]
 
-        for rid, route in enumerate(routes):
+        if engine is None:
+            engine = IntersectionEngine(routes)
 
-            # For each route, iterate over all traffic volumes
-            for road in roads:
-                
-                # Check to see if the road intersects the route at all
-                if route.polygon.intersects(road.line):
+        # Road line subsegments that reside within each route polygon
+        clipped = engine.clip(roads)
+
+        for rid, route in enumerate(routes):
 
-                    # Calculate the road line subsegment that resides within the route polygon
-                    road_in_route = route.polygon.intersection(road.line)
+            for i, road_in_route in clipped[rid]:
 
-                    inrange.append(road_in_route)
+                inrange[rid].append(road_in_route)
 
-                    # Calculate how much of the route the road covers
-                    route_ratio = road_in_route.length / route.line.length
+                # Calculate how much of the route the road covers
+                route_ratio = road_in_route.length / route.line.length
 
-                    # Calculate average volume for road subsegment based on road volume and ratio
-                    avg_volumes[rid] += road.volume * route_ratio
+                # Calculate average volume for road subsegment based on road volume and ratio
+                avg_volumes[rid] += roads.volumes[i] * route_ratio
 
         if not verbose:
             return avg_volumes
         else:
-            return avg_volumes, inrange
\ No newline at end of file
+            return avg_volumes, inrange
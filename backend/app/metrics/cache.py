@@ -0,0 +1,333 @@
+"""
+    file:
+        cache.py
+    purpose:
+        In memory caches shared by the metrics module
+"""
+
+import hashlib
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+class LRUCache:
+    """
+        purpose:
+            Thread safe least recently used cache with an optional time to live and size bound. Counters for
+            hits, misses and evictions are kept so the cache can be monitored
+    """
+
+    def __init__(self, ttl=None, max_entries=None, max_bytes=None, sizeof=None):
+        """
+            parameters:
+                ttl: optional; seconds an entry stays valid. None keeps entries until they are evicted
+                max_entries: optional; maximum number of entries
+                max_bytes: optional; maximum total size of the entries, as measured by SIZEOF
+                sizeof: optional; function returning the size of a value in bytes. Required with MAX_BYTES
+        """
+
+        if max_bytes is not None and sizeof is None:
+            raise ValueError('max_bytes requires a sizeof function')
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        # key -> (value, time stored, size); ordered from least to most recently used
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __expired(self, stored):
+        return self.ttl is not None and time.monotonic() - stored > self.ttl
+
+    def __remove(self, key):
+        _, _, size = self.__entries.pop(key)
+        self.nbytes -= size
+
+    def get(self, key, default=None):
+        """
+            purpose:
+                Look up KEY, marking it as most recently used
+            return:
+                The cached value, or DEFAULT if KEY is missing or expired
+        """
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            if self.__expired(entry[1]):
+                self.__remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value):
+        """
+            purpose:
+                Store VALUE under KEY, evicting the least recently used entries to stay within bounds
+        """
+
+        size = self.sizeof(value) if self.sizeof else 0
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+
+            # A value larger than the whole cache is never stored
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self.__entries[key] = (value, time.monotonic(), size)
+            self.nbytes += size
+
+            while (self.max_entries is not None and len(self.__entries) > self.max_entries) or \
+                  (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+            purpose:
+                Snapshot of the cache counters
+        """
+
+        with self.__lock:
+            return {'entries': len(self.__entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations}
+
+    def __contains__(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry is not None and not self.__expired(entry[1])
+
+    def __len__(self):
+        return len(self.__entries)
+
+class DirectionsCache:
+    """
+        purpose:
+            Cache of walking directions keyed by origin and destination rounded to a precision, so requests for
+            nearly the same trip share one Directions call. Entries older than TTL are still served for STALE
+            more seconds while a background refresh replaces them. Callers that miss a trip while it is being
+            fetched wait for that fetch instead of starting their own
+    """
+
+    def __init__(self, ttl=60 * 60, stale=24 * 60 * 60, max_entries=1024, precision=4):
+        """
+            parameters:
+                ttl: optional; seconds an entry is served without refreshing it
+                stale: optional; seconds after TTL the entry is still served while it is refreshed
+                max_entries: optional; maximum number of cached trips
+                precision: optional; decimal places coordinates are rounded to. 4 is about 10 m
+        """
+
+        self.ttl = ttl
+        self.precision = precision
+
+        # key -> (value, time fetched), dropped for good once even the stale window is over
+        self.entries = LRUCache(ttl=ttl + stale, max_entries=max_entries)
+
+        # Keys being refreshed in the background, and the Future of the value of keys fetched on a miss
+        self.__refreshing = set()
+        self.__fetching = {}
+        self.__lock = Lock()
+
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.waits = 0
+
+    def key(self, from_loc, to_loc):
+        """
+            purpose:
+                Cache key of a trip
+            parameters:
+                from_loc, to_loc: (LAT, LON) or an address, see GMapsAPI.walking_routes
+            return:
+                key: tuple; addresses are keyed by their text, case and spacing ignored
+        """
+
+        def location(loc):
+            if isinstance(loc, str):
+                return ' '.join(loc.lower().split())
+            return tuple(round(float(value), self.precision) for value in loc)
+
+        return location(from_loc), location(to_loc)
+
+    def get(self, key, fetch):
+        """
+            purpose:
+                Look up KEY, calling FETCH on a miss unless another caller already is. A stale entry is returned
+                as it is and refreshed in a background thread
+            parameters:
+                key: see key
+                fetch: function without arguments returning the value, or None when it failed
+            return:
+                value: cached or fetched value, None if FETCH failed. Failures are not cached
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return self.__fetch(key, fetch)
+
+        value, fetched = entry
+
+        if time.monotonic() - fetched > self.ttl:
+            self.__refresh(key, fetch)
+
+        return value
+
+    def __fetch(self, key, fetch):
+        # The first caller to miss KEY fetches it, the others wait for its value
+        with self.__lock:
+            waiting = self.__fetching.get(key)
+
+            if waiting is not None:
+                self.waits += 1
+            else:
+                # Stored by a fetch that finished since the lookup
+                entry = self.entries.get(key) if key in self.entries else None
+                if entry is not None:
+                    return entry[0]
+
+                future = self.__fetching[key] = Future()
+
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            value = fetch()
+            if value is not None:
+                self.entries.put(key, (value, time.monotonic()))
+
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                del self.__fetching[key]
+
+    def __refresh(self, key, fetch):
+        # Start one background refresh per key; a failed refresh keeps the stale entry
+        with self.__lock:
+            self.stale_hits += 1
+
+            if key in self.__refreshing:
+                return
+            self.__refreshing.add(key)
+            self.refreshes += 1
+
+        def refresh():
+            try:
+                value = fetch()
+                if value is not None:
+                    self.entries.put(key, (value, time.monotonic()))
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(key)
+
+        Thread(target=refresh, daemon=True).start()
+
+    def stats(self):
+        """
+            purpose:
+                Snapshot of the cache counters
+        """
+
+        return dict(self.entries.stats(), stale_hits=self.stale_hits, refreshes=self.refreshes, waits=self.waits)
+
+class MetricsCache:
+    """
+        purpose:
+            Least recently used cache of the metrics of each route, keyed by a hash of its polyline. Entries are
+            tied to the version of the OpenData they were computed from and are all dropped once it changes
+    """
+
+    def __init__(self, max_entries=4096, ttl=None):
+        """
+            parameters:
+                max_entries: optional; maximum number of routes
+                ttl: optional; seconds an entry stays valid. Set it to the lifetime of the data when the source
+                     has no version, like the live OpenData server
+        """
+
+        self.entries = LRUCache(ttl=ttl, max_entries=max_entries)
+
+        # Data version of the cached entries
+        self.version = None
+        self.__lock = Lock()
+
+    @staticmethod
+    def key(route):
+        # Polylines are long; their digest is a compact key
+        return hashlib.sha1(route.polyline.encode('utf-8')).hexdigest()
+
+    def __check_version(self, version):
+        # Drop every entry computed from other data
+        with self.__lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def get(self, route, version=None):
+        """
+            purpose:
+                Look up the metrics of a route
+            parameters:
+                route: WalkingRoute object
+                version: optional; version of the data the caller would compute the metrics from
+            return:
+                (lights, sidewalks, traffic, dark_gap, sidewalk_gap), or None if not cached for VERSION
+        """
+
+        self.__check_version(version)
+
+        return self.entries.get(self.key(route))
+
+    def put(self, route, metrics, version=None):
+        """
+            purpose:
+                Store the metrics of a route
+            parameters:
+                route: WalkingRoute object
+                metrics: RouteMetrics of ROUTE
+                version: optional; version of the data they were computed from. Ignored unless it is the
+                         version of the last get
+        """
+
+        # Metrics of data that was replaced meanwhile are not worth keeping
+        with self.__lock:
+            if version != self.version:
+                return
+
+            self.entries.put(self.key(route), (metrics.lights, metrics.sidewalks, metrics.traffic,
+                                               metrics.dark_gap, metrics.sidewalk_gap))
+
+    def stats(self):
+        return dict(self.entries.stats(), version=self.version)
@@ -0,0 +1,274 @@
+"""
+    file:
+        geocode.py
+    purpose:
+        Persistent store of geocoded addresses that sits in front of the Google geocoder. Every known address is
+        also kept in a sorted in memory index, so lookups, including of address prefixes, never leave the process.
+        Prefixes are only matched against preloaded address points, which cover every address of the city
+
+        Preload the address points of an OpenData layer from the backend directory:
+            python -m app.metrics.geocode geocode.sqlite --preload LAYER_URL
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+
+from bisect import bisect_left, insort
+from itertools import islice
+from threading import Lock
+
+from app.metrics.util import PooledSession
+
+# Source of the addresses geocoded by Google, as opposed to the layer URL of preloaded address points
+GOOGLE_SOURCE = 'google'
+
+# Features requested per page, below the 1000 element request limit
+PAGE_SIZE = 500
+
+# Address fields of an OpenData address point layer, joined in this order
+ADDRESS_FIELDS = ('ADDRESS',)
+
+# Long forms of the street types and directions, and the short form they are stored as
+ABBREVIATIONS = {
+    'street': 'st', 'road': 'rd', 'avenue': 'ave', 'drive': 'dr', 'crescent': 'cres', 'court': 'crt',
+    'boulevard': 'blvd', 'place': 'pl', 'lane': 'ln', 'terrace': 'terr', 'parkway': 'pkwy', 'circle': 'cir',
+    'highway': 'hwy', 'square': 'sq', 'gate': 'gt', 'heights': 'hts', 'trail': 'trl',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+}
+
+# Trailing parts of an address that do not help to tell London addresses apart
+TRAILING = re.compile(r'([,\s]+(london|ontario|on|canada|[a-z]\d[a-z]\s*\d[a-z]\d))+\s*$')
+
+def normalize(address):
+    """
+        purpose:
+            Reduce an address to the form it is stored under: lower case, no punctuation, single spaces, short
+            street types and directions, without city, province, country or postal code
+        parameters:
+            address: address string
+        return:
+            address: normalized string, empty if nothing is left
+    """
+
+    address = TRAILING.sub('', address.lower().strip())
+    words = re.sub(r'[^\w\s]', ' ', address).split()
+
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+class GeocodeStore:
+    """
+        purpose:
+            SQLite file of normalized address to (LAT, LON), with every row also held in memory. Safe to share
+            between threads
+    """
+
+    def __init__(self, path):
+        """
+            parameters:
+                path: SQLite file, created when missing. ':memory:' keeps the store in memory only
+        """
+
+        self.path = path
+
+        # One connection shared by every thread, used under the lock
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS addresses (address TEXT PRIMARY KEY, lat REAL, lng REAL, source TEXT)')
+        self.__db.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+        rows = list(self.__db.execute('SELECT address, lat, lng, source FROM addresses'))
+
+        # address -> (LAT, LON), and the addresses sorted for prefix lookups. Google only geocodes the addresses
+        # asked for, so only preloaded addresses tell whether a prefix is ambiguous
+        self.__locations = {address: (lat, lng) for address, lat, lng, _ in rows}
+        self.__sorted = sorted(self.__locations)
+        self.__preloaded = sorted(address for address, _, _, source in rows if source != GOOGLE_SOURCE)
+
+    def get(self, address):
+        """
+            purpose:
+                Look up an address. When it is not known as it is, it may still be the prefix of the preloaded
+                addresses of exactly one location, e.g. without the street type
+            parameters:
+                address: address string, normalized here
+            return:
+                (LAT, LON), or None when it is unknown or ambiguous
+        """
+
+        key = normalize(address)
+
+        with self.__lock:
+            location = self.__locations.get(key)
+
+            if location is None and key:
+                # Stop at the second location, units of one building share theirs
+                candidates = set()
+                for match in self.__starting(self.__preloaded, key + ' '):
+                    candidates.add(self.__locations[match])
+                    if len(candidates) > 1:
+                        break
+
+                location = candidates.pop() if len(candidates) == 1 else None
+
+            if location is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return location
+
+    def complete(self, prefix, limit=10):
+        """
+            purpose:
+                Known addresses that start with PREFIX, e.g. to suggest addresses while one is typed
+            parameters:
+                prefix: start of an address, normalized here
+                limit: optional; maximum number of addresses returned
+            return:
+                addresses: sorted list of normalized addresses
+        """
+
+        with self.__lock:
+            return list(islice(self.__starting(self.__sorted, normalize(prefix)), limit))
+
+    @staticmethod
+    def __starting(addresses, prefix):
+        # Addresses of the sorted list ADDRESSES that start with PREFIX, in order
+        for i in range(bisect_left(addresses, prefix), len(addresses)):
+            if not addresses[i].startswith(prefix):
+                break
+            yield addresses[i]
+
+    def put(self, address, lat, lng, source=GOOGLE_SOURCE):
+        """
+            purpose:
+                Store the location of an address
+            parameters:
+                address: address string, normalized here
+                lat, lng: location in decimal degrees
+                source: optional; where the location comes from
+        """
+
+        self.put_many([(address, lat, lng)], source)
+
+    def put_many(self, rows, source):
+        """
+            purpose:
+                Store the locations of many addresses in one transaction
+            parameters:
+                rows: iterable of (address, LAT, LON)
+                source: where the locations come from
+        """
+
+        rows = [(normalize(address), float(lat), float(lng), source) for address, lat, lng in rows]
+        rows = [row for row in rows if row[0]]
+
+        with self.__lock:
+            self.__db.executemany('INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?)', rows)
+            self.__db.commit()
+
+            new = {address for address, _, _, _ in rows if address not in self.__locations}
+
+            for address, lat, lng, _ in rows:
+                self.__locations[address] = (lat, lng)
+
+            self.__sorted = self.__insert(self.__sorted, new)
+
+            # Rows replace the ones stored before, and with them their source
+            known = {address for address, _, _, _ in rows if self.__find(self.__preloaded, address) is not None}
+
+            if source == GOOGLE_SOURCE:
+                for address in known:
+                    del self.__preloaded[self.__find(self.__preloaded, address)]
+            else:
+                self.__preloaded = self.__insert(self.__preloaded, {address for address, _, _, _ in rows} - known)
+
+    @staticmethod
+    def __find(addresses, address):
+        # Position of ADDRESS in the sorted list ADDRESSES, None when it is not in it
+        i = bisect_left(addresses, address)
+
+        return i if i < len(addresses) and addresses[i] == address else None
+
+    @staticmethod
+    def __insert(addresses, new):
+        # Insert a few addresses in place, sort again after bulk loads
+        if len(new) > 100:
+            return sorted(set(addresses).union(new))
+
+        for address in new:
+            insort(addresses, address)
+
+        return addresses
+
+    def preload(self, layer_url, fields=ADDRESS_FIELDS, session=None, page_size=PAGE_SIZE, verbose=False):
+        """
+            purpose:
+                Store every address point of an ArcGIS layer, e.g. the OpenData address points of the city
+            parameters:
+                layer_url: URL of the layer, ending in its layer ID
+                fields: optional; attribute fields that make up the address, joined with spaces
+                session: optional; PooledSession to query with
+                page_size: optional; number of features per request
+                verbose: optional; default False. If true, progress is printed
+            return:
+                count: number of addresses stored
+        """
+
+        session = session if session is not None else PooledSession()
+
+        # Every ID is listed up front, then the features are requested in pages of IDs
+        api_result = session.get('{}/query?where=1%3D1&returnIdsOnly=true&f=json'.format(layer_url))
+        ids = sorted(json.loads(api_result.text).get('objectIds') or [])
+
+        count = 0
+
+        for i in range(0, len(ids), page_size):
+            api_result = session.post('{}/query'.format(layer_url), data={
+                'objectIds': ','.join(str(object_id) for object_id in ids[i:i + page_size]),
+                'outFields': ','.join(fields),
+                'outSR': 4326,
+                'f': 'json',
+            })
+
+            rows = []
+            for feature in json.loads(api_result.text).get('features', []):
+                parts = [feature['attributes'].get(field) for field in fields]
+                address = ' '.join(str(part) for part in parts if part not in (None, ''))
+
+                if address and feature.get('geometry'):
+                    rows.append((address, feature['geometry']['y'], feature['geometry']['x']))
+
+            self.put_many(rows, layer_url)
+            count += len(rows)
+
+            if verbose:
+                print('{} of {} address points'.format(min(i + page_size, len(ids)), len(ids)))
+
+        return count
+
+    def stats(self):
+        with self.__lock:
+            return {'addresses': len(self.__locations), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self.__locations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fill a geocode store')
+    parser.add_argument('path', help='SQLite file of the store, e.g. geocode.sqlite')
+    parser.add_argument('--preload', metavar='LAYER_URL', help='ArcGIS layer of address points to store')
+    parser.add_argument('--fields', default=','.join(ADDRESS_FIELDS), help='Comma separated address fields of the layer')
+    args = parser.parse_args()
+
+    store = GeocodeStore(args.path)
+
+    if args.preload:
+        store.preload(args.preload, args.fields.split(','), verbose=True)
+
+    print('{} addresses in {}'.format(len(store), args.path))
@@ -0,0 +1,231 @@
+"""
+    file:
+        grid.py
+    purpose:
+        City wide safety grid. Street lights, sidewalks and traffic volumes are rasterised once into square cells,
+        so a route is scored by summing the cells along it: the cost depends on the length of the route only,
+        and no features are fetched at request time
+
+        Build a grid from the backend directory: python -m app.metrics.grid grid.npz [--snapshot snapshot.npz]
+"""
+
+import argparse
+
+import numpy as np
+
+from app.metrics.util import POLYGON_BUFFER
+
+# Side of a cell in degrees. Half the route buffer keeps the corridor of cells close to the buffer itself
+GRID_CELL = POLYGON_BUFFER / 2
+
+# Cells of margin around the extent of the data
+GRID_MARGIN = 8
+
+def _segments(lines):
+    """
+        purpose:
+            Segments of every line of a LineSet
+        return:
+            (starts, ends, owners): (S,2) float arrays of the segment ends and the (S,) line of each segment
+    """
+
+    coords = lines.coords
+
+    # Every vertex starts a segment except the last of each line
+    counts = np.diff(lines.offsets)
+    owners = np.repeat(np.arange(len(lines)), counts)
+    last = np.zeros(len(coords), dtype=bool)
+    last[lines.offsets[1:][counts > 0] - 1] = True
+
+    starts = np.flatnonzero(~last)
+
+    return coords[starts], coords[starts + 1], owners[starts]
+
+class SafetyGrid:
+    """
+        purpose:
+            Per cell totals of the OpenData layers over a fixed grid
+        properties:
+            origin - (LON, LAT) of the south west corner of cell (0, 0)
+            cell - Side of a cell in degrees
+            lights - (rows, cols) array of the street lights in each cell
+            sidewalks - (rows, cols) array of the sidewalk length in each cell, in degrees
+            traffic - (rows, cols) array of the traffic volume times road length in each cell, in degrees
+            version - Version of the data the grid was built from
+    """
+
+    def __init__(self, origin, cell, lights, sidewalks, traffic, version):
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.cell = float(cell)
+        self.lights = lights
+        self.sidewalks = sidewalks
+        self.traffic = traffic
+        self.version = version
+
+    @property
+    def shape(self):
+        return self.lights.shape
+
+    def cells_of(self, points):
+        """
+            purpose:
+                Cells of points
+            parameters:
+                points: (N,2) float array of (LON, LAT)
+            return:
+                (rows, cols): (N,) int arrays, clipped to the grid
+        """
+
+        cols = np.floor((points[:, 0] - self.origin[0]) / self.cell).astype(np.int64)
+        rows = np.floor((points[:, 1] - self.origin[1]) / self.cell).astype(np.int64)
+
+        return np.clip(rows, 0, self.shape[0] - 1), np.clip(cols, 0, self.shape[1] - 1)
+
+    @classmethod
+    def build(cls, snapshot, cell=GRID_CELL):
+        """
+            purpose:
+                Rasterise the layers of a snapshot. Lights are counted in the cell they fall in; lines are cut
+                into pieces shorter than half a cell and each piece adds its length to its cell
+            parameters:
+                snapshot: Snapshot object
+                cell: optional; side of a cell in degrees
+            return:
+                grid: SafetyGrid object
+        """
+
+        lights, sidewalks, volumes = snapshot.lights, snapshot.sidewalks, snapshot.volumes
+
+        # Extent of all the data, with a margin so routes at the edge still have cells around them
+        coords = np.concatenate([lights.coords, sidewalks.coords, volumes.coords])
+        low = coords.min(axis=0) - GRID_MARGIN * cell
+        high = coords.max(axis=0) + GRID_MARGIN * cell
+
+        shape = tuple(np.ceil((high - low) / cell).astype(int)[::-1])
+
+        grid = cls(low, cell, np.zeros(shape, dtype=np.int32), np.zeros(shape, dtype=np.float32),
+                   np.zeros(shape, dtype=np.float32), snapshot.version)
+
+        np.add.at(grid.lights, grid.cells_of(lights.coords), 1)
+
+        for totals, lines, weights in ((grid.sidewalks, sidewalks, None), (grid.traffic, volumes, volumes.volumes)):
+            starts, ends, owners = _segments(lines)
+            lengths = np.hypot(*(ends - starts).T)
+
+            # Pieces per segment and the middle of each piece
+            pieces = np.maximum(np.ceil(lengths / (cell / 2)), 1).astype(np.int64)
+            segment = np.repeat(np.arange(len(starts)), pieces)
+            t = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces) + 0.5) / pieces[segment]
+
+            middles = starts[segment] + (ends - starts)[segment] * t[:, None]
+            piece_lengths = (lengths / pieces)[segment]
+
+            if weights is not None:
+                piece_lengths = piece_lengths * weights[owners[segment]]
+
+            np.add.at(totals, grid.cells_of(middles), piece_lengths)
+
+        return grid
+
+    def corridor(self, vertices, distance=POLYGON_BUFFER):
+        """
+            purpose:
+                Cells whose centre lies within DISTANCE of a polyline, the grid version of its buffer. Only the
+                cells around the polyline are looked at
+            parameters:
+                vertices: (M,2) float array of (LON, LAT)
+                distance: optional; buffer distance in degrees
+            return:
+                (rows, cols): (K,) int arrays of unique cells
+        """
+
+        # A single vertex is a zero length segment
+        starts = vertices[:-1] if len(vertices) > 1 else vertices
+        ends = vertices[1:] if len(vertices) > 1 else vertices
+
+        # Points along every segment no more than a cell apart, from its start up to and including its end
+        lengths = np.hypot(*(ends - starts).T)
+        steps = np.maximum(np.ceil(lengths / self.cell), 1).astype(np.int64) + 1
+        segment = np.repeat(np.arange(len(starts)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / (steps[segment] - 1)
+        samples = starts[segment] + (ends - starts)[segment] * t[:, None]
+
+        # Window of cells around each sample, wide enough for the buffer. A cell within DISTANCE of a segment is
+        # in the window of one of the samples of that segment, so it is only measured against that segment
+        reach = int(np.ceil(distance / self.cell)) + 1
+        window = np.arange(-reach, reach + 1)
+        rows, cols = self.cells_of(samples)
+
+        rows = (rows[:, None, None] + window[None, :, None]).repeat(len(window), axis=2).reshape(len(samples), -1)
+        cols = (cols[:, None, None] + window[None, None, :]).repeat(len(window), axis=1).reshape(len(samples), -1)
+        segment = np.repeat(segment, rows.shape[1])
+        rows, cols = rows.ravel(), cols.ravel()
+
+        # Distance from each cell centre to its segment
+        cx = self.origin[0] + (cols + 0.5) * self.cell
+        cy = self.origin[1] + (rows + 0.5) * self.cell
+        ax, ay = starts[segment, 0], starts[segment, 1]
+        abx, aby = ends[segment, 0] - ax, ends[segment, 1] - ay
+
+        length2 = abx * abx + aby * aby
+        t = np.clip(((cx - ax) * abx + (cy - ay) * aby) / np.where(length2 > 0, length2, 1), 0, 1)
+        near = (cx - ax - t * abx) ** 2 + (cy - ay - t * aby) ** 2 <= distance * distance
+
+        near &= (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+
+        cells = np.unique(rows[near] * self.shape[1] + cols[near])
+
+        return np.divmod(cells, self.shape[1])
+
+    def totals(self, vertices, distance=POLYGON_BUFFER):
+        """
+            purpose:
+                Sum the cells of a route corridor
+            parameters:
+                vertices: (M,2) float array of (LON, LAT) of the route
+                distance: optional; buffer distance in degrees
+            return:
+                (lights, sidewalk length, traffic weighted length)
+        """
+
+        rows, cols = self.corridor(vertices, distance)
+
+        return int(self.lights[rows, cols].sum()), float(self.sidewalks[rows, cols].sum()), float(self.traffic[rows, cols].sum())
+
+    def save(self, path):
+        """
+            purpose:
+                Write the grid as one numpy archive; empty cells compress to almost nothing
+        """
+
+        np.savez_compressed(path, origin=np.array(self.origin), cell=np.array(self.cell), lights=self.lights,
+                            sidewalks=self.sidewalks, traffic=self.traffic, version=np.array(self.version))
+
+    @classmethod
+    def load(cls, path):
+        """
+            purpose:
+                Read a grid written by save
+        """
+
+        with np.load(path) as data:
+            return cls(data['origin'], data['cell'], data['lights'], data['sidewalks'], data['traffic'], str(data['version']))
+
+    def __repr__(self):
+        return 'SafetyGrid( {}: {}x{} cells of {} degrees )'.format(self.version, self.shape[0], self.shape[1], self.cell)
+
+if __name__ == "__main__":
+    from app.metrics.snapshot import Snapshot
+
+    parser = argparse.ArgumentParser(description='Build the city wide safety grid')
+    parser.add_argument('path', help='File to write the grid to, e.g. grid.npz')
+    parser.add_argument('--snapshot', help='Snapshot to build from; downloaded from OpenData when not given')
+    parser.add_argument('--cell', type=float, default=GRID_CELL, help='Side of a cell in degrees')
+    args = parser.parse_args()
+
+    snapshot = Snapshot.load(args.snapshot) if args.snapshot else Snapshot.download(verbose=True)
+
+    grid = SafetyGrid.build(snapshot, args.cell)
+    grid.save(args.path)
+
+    print(grid)
@@ -4,16 +4,21 @@
 """
 
 import googlemaps
-import polyline
 
 from datetime import datetime
 from shapely.geometry import LineString, Point
-from app.metrics.util import Coordinate, POLYGON_BUFFER
-from math import sqrt
+from app.metrics.util import Coordinate, ROUTE_SHAPE, decode_polyline, CONNECT_TIMEOUT, READ_TIMEOUT
+from math import floor, sqrt
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 import json
 import os
     
+# Padding of the box around both ends of a trip, see trip_bounding_box
+TRIP_PADDING = 0.25
+TRIP_MIN_PADDING = 0.002
+
 class WalkingRoute:
     """
         purpose:
@@ -21,12 +26,13 @@ class WalkingRoute:
     """
 
     
-    def __init__(self, route_json):
+    def __init__(self, route_json, shape=None):
         """
             purpose: 
                 Initialize WalkingRoute object based on googlemaps json
             params:
                 route_json: Googlemap's walking route api response
+                shape: optional; RouteShape the polygon is built with, default ROUTE_SHAPE
         """
 
         self.ne_corner = Coordinate(route_json['bounds']['northeast']['lat'], route_json['bounds']['northeast']['lng'])
@@ -42,12 +48,14 @@ class WalkingRoute:
 
         self.polyline = route_json['overview_polyline']['points']
 
-        self.points = polyline.decode(self.polyline)
-
-        waypoints = [(w[1], w[0]) for w in self.points]
-        self.line = LineString(waypoints)
+        # (N,2) array of (LON, LAT) vertices. Points are the same vertices as (LAT, LON), a view of the array
+        self.coords = decode_polyline(self.polyline)
+        self.points = self.coords[:, ::-1]
+        self.line = LineString(self.coords)
 
-        self.polygon = self.line.buffer(POLYGON_BUFFER)
+        # The line itself keeps every vertex; only the polygon is simplified
+        self.shape = shape if shape is not None else ROUTE_SHAPE
+        self.polygon = self.shape.buffer(self.line)
     
     def equals(self, other):
         """
@@ -92,23 +100,34 @@ def max_bounding_box(routes):
             (ne, sw): corners of the bounding box that surrounds the bounding boxes for all the routes
     """
 
-    # Assume first route is the box
-    max_ne = Coordinate(*routes[0].ne_corner.latlng)
-    max_sw = Coordinate(*routes[0].sw_corner.latlng)
-
     # ONLY VALID FOR WEST HEMISPHERE, NORTH HEMISPHERE
     # ne_bound will be the largest lat and the largest lon (closest to 0)
     # sw_bound will be the smallest lat and the smallest lon
-        
-    for route in routes:
-        max_ne.lat = max(max_ne.lat, route.ne_corner.lat)   # LAT
-        max_ne.lon = min(max_ne.lon, route.ne_corner.lon)
-
-        max_sw.lat = min(max_sw.lat, route.sw_corner.lat)
-        max_sw.lon = min(max_sw.lon, route.sw_corner.lon)
+    max_ne = Coordinate(max(route.ne_corner.lat for route in routes), max(route.ne_corner.lon for route in routes))
+    max_sw = Coordinate(min(route.sw_corner.lat for route in routes), min(route.sw_corner.lon for route in routes))
 
     return max_ne, max_sw 
 
+def trip_bounding_box(from_loc, to_loc, padding=TRIP_PADDING):
+    """
+        purpose:
+            Guess the area the walking routes between two locations cover before they are known: the box around
+            both ends, padded on every side since routes rarely go straight
+        params:
+            from_loc, to_loc: (LAT, LON) in decimal degrees
+            padding: optional; padding on each side as a fraction of the larger side of the box. At least
+                     TRIP_MIN_PADDING degrees
+        return:
+            (ne, sw): Coordinate corners of the padded box
+    """
+
+    lat0, lat1 = sorted((from_loc[0], to_loc[0]))
+    lon0, lon1 = sorted((from_loc[1], to_loc[1]))
+
+    pad = max(padding * max(lat1 - lat0, lon1 - lon0), TRIP_MIN_PADDING)
+
+    return Coordinate(lat1 + pad, lon1 + pad), Coordinate(lat0 - pad, lon0 - pad)
+
 def split_box(ne, sw, box_count):
     """
         purpose:
@@ -163,9 +182,221 @@ def split_box(ne, sw, box_count):
 
     return boxes
 
+# Width in degrees of the level 0 cells of the global tile grid. About the size of one box of split_box(ne, sw, 25)
+# over a typical route, which keeps tiles below the 1000 element request limit
+TILE_SIZE = 0.01
+
+# Level of the tiles a query area is first covered with when they are split adaptively, see TileSplits. Four times
+# as wide as level 0 so sparse areas take few queries
+START_TILE_LEVEL = -2
+
+# Deepest level tiles are split to; about 15 m wide
+MAX_TILE_LEVEL = 6
+
+class Tile:
+    """
+        purpose:
+            Cell of a fixed global grid of boxes. Tiles are addressed by their column, row and level, so the same
+            area always maps to the same tile and query results can be reused across requests. Every level halves
+            the size of the tiles
+    """
+
+    def __init__(self, col, row, level=0):
+        self.col = col
+        self.row = row
+        self.level = level
+
+    @property
+    def size(self):
+        return TILE_SIZE / 2 ** self.level
+
+    @property
+    def sw(self):
+        return Coordinate(self.row * self.size, self.col * self.size)
+
+    @property
+    def ne(self):
+        return Coordinate((self.row + 1) * self.size, (self.col + 1) * self.size)
+
+    @property
+    def area(self):
+        # In square degrees
+        return self.size ** 2
+
+    @property
+    def key(self):
+        # Canonical address of the tile
+        return (self.level, self.col, self.row)
+
+    def children(self):
+        """
+            purpose:
+                Split the tile into the four tiles of the next level that cover it
+            return:
+                tiles: List of Tile objects
+        """
+
+        return [Tile(2 * self.col + dc, 2 * self.row + dr, self.level + 1) for dc in (0, 1) for dr in (0, 1)]
+
+    def intersects(self, ne, sw):
+        """
+            purpose:
+                Check if the tile overlaps the bounding box dictated by the ne and sw corners
+        """
+
+        return (self.col * self.size <= ne.lon and (self.col + 1) * self.size >= sw.lon and
+                self.row * self.size <= ne.lat and (self.row + 1) * self.size >= sw.lat)
+
+    def __iter__(self):
+        # Unpacks into corners like the boxes of split_box
+        return iter((self.ne, self.sw))
+
+    def __eq__(self, other):
+        return isinstance(other, Tile) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return 'Tile( level {} col {} row {} )'.format(self.level, self.col, self.row)
+
+def split_tiles(ne, sw, level=0):
+    """
+        purpose:
+            Cover the bounding box dictated by the ne and sw corners with tiles of the global grid
+        params:
+            ne: Coordinate for ne corner
+            sw: Coordinate for sw corner
+            level: optional; tile level, see Tile
+        return:
+            tiles: List of Tile objects
+    """
+
+    size = TILE_SIZE / 2 ** level
+
+    cols = range(floor(sw.lon / size), floor(ne.lon / size) + 1)
+    rows = range(floor(sw.lat / size), floor(ne.lat / size) + 1)
+
+    return [Tile(col, row, level) for col in cols for row in rows]
+
+class TileSplits:
+    """
+        purpose:
+            Quadtree over the tile grid, per layer. Remembers the tiles that hold more features of a layer than one
+            query returns, so later requests go straight to their children instead of hitting the limit again.
+            With a density estimate for a layer, tiles expected to hold too many features are split before their
+            first query. Densities measured on a tile, see measure, take precedence over the layer wide one
+            within that tile
+    """
+
+    def __init__(self, limit=1000, densities=None, max_level=MAX_TILE_LEVEL):
+        """
+            parameters:
+                limit: optional; most features the server returns for one query
+                densities: optional; dict of layer to estimated features per square degree
+                max_level: optional; tiles at this level are never split
+        """
+
+        self.limit = limit
+        self.densities = dict(densities or {})
+        self.max_level = max_level
+
+        self.__split = set()
+        self.__lock = Lock()
+
+        # (layer,) + tile key -> features per square degree within that tile, and the levels measured
+        self.__measured = {}
+        self.__levels = set()
+
+    def measure(self, layer, tile, count):
+        """
+            purpose:
+                Remember how many features of a layer a tile holds, e.g. from a returnCountOnly query. The tiles
+                within it are estimated from its density
+        """
+
+        with self.__lock:
+            self.__measured[(layer,) + tile.key] = count / tile.area
+            self.__levels.add(tile.level)
+
+    def estimate(self, layer, tile):
+        """
+            purpose:
+                Estimate the number of features of a layer within a tile
+            return:
+                count: float, or None without a density estimate for the layer
+        """
+
+        density = self.densities.get(layer)
+
+        # Density of the smallest measured tile that covers this one
+        with self.__lock:
+            for level in sorted((level for level in self.__levels if level <= tile.level), reverse=True):
+                scale = 2 ** (tile.level - level)
+                measured = self.__measured.get((layer, level, tile.col // scale, tile.row // scale))
+
+                if measured is not None:
+                    density = measured
+                    break
+
+        return None if density is None else density * tile.area
+
+    def is_split(self, layer, tile):
+        """
+            purpose:
+                Check if a tile has to be queried through its children for a layer
+        """
+
+        if tile.level >= self.max_level:
+            return False
+
+        with self.__lock:
+            if (layer,) + tile.key in self.__split:
+                return True
+
+        estimate = self.estimate(layer, tile)
+
+        return estimate is not None and estimate >= self.limit
+
+    def split(self, layer, tile):
+        """
+            purpose:
+                Remember that a tile holds too many features of a layer for one query
+            return:
+                True if the tile is split, False if it is already at the deepest level
+        """
+
+        if tile.level >= self.max_level:
+            return False
+
+        with self.__lock:
+            self.__split.add((layer,) + tile.key)
+
+        return True
+
+    def __len__(self):
+        return len(self.__split)
+
 class GMapsAPI:
-    def __init__(self, key):
+    def __init__(self, key, session=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, cache=None, geocodes=None,
+                 shape=None):
+      """
+          parameters:
+              key: Google Maps API key
+              session: optional; PooledSession used for every API call instead of the client's own session
+              connect_timeout: optional; seconds to wait for a connection
+              read_timeout: optional; seconds to wait for the server to send data
+              cache: optional; DirectionsCache of the WalkingRoute objects of each trip
+              geocodes: optional; GeocodeStore asked before the Google geocoder, and filled with its answers
+              shape: optional; RouteShape of the WalkingRoute polygons
+      """
+
       self.key = key
+      self.session = session
+      self.timeout = (connect_timeout, read_timeout)
+      self.cache = cache
+      self.geocodes = geocodes
+      self.shape = shape
 
     def create_conn(self):
         """
@@ -175,13 +406,73 @@ class GMapsAPI:
                 True if connection was successful, else False. 
         """
         try:
-            self.gmaps = googlemaps.Client(self.key)
+            self.gmaps = googlemaps.Client(self.key, connect_timeout=self.timeout[0], read_timeout=self.timeout[1])
+
+            # Keep connections to Google alive across requests
+            if self.session is not None:
+                self.gmaps.session = self.session
+
             return True
         except Exception as e:
             print(e)
             return False
 
     
+    def geocode(self, address):
+        """
+            purpose:
+                Find the location of an address, from the geocode store when it knows it, else from Google
+            parameters:
+                address: address string
+            return:
+                (LAT, LON) in decimal degrees. Raises when Google has no answer
+        """
+
+        if self.geocodes is not None:
+            location = self.geocodes.get(address)
+            if location is not None:
+                return location
+
+        result = self.gmaps.geocode(address)
+        location = (result[0]['geometry']['location']['lat'], result[0]['geometry']['location']['lng'])
+
+        if self.geocodes is not None:
+            self.geocodes.put(address, *location)
+
+        return location
+
+    def locate(self, from_loc, to_loc):
+        """
+            purpose:
+                Geocode both ends of a trip, at the same time when both need a call to Google
+            parameters:
+                from_loc, to_loc: see walking_routes
+            return:
+                (from_loc, to_loc): (LAT, LON) of each end; an address that could not be geocoded is returned
+                                    as it is, so Google can still try it in the Directions call
+        """
+
+        def locate(loc):
+            if type(loc) != str:
+                return loc
+
+            try:
+                return self.geocode(loc)
+            except Exception as e:
+                print('String parameters could not be geocoded: {}'.format(e))
+                return loc
+
+        # The second lookup runs on its own thread, unless it is just a coordinate
+        if type(from_loc) == str and type(to_loc) == str:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                to_future = executor.submit(locate, to_loc)
+                from_loc = locate(from_loc)
+                to_loc = to_future.result()
+
+            return from_loc, to_loc
+
+        return locate(from_loc), locate(to_loc)
+
     def walking_routes(self, from_loc, to_loc):
         """
             purpose: 
@@ -196,33 +487,37 @@ class GMapsAPI:
                 Returns list of WalkingRoute objects or None if error occured
         """
 
-        # When the type of both input arguments are strings, attempt to geocode the addresses
-        if type(to_loc) == str:
-            try:
-                to_loc = self.gmaps.geocode(to_loc)
-                to_loc = (to_loc[0]['geometry']['location']['lat'], to_loc[0]['geometry']['location']['lng'])
-                
-            except Exception as e:
-                print('String parameters could not be geocoded: {}'.format(e))
+        if self.cache is None:
+            return self.__walking_routes(from_loc, to_loc)
 
-        if type(from_loc) == str:
-            try:
-                from_loc = self.gmaps.geocode(from_loc) 
-                from_loc = (from_loc[0]['geometry']['location']['lat'], from_loc[0]['geometry']['location']['lng'])
+        # Cached routes are shared between requests, hand out a new list of them
+        routes = self.cache.get(self.cache.key(from_loc, to_loc), lambda: self.__walking_routes(from_loc, to_loc))
 
-            except Exception as e:
-                print('String parameters could not be geocoded: {}'.format(e))
+        return list(routes) if routes is not None else None
+
+    def __walking_routes(self, from_loc, to_loc):
+        """
+            purpose:
+                Same as walking_routes, always asking Google Maps
+        """
+
+        # When the type of both input arguments are strings, attempt to geocode the addresses
+        from_loc, to_loc = self.locate(from_loc, to_loc)
+
+        # Google takes an address as it is, and a (LAT, LON) pair as a tuple
+        def waypoint(loc):
+            return loc if type(loc) == str else tuple(loc)
 
         # Query Maps API with FROM_LOC and TO_LOC
         try:
-            routes = self.gmaps.directions(origin=tuple(from_loc),
-                                destination=tuple(to_loc),
+            routes = self.gmaps.directions(origin=waypoint(from_loc),
+                                destination=waypoint(to_loc),
                                 mode="walking",
                                 alternatives=True,
                                 units="metric",      # Get as many routes as possible
                                 departure_time=datetime.now())
 
-            unpacked_routes = [WalkingRoute(route) for route in routes]
+            unpacked_routes = [WalkingRoute(route, self.shape) for route in routes]
 
             return unpacked_routes
 
@@ -5,16 +5,22 @@
         Contains the logic of interacing with the London OpenData API including organizing data elements
 """
 
-import requests
+import asyncio
+import atexit
 import json
 
-from shapely.geometry import LineString, Point
-from app.metrics.map import WalkingRoute
+import numpy as np
 
-from math import sqrt
+from array import array
+from itertools import chain
+from urllib.parse import quote
+from shapely.geometry import LineString, Point
+from app.metrics.map import WalkingRoute, Tile
+from app.metrics import pbf
 
-from threading import Thread
-from app.metrics.util import Coordinate, POLYGON_BUFFER
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Event, Lock, Thread
+from app.metrics.util import Coordinate, POLYGON_BUFFER, PooledSession, READ_TIMEOUT, make_lines, make_points
 
 class StreetLight:
     """
@@ -38,6 +44,15 @@ class StreetLight:
         # Create coordinate
         self.coord = Coordinate(light_json["geometry"]["x"], light_json["geometry"]["y"])
 
+    @classmethod
+    def from_values(cls, id, x, y):
+        """
+            purpose:
+                Construct StreetLight object from already parsed values, see LightSet
+        """
+
+        return cls({"attributes": {"OBJECTID": id}, "geometry": {"x": x, "y": y}})
+
     # String format    
     def __str__(self):
         return 'ID: {} - {},{}'.format(self.id, self.coord.lat, self.coord.lon)
@@ -53,8 +68,10 @@ class Sidewalk:
         parameters:
             ID - Unique ID provided by OpenData
             length - Length of sidewalk segment in KM
-            points - List of coordinates that represent the path of the sidewalk
+            path - List of [LON, LAT] vertices of the sidewalk
+            points - List of coordinates that represent the path of the sidewalk, built on first use
             line - LineString element used for plotted
+            polygon - Buffer around line, built on first use
     """
 
     def __init__(self, sidewalk_json):
@@ -65,15 +82,39 @@ class Sidewalk:
         self.length = sidewalk_json["attributes"]["Shape.STLength()"] / 1000
 
         # Extract points on sidewalk path
-        points = sidewalk_json["geometry"]["paths"][0]
-
-        # List of coordinates
-        self.points = [Coordinate(point[0], point[1]) for point in points]
+        self.path = sidewalk_json["geometry"]["paths"][0]
 
         # LineString based on list of points
-        self.line = LineString([(point[0], point[1]) for point in points])
+        self.line = LineString([(point[0], point[1]) for point in self.path])
+
+        # Coordinates and buffer are built on first use
+        self.__points = None
+        self.__polygon = None
+
+    @property
+    def points(self):
+        # List of coordinates
+        if self.__points is None:
+            self.__points = [Coordinate(point[0], point[1]) for point in self.path]
+        return self.__points
+
+    @property
+    def polygon(self):
+        if self.__polygon is None:
+            self.__polygon = self.line.buffer(POLYGON_BUFFER)
+        return self.__polygon
+
+    @classmethod
+    def from_values(cls, id, length, points):
+        """
+            purpose:
+                Construct Sidewalk object from already parsed values, see LineSet
+            parameters:
+                length: Length in KM
+                points: List of [LON, LAT] vertices
+        """
 
-        self.polygon = self.line.buffer(POLYGON_BUFFER)
+        return cls({"attributes": {"OBJECTID": id, "Shape.STLength()": length * 1000}, "geometry": {"paths": [points]}})
 
     # String format    
     def __str__(self):
@@ -91,8 +132,10 @@ class TrafficVolume:
             ID - Unique ID provided by OpenData
             volume - Average annual daily traffic volume in # of cars
             length - Length of sidewalk segment in KM
-            points - List of coordinates that represent the path of the sidewalk
+            path - List of [LON, LAT] vertices of the sidewalk
+            points - List of coordinates that represent the path of the sidewalk, built on first use
             line - LineString element used for plotted
+            polygon - Buffer around line, built on first use
     """
     
     def __init__(self, volume_json):
@@ -106,15 +149,40 @@ class TrafficVolume:
         self.volume = volume_json["attributes"]["VolumeCount"]
 
         # Extract points on sidewalk path
-        points = volume_json["geometry"]["paths"][0]
-
-        # List of coordinates
-        self.points = [Coordinate(point[0], point[1]) for point in points]
+        self.path = volume_json["geometry"]["paths"][0]
 
         # LineString based on list of points
-        self.line = LineString([(point[0], point[1]) for point in points])
+        self.line = LineString([(point[0], point[1]) for point in self.path])
+
+        # Coordinates and buffer are built on first use
+        self.__points = None
+        self.__polygon = None
+
+    @property
+    def points(self):
+        # List of coordinates
+        if self.__points is None:
+            self.__points = [Coordinate(point[0], point[1]) for point in self.path]
+        return self.__points
+
+    @property
+    def polygon(self):
+        if self.__polygon is None:
+            self.__polygon = self.line.buffer(POLYGON_BUFFER)
+        return self.__polygon
+
+    @classmethod
+    def from_values(cls, id, length, volume, points):
+        """
+            purpose:
+                Construct TrafficVolume object from already parsed values, see LineSet
+            parameters:
+                length: Length in KM
+                points: List of [LON, LAT] vertices
+        """
 
-        self.polygon = self.line.buffer(POLYGON_BUFFER)
+        return cls({"attributes": {"OBJECTID": id, "Shape.STLength()": length * 1000, "VolumeCount": volume},
+                    "geometry": {"paths": [points]}})
 
     # String format    
     def __str__(self):
@@ -124,321 +192,1869 @@ class TrafficVolume:
     def __repr__(self):
         return 'TrafficVolume ID: {} Length: {}, Average Volume: {}'.format(self.id, self.length, self.volume)
 
-class OpenDataLondon:
+class LightSet:
     """
         purpose:
-            Handle London OpenData API calls
+            Columnar collection of street lights. Shapely points and StreetLight objects are only
+            materialised when asked for
+        properties:
+            ids - (N,) int array of unique IDs provided by OpenData
+            x - (N,) float array of LON
+            y - (N,) float array of LAT
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, ids=(), x=(), y=()):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
 
-    def __bounding_box_route(self, along_route: WalkingRoute):
+        self.__points = None
+
+    @classmethod
+    def from_json(cls, features):
         """
             purpose:
-                Create the API endpoint string based on the bounding box around a WalkingRoute
+                Parse the features of an OpenData street light query
             parameters:
-                along_route: WalkingRoute object that defines bounding box
-            return:
-                geometry: string representing API url with bounding box around route
+                features: List of JSON features, see StreetLight
         """
 
-        # Requires LON, LAT but google maps is LAT, LON
-        box_ne = '{}%2C{}'.format(along_route.ne_corner.latlng[1], along_route.ne_corner.latlng[0])
-        box_sw = '{}%2C{}'.format(along_route.sw_corner.latlng[1], along_route.sw_corner.latlng[0])
+        count = len(features)
 
-        geometry = '&geometry={}%2C{}&geometryType=esriGeometryEnvelope&inSR=4326&spatialRel=esriSpatialRelIntersects'.format(box_ne, box_sw)
+        ids = np.fromiter((f["attributes"]["OBJECTID"] for f in features), dtype=np.int64, count=count)
+        x = np.fromiter((f["geometry"]["x"] for f in features), dtype=float, count=count)
+        y = np.fromiter((f["geometry"]["y"] for f in features), dtype=float, count=count)
 
-        return geometry
+        return cls(ids, x, y)
 
-    def __bounding_box(self, ne, sw):
+    @classmethod
+    def concat(cls, sets):
         """
             purpose:
-                Create the API endpoint string based on the bounding box defined by the northeast and southwest coordinates
-            parameters:
-                ne: Northeast Coordinate object
-                sw: Southwest Coordinate object
-            return:
-                geometry: string representing API url with bounding box around coordinates
+                Join multiple LightSets into one, keeping duplicates
         """
 
-        # Requires LON, LAT but google maps is LAT, LON
-        box_ne = '{}%2C{}'.format(ne.lon, ne.lat)
-        box_sw = '{}%2C{}'.format(sw.lon, sw.lat)
+        sets = list(sets)
+        if not sets:
+            return cls()
 
-        geometry = '&geometry={}%2C{}&geometryType=esriGeometryEnvelope&inSR=4326&spatialRel=esriSpatialRelIntersects'.format(box_ne, box_sw)
+        return cls(np.concatenate([s.ids for s in sets]), np.concatenate([s.x for s in sets]), np.concatenate([s.y for s in sets]))
 
-        return geometry
+    def select(self, positions):
+        """
+            purpose:
+                New LightSet holding only the lights at POSITIONS
+        """
 
-    def get_street_lights_onroute(self, along_route : WalkingRoute):
+        return LightSet(self.ids[positions], self.x[positions], self.y[positions])
+
+    def unique(self):
         """
             purpose:
-                Get all street lights along WalkingRoute
-            parameters:
-                along_route: WalkingRoute object
-            return:
-                street_lights: List of StreetLight objects that are within the bounds of the route
+                Remove lights with a repeated ID, keeping the first occurrence
         """
 
-        # Base URL
-        geometry = self.__bounding_box_route(along_route)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/19/query?where=1%3D1&outFields=Shape,OBJECTID{}&outSR=4326&f=json'.format(geometry)
+        _, first = np.unique(self.ids, return_index=True)
+        return self.select(np.sort(first))
 
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+    @property
+    def nbytes(self):
+        # Memory held by the arrays
+        return self.ids.nbytes + self.x.nbytes + self.y.nbytes
 
-        street_lights = [StreetLight(element) for element in api_response['features']]
+    @property
+    def coords(self):
+        # (N,2) array of (LON, LAT)
+        return np.column_stack((self.x, self.y))
 
-        return street_lights
+    @property
+    def points(self):
+        # Shapely Points, built on first use
+        if self.__points is None:
+            self.__points = make_points(self.x, self.y)
+        return self.__points
 
-    def get_street_lights_inbox(self, ne_corner, sw_corner):
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return StreetLight.from_values(int(self.ids[i]), float(self.x[i]), float(self.y[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # Representative format
+    def __repr__(self):
+        return 'LightSet( {} lights )'.format(len(self))
+
+class LineSet:
+    """
+        purpose:
+            Columnar collection of line features; sidewalks or traffic volumes. Every line is stored as a run
+            of vertices in one flat coordinate array. LineStrings and feature objects are only materialised
+            when asked for
+        properties:
+            ids - (N,) int array of unique IDs provided by OpenData
+            lengths - (N,) float array of segment lengths in KM
+            volumes - (N,) float array of average annual daily traffic volume, or None for sidewalks
+            coords - (V,2) float array of (LON, LAT) vertices of all lines
+            offsets - (N+1,) int array; the vertices of line i are coords[offsets[i]:offsets[i+1]]
+    """
+
+    def __init__(self, ids=(), lengths=(), coords=None, offsets=None, volumes=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=float)
+        self.volumes = None if volumes is None else np.asarray(volumes, dtype=float)
+        self.coords = np.zeros((0, 2)) if coords is None else np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+
+        self.__lines = None
+
+    @classmethod
+    def from_json(cls, features, volumes=False):
         """
             purpose:
-                Get all street lights within a bounding box
+                Parse the features of an OpenData sidewalk or traffic volume query
             parameters:
-                ne_corner: Northeast Coordinate object
-                sw_corner: Southwest Coordinate object
-            return:
-                street_lights: List of StreetLight objects that are within the bounds of the box
+                features: List of JSON features, see Sidewalk and TrafficVolume
+                volumes: optional; default False. If true, the features carry a traffic VolumeCount
         """
-        
-        # Base URL
-        geometry = self.__bounding_box(ne_corner, sw_corner)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/19/query?where=1%3D1&outFields=Shape,OBJECTID{}&outSR=4326&f=json'.format(geometry)
 
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+        count = len(features)
 
-        street_lights = [StreetLight(element) for element in api_response['features']]
+        ids = np.fromiter((f["attributes"]["OBJECTID"] for f in features), dtype=np.int64, count=count)
+        lengths = np.fromiter((f["attributes"]["Shape.STLength()"] for f in features), dtype=float, count=count) / 1000
 
-        return street_lights
+        if volumes:
+            volumes = np.fromiter((f["attributes"]["VolumeCount"] for f in features), dtype=float, count=count)
+        else:
+            volumes = None
 
-    def get_sidewalks_onroute(self, along_route : WalkingRoute):
+        # Like the feature objects, only the first path of each feature is kept
+        paths = [f["geometry"]["paths"][0] for f in features]
+        counts = np.fromiter((len(path) for path in paths), dtype=np.int64, count=count)
+
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        coords = np.fromiter(chain.from_iterable(chain.from_iterable(paths)), dtype=float, count=2 * int(offsets[-1]))
+
+        return cls(ids, lengths, coords, offsets, volumes)
+
+    @classmethod
+    def concat(cls, sets):
         """
             purpose:
-                Get all sidewalk data along WalkingRoute
-            parameters:
-                along_route: WalkingRoute object
-            return:
-                sidewalks: List of Sidewalk objects that are within the bounds of the route
+                Join multiple LineSets of the same layer into one, keeping duplicates
         """
 
-        # Base URL
-        geometry = self.__bounding_box_route(along_route)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/4/query?where=1%3D1&outFields=OBJECTID,Shape.STLength(){}&outSR=4326&f=json'.format(geometry)
+        sets = list(sets)
+        if not sets:
+            return cls()
 
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+        # Shift every set's offsets past the vertices of the sets before it
+        starts = np.cumsum([0] + [s.offsets[-1] for s in sets[:-1]])
+        offsets = np.concatenate([[0]] + [s.offsets[1:] + start for s, start in zip(sets, starts)])
 
-        sidewalks = [Sidewalk(element) for element in api_response['features']]
+        volumes = None
+        if sets[0].volumes is not None:
+            volumes = np.concatenate([s.volumes for s in sets])
 
-        return sidewalks
-    
-    def get_sidewalks_inbox(self, ne_corner, sw_corner):
+        return cls(np.concatenate([s.ids for s in sets]), np.concatenate([s.lengths for s in sets]),
+                   np.concatenate([s.coords for s in sets]), offsets, volumes)
+
+    def select(self, positions):
         """
             purpose:
-                Get all sidewalk data within a bounding box
-            parameters:
-                ne_corner: Northeast Coordinate object
-                sw_corner: Southwest Coordinate object
-            return:
-                street_lights: List of Sidewalk objects that are within the bounds of the box
+                New LineSet holding only the lines at POSITIONS
         """
 
-        # Base URL
-        geometry = self.__bounding_box(ne_corner, sw_corner)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/4/query?where=1%3D1&outFields=OBJECTID,Shape.STLength(){}&outSR=4326&f=json'.format(geometry)
+        positions = np.asarray(positions, dtype=np.int64)
 
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+        starts = self.offsets[:-1][positions]
+        counts = self.offsets[1:][positions] - starts
 
-        sidewalks = [Sidewalk(element) for element in api_response['features']]
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
 
-        return sidewalks
+        # Position of every kept vertex in the original coordinate array
+        take = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
 
-    def get_traffic_volumes_onroute(self, along_route : WalkingRoute):
+        volumes = None if self.volumes is None else self.volumes[positions]
+
+        return LineSet(self.ids[positions], self.lengths[positions], self.coords[take], offsets, volumes)
+
+    def unique(self):
         """
             purpose:
-                Get all traffic volume data along WalkingRoute
-            parameters:
-                along_route: WalkingRoute object
-            return:
-                volumes: List of TrafficVolume objects that are within the bounds of the route
+                Remove lines with a repeated ID, keeping the first occurrence
         """
 
-        # Base URL
-        geometry = self.__bounding_box_route(along_route)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/21/query?where=1%3D1&outFields=OBJECTID,Shape.STLength(),VolumeCount{}&outSR=4326&f=json'.format(geometry)
-
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+        _, first = np.unique(self.ids, return_index=True)
+        return self.select(np.sort(first))
 
-        volumes = [TrafficVolume(element) for element in api_response['features']]
+    def vertices(self, i):
+        # (M,2) array of (LON, LAT) vertices of line I
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
 
-        return volumes
+    @property
+    def nbytes(self):
+        # Memory held by the arrays
+        return self.ids.nbytes + self.lengths.nbytes + self.coords.nbytes + self.offsets.nbytes + \
+               (0 if self.volumes is None else self.volumes.nbytes)
 
-    def get_traffic_volumes_inbox(self, ne_corner, sw_corner):
+    def bounds(self):
         """
             purpose:
-                Get all traffic volume data within a bounding box
-            parameters:
-                ne_corner: Northeast Coordinate object
-                sw_corner: Southwest Coordinate object
+                Bounding box of every line
             return:
-                street_lights: List of TrafficVolume objects that are within the bounds of the box
+                (minx, miny, maxx, maxy): tuple of (N,) float arrays
         """
 
-       # Base URL
-        geometry = self.__bounding_box(ne_corner, sw_corner)
-        url = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer/21/query?where=1%3D1&outFields=OBJECTID,Shape.STLength(),VolumeCount{}&outSR=4326&f=json'.format(geometry)
+        if len(self) == 0:
+            empty = np.zeros(0)
+            return empty, empty, empty, empty
 
-        api_result = requests.get(url)
-        api_response = json.loads(api_result.text)
+        starts = self.offsets[:-1]
+        x, y = self.coords[:, 0], self.coords[:, 1]
 
-        volumes = [TrafficVolume(element) for element in api_response['features']]
+        return (np.minimum.reduceat(x, starts), np.minimum.reduceat(y, starts),
+                np.maximum.reduceat(x, starts), np.maximum.reduceat(y, starts))
 
-        return volumes
+    @property
+    def lines(self):
+        # Shapely LineStrings, built on first use
+        if self.__lines is None:
+            self.__lines = make_lines(self.coords, self.offsets)
+        return self.__lines
 
-class DataThreadPool:
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        points = self.vertices(i).tolist()
+
+        if self.volumes is None:
+            return Sidewalk.from_values(int(self.ids[i]), float(self.lengths[i]), points)
+
+        return TrafficVolume.from_values(int(self.ids[i]), float(self.lengths[i]), float(self.volumes[i]), points)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # Representative format
+    def __repr__(self):
+        return 'LineSet( {} lines )'.format(len(self))
+
+# OpenData transportation map service and the layers read from it
+OPENDATA_URL = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer'
+
+LIGHTS_LAYER = 19
+SIDEWALKS_LAYER = 4
+VOLUMES_LAYER = 21
+
+# Most features the server returns for one query; responses cut at this size report exceededTransferLimit
+MAX_RECORD_COUNT = 1000
+
+# Corners of the area of London covered by the OpenData layers, measured into TileSplits by measure_tiles
+CITY_NE = Coordinate(43.08, -81.05)
+CITY_SW = Coordinate(42.82, -81.42)
+
+# Encodings of layer query responses, see OpenDataLondon
+#   'json' - full precision JSON
+#   'compact' - JSON with coordinates quantized and lines generalized to WIRE_TOLERANCE
+#   'pbf' - protocol buffers, quantized and generalized the same way
+#   'auto' - pbf for the layers whose server supports it, else compact
+WIRE_FORMATS = ('json', 'compact', 'pbf', 'auto')
+
+# Degrees coordinates are quantized and lines generalized to by the compact formats. A twenty fifth of
+# POLYGON_BUFFER, about a metre, well below what moves a feature in or out of a route polygon
+WIRE_TOLERANCE = POLYGON_BUFFER / 25
+
+# Metres per degree of latitude, to send POLYGON_BUFFER as a corridor distance. A degree of longitude is shorter
+# in London, so the route polygon is narrower east to west than north to south. Corridors that fetch features
+# cover it in every direction, counts are matched to its width across the route, see corridor_meters
+METERS_PER_DEGREE = 111320
+
+# Degrees routes are simplified by before they are sent as a corridor. Added to the corridor distance so no
+# feature near the original route is missed
+CORRIDOR_TOLERANCE = POLYGON_BUFFER / 5
+
+# Fields requested for each layer
+LAYER_FIELDS = {
+    LIGHTS_LAYER: 'OBJECTID',
+    SIDEWALKS_LAYER: 'OBJECTID,Shape.STLength()',
+    VOLUMES_LAYER: 'OBJECTID,Shape.STLength(),VolumeCount',
+}
+
+def parse_features(layer, features):
     """
         purpose:
-            Streamline interact with OpenData helper class. Automatically multithreads API call
-            to avoid hitting the maximum API request limit.
+            Parse the JSON features of an OpenData layer query into the matching collection
+        parameters:
+            layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            features: List of JSON features
+        return:
+            LightSet for street lights, else LineSet
     """
-    def __init__(self):
-        self.data_source = OpenDataLondon()
 
-    def __uniques(self,iterable):
+    # Streamed responses are parsed while they are read, see FeatureStream
+    if isinstance(features, (LightSet, LineSet)):
+        return features
+
+    if layer == LIGHTS_LAYER:
+        return LightSet.from_json(features)
+
+    return LineSet.from_json(features, volumes=(layer == VOLUMES_LAYER))
+
+def parse_pbf(layer, body):
+    """
+        purpose:
+            Parse the protocol buffer response of an OpenData layer query
+        parameters:
+            layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            body: bytes of the response
+        return:
+            api_response: dict shaped like the JSON response, with the features already parsed into a LightSet
+                          for street lights, else a LineSet
+    """
+
+    result = pbf.decode_features(body)
+
+    attributes = result['attributes']
+    coords = result['coords']
+
+    ids = np.asarray(attributes.get('OBJECTID', []), dtype=np.int64)
+
+    if layer == LIGHTS_LAYER:
+        features = LightSet(ids, coords[:, 0], coords[:, 1])
+    else:
+        # Empty responses may list no fields
+        lengths = np.asarray(attributes.get('Shape.STLength()', []), dtype=float) / 1000
+        volumes = np.asarray(attributes.get('VolumeCount', []), dtype=float) if layer == VOLUMES_LAYER else None
+
+        features = LineSet(ids, lengths, coords, result['offsets'], volumes)
+
+    return {'features': features, 'exceededTransferLimit': result['exceededTransferLimit']}
+
+def dequantize_response(layer, api_response):
+    """
+        purpose:
+            Turn the quantized coordinates of a compact JSON response back into degrees. Responses without a
+            transform are returned as they are
+        parameters:
+            layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            api_response: JSON response of the server, see OpenDataLondon.query_json
+        return:
+            api_response: with the features parsed into a LightSet for street lights, else a LineSet
+    """
+
+    transform = api_response.get('transform')
+    if transform is None or 'features' not in api_response:
+        return api_response
+
+    features = parse_features(layer, api_response['features'])
+    upper_left = transform.get('originPosition', 'upperLeft') == 'upperLeft'
+
+    if layer == LIGHTS_LAYER:
+        x, y = pbf.dequantize(features.coords, transform['scale'], transform['translate'], upper_left)
+        features = LightSet(features.ids, x, y)
+    else:
+        # Vertices of each path are relative to the one before
+        quantized = pbf.undelta(features.coords, np.diff(features.offsets))
+        x, y = pbf.dequantize(quantized, transform['scale'], transform['translate'], upper_left)
+        features = LineSet(features.ids, features.lengths, np.column_stack([x, y]), features.offsets, features.volumes)
+
+    return dict(api_response, features=features)
+
+def corridor_meters(coords, distance):
+    """
+        purpose:
+            Half width in metres of a line buffered by DISTANCE degrees, measured across the line and averaged
+            over its length. A degree of longitude shrinks with the latitude, so the buffer is narrower east to
+            west than north to south, and how wide it is across the line depends on where the line heads
+        parameters:
+            coords: (N,2) float array of the (LON, LAT) vertices of the line
+            distance: buffer in degrees, like POLYGON_BUFFER
+        return:
+            meters: float
+    """
+
+    north = METERS_PER_DEGREE
+    east = METERS_PER_DEGREE * np.cos(np.radians(np.mean(coords[:, 1]))) if len(coords) else north
+
+    # Edges in metres; across an edge heading (ux, uy) the buffer reaches sqrt((east uy)^2 + (north ux)^2)
+    edges = np.diff(coords, axis=0) * (east, north)
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+
+    if lengths.sum() == 0:
+        return distance * north
+
+    across = np.hypot(east * edges[:, 1], north * edges[:, 0]) / np.where(lengths > 0, lengths, 1)
+
+    return float(distance * (across * lengths).sum() / lengths.sum())
+
+class FeatureStream:
+    """
+        purpose:
+            Decode the response of an OpenData layer query from ijson parse events, while it is being read.
+            Ids, attributes and coordinates are appended straight to compact typed buffers that become the
+            numpy arrays of the collection, so neither the response text nor its JSON tree is ever held in memory.
+            Features missing a value, e.g. with a null geometry, are skipped
+    """
+
+    def __init__(self, layer):
         """
-            purpose: 
-                Remove non-unique elements (determined by ID) from iterable
             parameters:
-                iterable: container
-            return:
-                uniques: original iterable but with only unique elements
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
         """
 
-        # Return only the unique elements in the iterable container
-        seen = set()
-        uniques = []
+        self.layer = layer
+        self.exceeded = False
+        self.found = False
+
+        self.ids = array('q')
+
+        # Buffer each number is appended to, by the prefix of its parse event
+        self.columns = {'features.item.attributes.OBJECTID': self.ids.append}
+
+        if layer == LIGHTS_LAYER:
+            self.x = array('d')
+            self.y = array('d')
+
+            self.columns['features.item.geometry.x'] = self.x.append
+            self.columns['features.item.geometry.y'] = self.y.append
+
+            # Buffers that get one value per feature, and those that get any number
+            self.values = [self.ids, self.x, self.y]
+            self.parts = []
+        else:
+            self.lengths = array('d')
+            self.volumes = array('d') if layer == VOLUMES_LAYER else None
+
+            # Vertices of every path, flattened to LON, LAT pairs. Paths are recorded as vertex ranges and each
+            # feature as the index of its first path
+            self.coords = array('d')
+            self.path_starts = array('q')
+            self.path_ends = array('q')
+            self.first_paths = array('q')
+
+            self.columns['features.item.attributes.Shape.STLength()'] = self.lengths.append
+            self.columns['features.item.geometry.paths.item.item.item'] = self.coords.append
 
-        for i in iterable:
-            if i.id not in seen:
-                seen.add(i.id)
-                uniques.append(i)
+            if self.volumes is not None:
+                self.columns['features.item.attributes.VolumeCount'] = self.volumes.append
 
-        return uniques
+            self.values = [self.ids, self.lengths, self.first_paths] + ([] if self.volumes is None else [self.volumes])
+            self.parts = [self.coords, self.path_starts, self.path_ends]
 
-    def __flatten(self, iterable):
+        # Length of every buffer at the start of the current feature
+        self.marks = []
+
+        # Transform of compact responses
+        self.scale = array('d')
+        self.translate = array('d')
+        self.origin = None
+
+        self.columns['transform.scale.item'] = self.scale.append
+        self.columns['transform.translate.item'] = self.translate.append
+
+        # Structural events, by prefix and event
+        self.events = {
+            ('features', 'start_array'): self.__start_features,
+            ('exceededTransferLimit', 'boolean'): self.__exceeded,
+            ('transform.originPosition', 'string'): self.__origin,
+            ('features.item', 'start_map'): self.__start_feature,
+            ('features.item', 'end_map'): self.__end_feature,
+        }
+
+        if layer != LIGHTS_LAYER:
+            self.events[('features.item.geometry.paths.item', 'start_array')] = self.__start_path
+            self.events[('features.item.geometry.paths.item', 'end_array')] = self.__end_path
+
+    def __start_features(self, value):
+        self.found = True
+
+    def __exceeded(self, value):
+        self.exceeded = value
+
+    def __origin(self, value):
+        self.origin = value
+
+    def __start_feature(self, value):
+        self.marks = [len(buffer) for buffer in self.values + self.parts]
+
+        if self.layer != LIGHTS_LAYER:
+            self.first_paths.append(len(self.path_starts))
+
+    def __end_feature(self, value):
+        complete = all(len(buffer) == mark + 1 for buffer, mark in zip(self.values, self.marks))
+
+        if self.layer != LIGHTS_LAYER:
+            complete = complete and len(self.path_starts) > self.first_paths[-1]
+
+        if not complete:
+            # Drop what was read of the feature, so the buffers stay aligned
+            for buffer, mark in zip(self.values + self.parts, self.marks):
+                del buffer[mark:]
+
+    def __start_path(self, value):
+        self.path_starts.append(len(self.coords) // 2)
+
+    def __end_path(self, value):
+        self.path_ends.append(len(self.coords) // 2)
+
+    def feed(self, prefix, event, value):
         """
             purpose:
-                Flatten list of lists
-            parameters:
-                iterable: list of lists
-            return:
-                single list
+                Handle one (prefix, event, value) parse event of ijson
         """
 
-        # Convert a list of lists into one list
-        return [item for sublist in iterable for item in sublist]
+        append = self.columns.get(prefix)
+
+        if append is not None:
+            append(value)
+            return
+
+        handler = self.events.get((prefix, event))
+
+        if handler is not None:
+            handler(value)
 
-    def collect(self, boxes):
+    def response(self):
         """
             purpose:
-                Split the process of collecting relevant data from the OpenData API into multiple threads
-                to avoid running into the 1000 element request limit. Threaded approach chosen so each API
-                call does not need to be made sequentially
-            params:
-                boxes = list of boxes that defines the API query area. Through testing, 25 or 36 boxes is a good number for entire city
-            returns:
-                ( list(StreetLight), list(Sidewalk), list(TrafficVolume) )
+                Finish decoding
+            return:
+                api_response: dict shaped like the JSON response, with the features already parsed into a LightSet
+                              for street lights, else a LineSet. Has no features if the response had none, e.g.
+                              an error
         """
 
-        # Through testing, it seems like this is the best number of threads to avoid having too many boxes being handled by each thread
-        # which will ensure API request limits are not met
-        nthreads = int(sqrt(len(boxes)))
+        api_response = {'exceededTransferLimit': self.exceeded}
 
-        # Containers for thread data, by reference
-        lights = []
-        sidewalks = []
-        volumes = []
+        if len(self.scale):
+            api_response['transform'] = {'originPosition': self.origin or 'upperLeft', 'scale': list(self.scale),
+                                         'translate': list(self.translate)}
 
-        threads = []
+        if not self.found:
+            return api_response
 
-        # Split long list of boxes into smaller chucks so each thread only takes on some boxes; not all
-        for i in range(nthreads):
-            sub_boxes = boxes[i::nthreads]
+        ids = np.frombuffer(self.ids, dtype=np.int64)
 
-            t_l = Thread(target=self.__process_lights, args=(sub_boxes,lights))
-            t_s = Thread(target=self.__process_sidewalks, args=(sub_boxes,sidewalks))
-            t_v = Thread(target=self.__process_volumes, args=(sub_boxes,volumes))
+        if self.layer == LIGHTS_LAYER:
+            api_response['features'] = LightSet(ids, np.frombuffer(self.x), np.frombuffer(self.y))
+            return api_response
 
-            # Append thread ids
-            threads.append(t_l)
-            threads.append(t_s)
-            threads.append(t_v)
+        coords = np.frombuffer(self.coords).reshape(-1, 2)
+        lengths = np.frombuffer(self.lengths) / 1000
+        volumes = None if self.volumes is None else np.frombuffer(self.volumes)
 
-        # Start threads
-        [ t.start() for t in threads ]
-        # Wait for the threads to finish
-        [ t.join() for t in threads ]
-        
-        # Flatten sub lists cause each thread returns a list
-        lights = self.__flatten(lights)
-        sidewalks = self.__flatten(sidewalks)
-        volumes = self.__flatten(volumes)
+        starts = np.frombuffer(self.path_starts, dtype=np.int64)
+        ends = np.frombuffer(self.path_ends, dtype=np.int64)
+        first = np.frombuffer(self.first_paths, dtype=np.int64)
 
-        # Remove duplicates in case bounding boxes overlap
-        lights = self.__uniques(lights)
-        sidewalks = self.__uniques(sidewalks)
-        volumes = self.__uniques(volumes)
+        offsets = np.zeros(len(first) + 1, dtype=np.int64)
 
-        return lights, sidewalks, volumes
-        
-    def __process_lights(self, boxes, container):
+        if len(starts) == len(first) and (first == np.arange(len(first))).all():
+            # One path per feature, the vertices are already in place
+            offsets[1:] = ends
+        else:
+            # Like the feature objects, only the first path of each feature is kept
+            counts = ends[first] - starts[first]
+            np.cumsum(counts, out=offsets[1:])
+
+            keep = np.repeat(starts[first] - offsets[:-1], counts) + np.arange(offsets[-1])
+            coords = coords[keep]
+
+        api_response['features'] = LineSet(ids, lengths, coords, offsets, volumes)
+
+        return api_response
+
+# Bytes read from a streamed response at a time. ijson hands over the parse events of a whole read at once, so this
+# bounds the memory used while decoding
+STREAM_CHUNK = 8192
+
+def stream_response(layer, body):
+    """
+        purpose:
+            Decode the response of an OpenData layer query while reading it, see FeatureStream. Requires ijson
+        parameters:
+            layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            body: binary file like object of the response body
+        return:
+            api_response: see FeatureStream.response
+    """
+
+    import ijson
+
+    stream = FeatureStream(layer)
+
+    for prefix, event, value in ijson.parse(body, use_float=True, buf_size=STREAM_CHUNK):
+        stream.feed(prefix, event, value)
+
+    return stream.response()
+
+class OpenDataLondon:
+    """
+        purpose:
+            Handle London OpenData API calls
+    """
+
+    def __init__(self, cache=None, session=None, splits=None, stream=False, wire='json'):
+        """
+            parameters:
+                cache: optional; LRUCache for the features of each Tile. Without one every tile is queried
+                session: optional; PooledSession shared by every query. One is created when not given
+                splits: optional; TileSplits to split tiles that exceed the transfer limit. Without it such tiles
+                        are returned truncated
+                stream: optional; default False. If true, layer query responses are decoded while they are read,
+                        see FeatureStream. Requires ijson
+                wire: optional; default 'json'. Encoding of the responses to bounding box queries, one of WIRE_FORMATS
+        """
+
+        if wire not in WIRE_FORMATS:
+            raise ValueError('Unknown wire format {}, expected one of {}'.format(wire, WIRE_FORMATS))
+
+        self.cache = cache
+        self.session = session if session is not None else PooledSession()
+        self.splits = splits
+        self.stream = stream
+        self.wire = wire
+
+        # Format picked for each layer when WIRE is auto, asked for by one thread at a time
+        self.__formats = {}
+        self.__formats_lock = Lock()
+
+        # (layer,) + tile key -> Event set once the thread querying that tile is done, see claim_tiles
+        self.__inflight = {}
+        self.__inflight_lock = Lock()
+
+    def __bounding_box_route(self, along_route: WalkingRoute):
         """
             purpose:
-                Thread target; get street light data for each box
+                Create the API endpoint string based on the bounding box around a WalkingRoute
             parameters:
-                boxes: bounding boxes for query
-                container: to store results in
+                along_route: WalkingRoute object that defines bounding box
             return:
-                container: updated container after adding lights 
+                geometry: string representing API url with bounding box around route
         """
 
-        for box in boxes:
-            # Unpack tuple of coordinates
-            container.append( self.data_source.get_street_lights_inbox(*box) )
-        return container
+        # Requires LON, LAT but google maps is LAT, LON
+        box_ne = '{}%2C{}'.format(along_route.ne_corner.latlng[1], along_route.ne_corner.latlng[0])
+        box_sw = '{}%2C{}'.format(along_route.sw_corner.latlng[1], along_route.sw_corner.latlng[0])
+
+        geometry = '&geometry={}%2C{}&geometryType=esriGeometryEnvelope&inSR=4326&spatialRel=esriSpatialRelIntersects'.format(box_ne, box_sw)
 
-    def __process_sidewalks(self, boxes, container):
+        return geometry
+
+    def __bounding_box(self, ne, sw):
         """
             purpose:
-                Thread target; get sidewalk data for each box
+                Create the API endpoint string based on the bounding box defined by the northeast and southwest coordinates
             parameters:
-                boxes: bounding boxes for query
-                container: to store results in
+                ne: Northeast Coordinate object
+                sw: Southwest Coordinate object
             return:
-                container: updated container after adding sidewalk data 
+                geometry: string representing API url with bounding box around coordinates
         """
 
-        for box in boxes:
-            # Unpack tuple of coordinates
-            container.append( self.data_source.get_sidewalks_inbox(*box) )
-        return container
+        # Requires LON, LAT but google maps is LAT, LON
+        box_ne = '{}%2C{}'.format(ne.lon, ne.lat)
+        box_sw = '{}%2C{}'.format(sw.lon, sw.lat)
+
+        geometry = '&geometry={}%2C{}&geometryType=esriGeometryEnvelope&inSR=4326&spatialRel=esriSpatialRelIntersects'.format(box_ne, box_sw)
+
+        return geometry
 
-    def __process_volumes(self, boxes, container):
+    def __corridor(self, along_route, meters, tolerance):
         """
             purpose:
-                Thread target; get traffic volume data for each box
+                Create the query parameters that select the features within METERS of a WalkingRoute
             parameters:
-                boxes: bounding boxes for query
-                container: to store results in
+                along_route: WalkingRoute object
+                meters: corridor half width in metres
+                tolerance: degrees to simplify the route by; 0 sends every point
             return:
-                container: updated container after adding traffic volume data
+                params: dict of API parameters
         """
-        
-        for box in boxes:
+
+        line = along_route.line.simplify(tolerance) if tolerance else along_route.line
+
+        # Route lines are already LON, LAT
+        geometry = {'paths': [[list(point) for point in line.coords]], 'spatialReference': {'wkid': 4326}}
+
+        return {
+            'where': '1=1',
+            'geometry': json.dumps(geometry),
+            'geometryType': 'esriGeometryPolyline',
+            'inSR': 4326,
+            'spatialRel': 'esriSpatialRelIntersects',
+            'distance': meters,
+            'units': 'esriSRUnit_Meter',
+        }
+
+    def wire_format(self, layer):
+        """
+            purpose:
+                Pick the encoding of the responses to bounding box queries of a layer. With the auto format the
+                layer is asked once which formats it supports, and compact JSON is used if it can't be asked
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            return:
+                format: 'json', 'compact' or 'pbf'
+        """
+
+        if self.wire != 'auto':
+            return self.wire
+
+        with self.__formats_lock:
+            if layer not in self.__formats:
+                try:
+                    api_result = self.session.get('{}/{}?f=json'.format(OPENDATA_URL, layer))
+                    supported = json.loads(api_result.text).get('supportedQueryFormats', '')
+                except Exception:
+                    # Every layer supports compact JSON
+                    supported = ''
+
+                self.__formats[layer] = 'pbf' if 'pbf' in supported.lower() else 'compact'
+
+            return self.__formats[layer]
+
+    def __wire_params(self, layer, wire, ne, sw):
+        """
+            purpose:
+                Create the API endpoint string that asks for a compact encoding of the features within a bounding box
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                wire: 'json', 'compact' or 'pbf'
+                ne: Northeast Coordinate object
+                sw: Southwest Coordinate object
+            return:
+                params: string, empty for json
+        """
+
+        if wire == 'json':
+            return ''
+
+        # Integer coordinates in steps of WIRE_TOLERANCE over the box. Edit mode keeps every feature, even the
+        # ones that share a step
+        quantization = {
+            'mode': 'edit',
+            'originPosition': 'upperLeft',
+            'tolerance': WIRE_TOLERANCE,
+            'extent': {'xmin': sw.lon, 'ymin': sw.lat, 'xmax': ne.lon, 'ymax': ne.lat, 'spatialReference': {'wkid': 4326}},
+        }
+
+        params = '&quantizationParameters={}'.format(quote(json.dumps(quantization)))
+
+        # Drop the vertices of lines that do not move them by more than the tolerance
+        if layer != LIGHTS_LAYER:
+            params += '&maxAllowableOffset={}'.format(WIRE_TOLERANCE)
+
+        return params
+
+    def query_url(self, layer, geometry, box=None, wire=None):
+        """
+            purpose:
+                Create the API endpoint string of a layer query
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                geometry: string representing the API url geometry parameters
+                box: optional; (ne, sw) corners of the bounding box of GEOMETRY. The compact formats need it,
+                     without it the response is full precision JSON
+                wire: optional; encoding of the response when BOX is given, see wire_format. Asked for when not given
+            return:
+                url: string
+        """
+
+        if box is None:
+            wire = 'json'
+        elif wire is None:
+            wire = self.wire_format(layer)
+
+        params = self.__wire_params(layer, wire, *box) if box is not None else ''
+
+        # Base URL
+        return '{}/{}/query?where=1%3D1&outFields={}{}{}&outSR=4326&f={}'.format(OPENDATA_URL, layer, LAYER_FIELDS[layer], geometry,
+                                                                                  params, 'pbf' if wire == 'pbf' else 'json')
+
+    def layers_url(self, layers, geometry):
+        """
+            purpose:
+                Create the API endpoint string of a map service query, which queries several layers at once
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                geometry: string representing the API url geometry parameters
+            return:
+                url: string
+        """
+
+        # Filter and fields of each layer
+        layer_defs = json.dumps([{'layerId': layer, 'where': '1=1', 'outFields': LAYER_FIELDS[layer]} for layer in layers])
+
+        return '{}/query?layerDefs={}{}&returnGeometry=true&outSR=4326&f=json'.format(OPENDATA_URL, quote(layer_defs), geometry)
+
+    def box_url(self, layer, ne_corner, sw_corner, wire=None):
+        """
+            purpose:
+                Create the API endpoint string of a layer query within a bounding box
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+                wire: optional; encoding of the response, see query_url
+            return:
+                url: string
+        """
+
+        return self.query_url(layer, self.__bounding_box(ne_corner, sw_corner), (ne_corner, sw_corner), wire)
+
+    def query(self, layer, geometry, box=None):
+        """
+            purpose:
+                Query one OpenData layer for the features within a geometry
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                geometry: string representing the API url geometry parameters
+                box: optional; (ne, sw) corners of the bounding box of GEOMETRY, see query_url
+            return:
+                features: LightSet for street lights, else LineSet
+        """
+
+        return parse_features(layer, self.query_json(layer, geometry, box)['features'])
+
+    def query_json(self, layer, geometry, box=None):
+        """
+            purpose:
+                Same as query, without parsing the response
+            return:
+                api_response: JSON response of the server. Its features are already parsed when streaming or in
+                              a compact format
+        """
+
+        wire = self.wire_format(layer) if box is not None else 'json'
+
+        with self.session.get(self.query_url(layer, geometry, box), stream=self.stream and wire != 'pbf') as api_result:
+            if wire == 'pbf':
+                return parse_pbf(layer, api_result.content)
+
+            return dequantize_response(layer, self.__decode(layer, api_result))
+
+    def __decode(self, layer, api_result):
+        """
+            purpose:
+                Decode the response to a features query of a layer
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                api_result: requests Response, opened with stream=True when streaming
+            return:
+                api_response: see query_json
+        """
+
+        if not self.stream:
+            return json.loads(api_result.text)
+
+        # Undo any gzip or deflate encoding while reading
+        api_result.raw.decode_content = True
+
+        return stream_response(layer, api_result.raw)
+
+    def query_layers_json(self, layers, geometry):
+        """
+            purpose:
+                Query several OpenData layers for the features within a geometry in one request
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                geometry: string representing the API url geometry parameters
+            return:
+                api_responses: dict of layer to its part of the response, shaped like the response of query_json
+        """
+
+        api_result = self.session.get(self.layers_url(layers, geometry))
+        api_response = json.loads(api_result.text)
+
+        return {layer['id']: layer for layer in api_response['layers']}
+
+    def get_inbox_layers(self, layers, ne_corner, sw_corner):
+        """
+            purpose:
+                Same as get_inbox for several layers at once, in one request
+            return:
+                features: dict of layer to LightSet for street lights, else LineSet
+        """
+
+        api_responses = self.query_layers_json(layers, self.__bounding_box(ne_corner, sw_corner))
+
+        return {layer: parse_features(layer, api_responses[layer]['features']) for layer in layers}
+
+    def get_inbox(self, layer, ne_corner, sw_corner):
+        """
+            purpose:
+                Get all features of a layer within a bounding box
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+            return:
+                features: LightSet for street lights, else LineSet
+        """
+
+        return self.query(layer, self.__bounding_box(ne_corner, sw_corner), (ne_corner, sw_corner))
+
+    def get_tile(self, layer, tile, within=None):
+        """
+            purpose:
+                Get all features of a layer within a Tile, from the cache when possible. Tiles with too many
+                features for one query are fetched through their children, see fetch_tile
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                tile: Tile object
+                within: optional; (ne, sw) corners of the area of interest. Children outside of it are skipped
+            return:
+                features: LightSet for street lights, else LineSet
+        """
+
+        tiles = [tile]
+        parts = []
+
+        while tiles:
+            features, children = self.fetch_tile(layer, tiles.pop(), within)
+
+            if features is not None:
+                parts.append(features)
+            tiles.extend(children)
+
+        if not parts:
+            return parse_features(layer, [])
+
+        if layer == LIGHTS_LAYER:
+            return LightSet.concat(parts)
+
+        return LineSet.concat(parts)
+
+    def fetch_tile(self, layer, tile, within=None):
+        """
+            purpose:
+                Get the features of a layer within one Tile, or the children to fetch instead when the tile holds
+                more features than one query returns. Such tiles are remembered in SPLITS
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                tile: Tile object
+                within: optional; (ne, sw) corners of the area of interest. Children outside of it are skipped
+            return:
+                (features, children): features is None when the tile is split into the CHILDREN Tiles
+        """
+
+        children = self.split_children(layer, tile, within)
+        if children is not None:
+            return None, children
+
+        features = self.cached_tile(layer, tile)
+        if features is not None:
+            return features, []
+
+        claimed, waiting = self.claim_tiles([layer], tile)
+
+        # Another thread is querying this tile; use its result, or query it here if it failed
+        if waiting:
+            waiting[layer].wait()
+            return self.fetch_tile(layer, tile, within)
+
+        try:
+            return self.tile_response(layer, tile, self.query_json(layer, self.__bounding_box(*tile), tuple(tile)), within)
+        finally:
+            self.release_tiles(claimed, tile)
+
+    def fetch_tile_layers(self, layers, tile, within=None):
+        """
+            purpose:
+                Same as fetch_tile for several layers of one Tile. The layers that are neither split nor cached
+                are fetched in one request
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                tile: Tile object
+                within: optional; (ne, sw) corners of the area of interest. Children outside of it are skipped
+            return:
+                results: List of (layer, features, children), see fetch_tile
+        """
+
+        results = []
+        missing = []
+
+        for layer in layers:
+            children = self.split_children(layer, tile, within)
+            features = self.cached_tile(layer, tile) if children is None else None
+
+            if children is not None:
+                results.append((layer, None, children))
+            elif features is not None:
+                results.append((layer, features, []))
+            else:
+                missing.append(layer)
+
+        claimed, waiting = self.claim_tiles(missing, tile)
+
+        if claimed:
+            try:
+                api_responses = self.query_layers_json(claimed, self.__bounding_box(*tile))
+
+                for layer in claimed:
+                    results.append((layer,) + self.tile_response(layer, tile, api_responses[layer], within))
+            finally:
+                self.release_tiles(claimed, tile)
+
+        # Layers another thread was querying are looked up again once it is done
+        if waiting:
+            for event in waiting.values():
+                event.wait()
+
+            results.extend(self.fetch_tile_layers(list(waiting), tile, within))
+
+        return results
+
+    def claim_tiles(self, layers, tile):
+        """
+            purpose:
+                Mark the layers of a Tile as being queried by this thread, so concurrent collects of overlapping
+                areas, like a prefetch and the collect it was started for, query each tile once. Only done when
+                there is a cache to share the results through
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                tile: Tile object
+            return:
+                (claimed, waiting): the layers this thread must query and then pass to release_tiles, and a dict
+                                    of the layers another thread is querying to the Event set when it is done
+        """
+
+        if self.cache is None:
+            return list(layers), {}
+
+        claimed = []
+        waiting = {}
+
+        with self.__inflight_lock:
+            for layer in layers:
+                event = self.__inflight.get((layer,) + tile.key)
+
+                if event is None:
+                    self.__inflight[(layer,) + tile.key] = Event()
+                    claimed.append(layer)
+                else:
+                    waiting[layer] = event
+
+        return claimed, waiting
+
+    def release_tiles(self, layers, tile):
+        """
+            purpose:
+                Wake the threads waiting for the layers of a Tile claimed with claim_tiles, whether or not the
+                query succeeded
+        """
+
+        if self.cache is None:
+            return
+
+        with self.__inflight_lock:
+            for layer in layers:
+                self.__inflight.pop((layer,) + tile.key).set()
+
+    def split_children(self, layer, tile, within=None):
+        """
+            purpose:
+                Get the children to fetch instead of a tile already known to be split
+            return:
+                children: List of Tile objects, None if the tile is not split
+        """
+
+        if self.splits is None or not self.splits.is_split(layer, tile):
+            return None
+
+        children = tile.children()
+
+        if within is not None:
+            children = [child for child in children if child.intersects(*within)]
+
+        return children
+
+    def tile_response(self, layer, tile, api_response, within=None):
+        """
+            purpose:
+                Handle the response of the query of one Tile. Complete responses are parsed and cached, truncated
+                ones split the tile
+            return:
+                (features, children): see fetch_tile
+        """
+
+        if api_response.get('exceededTransferLimit'):
+            if self.splits is not None and self.splits.split(layer, tile):
+                return None, self.split_children(layer, tile, within)
+
+            print('OpenData layer {} truncated in {}'.format(layer, tile))
+
+        features = parse_features(layer, api_response['features'])
+        self.cache_tile(layer, tile, features)
+
+        return features, []
+
+    def cached_tile(self, layer, tile):
+        """
+            purpose:
+                Look up the features of a layer within a Tile in the cache
+            return:
+                features: LightSet for street lights, else LineSet. None if not cached
+        """
+
+        if self.cache is None:
+            return None
+
+        return self.cache.get((layer,) + tile.key)
+
+    def cache_tile(self, layer, tile, features):
+        """
+            purpose:
+                Store the features of a layer within a Tile in the cache, if there is one
+        """
+
+        if self.cache is not None:
+            self.cache.put((layer,) + tile.key, features)
+
+    def get_object_ids(self, layer):
+        """
+            purpose:
+                Get the ID of every feature in a layer. Not subject to the 1000 element request limit
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+            return:
+                ids: Sorted list of IDs
+        """
+
+        url = '{}/{}/query?where=1%3D1&returnIdsOnly=true&f=json'.format(OPENDATA_URL, layer)
+
+        api_result = self.session.get(url)
+        api_response = json.loads(api_result.text)
+
+        return sorted(api_response['objectIds'] or [])
+
+    def count_box(self, layer, ne_corner, sw_corner):
+        """
+            purpose:
+                Count the features of a layer within a bounding box without downloading them. Not subject to
+                the 1000 element request limit
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+            return:
+                count: int
+        """
+
+        url = '{}/{}/query?where=1%3D1{}&returnCountOnly=true&f=json'.format(OPENDATA_URL, layer,
+                                                                            self.__bounding_box(ne_corner, sw_corner))
+
+        api_result = self.session.get(url)
+        api_response = json.loads(api_result.text)
+
+        return api_response['count']
+
+    def measure_tiles(self, layers, tiles, workers=1):
+        """
+            purpose:
+                Count the features of each layer within each tile into the TileSplits, so tiles that hold more
+                than one query returns are split before their first query
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                tiles: Sequence of Tile objects, e.g. split_tiles over the city at START_TILE_LEVEL
+                workers: optional; concurrent count queries
+        """
+
+        if self.splits is None:
+            raise ValueError('Measuring tiles requires TileSplits')
+
+        def measure(layer, tile):
+            self.splits.measure(layer, tile, self.count_box(layer, *tile))
+
+        jobs = [(layer, tile) for layer in layers for tile in tiles]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda job: measure(*job), jobs))
+
+    def get_by_ids(self, layer, ids):
+        """
+            purpose:
+                Get the features of a layer by ID. Keep IDS below the 1000 element request limit
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                ids: List of IDs
+            return:
+                features: LightSet for street lights, else LineSet
+        """
+
+        # POST so long ID lists do not run into URL length limits
+        api_response = self.post_json(layer, {
+            'objectIds': ','.join(str(i) for i in ids),
+            'outFields': LAYER_FIELDS[layer],
+            'outSR': 4326,
+        }, features=True)
+
+        return parse_features(layer, api_response['features'])
+
+    def post_json(self, layer, params, features=False):
+        """
+            purpose:
+                Query one OpenData layer through a POST, for parameters too long for a URL
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                params: dict of API parameters
+                features: optional; default False. If true, the query returns features and the response may be
+                          streamed, see query_json
+            return:
+                api_response: JSON response of the server
+        """
+
+        stream = self.stream and features
+
+        with self.session.post('{}/{}/query'.format(OPENDATA_URL, layer), data=dict(params, f='json'), stream=stream) as api_result:
+            if stream:
+                return self.__decode(layer, api_result)
+
+            return json.loads(api_result.text)
+
+    def get_corridor(self, layer, along_route, distance=POLYGON_BUFFER, tolerance=CORRIDOR_TOLERANCE):
+        """
+            purpose:
+                Get the features of a layer near a WalkingRoute. The server matches the features against a
+                corridor around the route, so unlike the bounding box queries it only returns relevant data
+            parameters:
+                layer: One of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                along_route: WalkingRoute object
+                distance: optional; corridor half width in degrees
+                tolerance: optional; degrees to simplify the route by before it is sent
+            return:
+                features: LightSet for street lights, else LineSet
+        """
+
+        # Wide enough to cover the route polygon north to south, where a degree is longest
+        params = self.__corridor(along_route, (distance + tolerance) * METERS_PER_DEGREE, tolerance)
+
+        api_response = self.post_json(layer, dict(params, outFields=LAYER_FIELDS[layer], outSR=4326), features=True)
+        if not api_response.get('exceededTransferLimit'):
+            return parse_features(layer, api_response['features'])
+
+        # Too many features for one response. ID queries are not limited, so get the features by ID in pages
+        ids = self.post_json(layer, dict(params, returnIdsOnly='true'))['objectIds'] or []
+        pages = [self.get_by_ids(layer, ids[i:i + MAX_RECORD_COUNT]) for i in range(0, len(ids), MAX_RECORD_COUNT)]
+
+        if layer == LIGHTS_LAYER:
+            return LightSet.concat(pages)
+
+        return LineSet.concat(pages) if pages else parse_features(layer, [])
+
+    def count_corridor(self, layer, along_route, distance=POLYGON_BUFFER, tolerance=0):
+        """
+            purpose:
+                Count the features of a layer near a WalkingRoute without downloading them, see get_corridor.
+                The corridor is as wide as the route polygon across the route on average, see corridor_meters
+            return:
+                count: int
+        """
+
+        params = self.__corridor(along_route, corridor_meters(along_route.coords, distance + tolerance), tolerance)
+
+        return self.post_json(layer, dict(params, returnCountOnly='true'))['count']
+
+    def get_street_lights_onroute(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get all street lights along WalkingRoute
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                street_lights: LightSet of the street lights that are within the bounds of the route
+        """
+
+        return self.query(LIGHTS_LAYER, self.__bounding_box_route(along_route))
+
+    def get_street_lights_corridor(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get the street lights near a WalkingRoute, see get_corridor
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                street_lights: LightSet of the street lights within the corridor around the route
+        """
+
+        return self.get_corridor(LIGHTS_LAYER, along_route)
+
+    def count_street_lights_corridor(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Count the street lights near a WalkingRoute, for when only the light density is needed
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                count: Number of street lights within the corridor around the route
+        """
+
+        return self.count_corridor(LIGHTS_LAYER, along_route)
+
+    def get_street_lights_inbox(self, ne_corner, sw_corner):
+        """
+            purpose:
+                Get all street lights within a bounding box
+            parameters:
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+            return:
+                street_lights: LightSet of the street lights that are within the bounds of the box
+        """
+
+        return self.get_inbox(LIGHTS_LAYER, ne_corner, sw_corner)
+
+    def get_sidewalks_onroute(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get all sidewalk data along WalkingRoute
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                sidewalks: LineSet of the sidewalks that are within the bounds of the route
+        """
+
+        return self.query(SIDEWALKS_LAYER, self.__bounding_box_route(along_route))
+    
+    def get_sidewalks_corridor(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get the sidewalks near a WalkingRoute, see get_corridor
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                sidewalks: LineSet of the sidewalks within the corridor around the route
+        """
+
+        return self.get_corridor(SIDEWALKS_LAYER, along_route)
+
+    def get_sidewalks_inbox(self, ne_corner, sw_corner):
+        """
+            purpose:
+                Get all sidewalk data within a bounding box
+            parameters:
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+            return:
+                sidewalks: LineSet of the sidewalks that are within the bounds of the box
+        """
+
+        return self.get_inbox(SIDEWALKS_LAYER, ne_corner, sw_corner)
+
+    def get_traffic_volumes_onroute(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get all traffic volume data along WalkingRoute
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                volumes: LineSet of the traffic volumes that are within the bounds of the route
+        """
+
+        return self.query(VOLUMES_LAYER, self.__bounding_box_route(along_route))
+
+    def get_traffic_volumes_corridor(self, along_route : WalkingRoute):
+        """
+            purpose:
+                Get the traffic volumes near a WalkingRoute, see get_corridor
+            parameters:
+                along_route: WalkingRoute object
+            return:
+                volumes: LineSet of the traffic volumes within the corridor around the route
+        """
+
+        return self.get_corridor(VOLUMES_LAYER, along_route)
+
+    def get_traffic_volumes_inbox(self, ne_corner, sw_corner):
+        """
+            purpose:
+                Get all traffic volume data within a bounding box
+            parameters:
+                ne_corner: Northeast Coordinate object
+                sw_corner: Southwest Coordinate object
+            return:
+                volumes: LineSet of the traffic volumes that are within the bounds of the box
+        """
+
+        return self.get_inbox(VOLUMES_LAYER, ne_corner, sw_corner)
+
+class Prefetch:
+    """
+        purpose:
+            Handle of a collect started in the background by DataThreadPool.prefetch
+    """
+
+    def __init__(self):
+        self.future = Future()
+        self.stopped = Event()
+
+    def stop(self):
+        """
+            purpose:
+                Drop the queries of the prefetch that have not started, e.g. once the area that is really needed
+                is known. The running ones still finish and fill the cache
+        """
+
+        self.stopped.set()
+
+    def result(self, timeout=None):
+        """
+            purpose:
+                Wait for the prefetch to finish
+            return:
+                ( LightSet, LineSet of sidewalks, LineSet of traffic volumes ) of the tiles it fetched
+        """
+
+        return self.future.result(timeout)
+
+class DataThreadPool:
+    """
+        purpose:
+            Streamline interact with OpenData helper class. Automatically multithreads API call
+            to avoid hitting the maximum API request limit.
+
+            Every box and layer query is a task on one executor shared by the whole process. Idle workers take
+            the next queued task, so a slow box does not hold back the boxes behind it, and the number of
+            queries in flight to the OpenData server is capped however many requests are being served
+    """
+
+    # Executor shared by every DataThreadPool of the process; created on first use
+    _executor = None
+    _executor_lock = Lock()
+
+    # Tasks waiting for a worker, tasks being run and tasks done since start up
+    _queued = 0
+    _active = 0
+    _completed = 0
+
+    def __init__(self, cache=None, session=None, pool_size=15, splits=None, combined=False, stream=False, wire='json'):
+        """
+            parameters:
+                cache: optional; LRUCache for the features of each Tile, see OpenDataLondon
+                session: optional; PooledSession shared by every worker. One is created when not given
+                pool_size: optional; workers of the shared executor, if it does not exist yet, and connections of
+                           the created session
+                splits: optional; TileSplits for tiles with too many features for one query, see OpenDataLondon
+                combined: optional; default False. If true, every box is queried for all layers in one request
+                          through the map service instead of one request per layer
+                stream: optional; default False. If true, layer query responses are decoded while they are read,
+                        see FeatureStream
+                wire: optional; default 'json'. Encoding of the layer query responses, see OpenDataLondon
+        """
+
+        if session is None:
+            session = PooledSession(pool_size)
+
+        self.data_source = OpenDataLondon(cache, session, splits, stream, wire)
+        self.pool_size = pool_size
+        self.combined = combined
+
+    @classmethod
+    def executor(cls, max_workers=15):
+        """
+            purpose:
+                Get the executor shared by the process, creating it with MAX_WORKERS workers on first use.
+                It is shut down when the process exits, after the queued tasks are done
+            return:
+                executor: ThreadPoolExecutor
+        """
+
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='opendata')
+                atexit.register(cls.shutdown)
+
+            return cls._executor
+
+    @classmethod
+    def shutdown(cls, wait=True):
+        """
+            purpose:
+                Stop the shared executor. Tasks already queued still run; a later collect starts a new executor
+            parameters:
+                wait: optional; block until the queued tasks are done
+        """
+
+        with cls._executor_lock:
+            executor, cls._executor = cls._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    @classmethod
+    def stats(cls):
+        """
+            purpose:
+                Report the load of the shared executor
+            return:
+                stats: dict with workers, queued (queue depth), active and completed task counts
+        """
+
+        with cls._executor_lock:
+            workers = cls._executor._max_workers if cls._executor is not None else 0
+
+            return {'workers': workers, 'queued': cls._queued, 'active': cls._active, 'completed': cls._completed}
+
+    @classmethod
+    def __count(cls, queued=0, active=0, completed=0):
+        with cls._executor_lock:
+            cls._queued += queued
+            cls._active += active
+            cls._completed += completed
+
+    def __submit(self, executor, task, *args):
+        # Queue TASK on the shared executor, counted in stats
+        self.__count(queued=1)
+        return executor.submit(self.__run, task, *args)
+
+    def __run(self, task, *args):
+        self.__count(queued=-1, active=1)
+
+        try:
+            return task(*args)
+        finally:
+            self.__count(active=-1, completed=1)
+
+    def collect(self, boxes, within=None, stop=None):
+        """
+            purpose:
+                Split the process of collecting relevant data from the OpenData API into one query per box and
+                layer, run by the shared executor, to avoid running into the 1000 element request limit.
+                Threaded approach chosen so each API call does not need to be made sequentially. Tiles that
+                turn out to be split are replaced by queries of their children
+            params:
+                boxes = list of Tile objects, or of (Coordinate, Coordinate) boxes, that defines the API query area.
+                        Through testing, 25 or 36 boxes is a good number for entire city. Tiles are cached
+                within = optional; (ne, sw) corners of the area of interest. Children of split tiles outside of it
+                         are skipped
+                stop = optional; threading Event. Once set, queries that have not started are dropped and the
+                       collect returns what the running ones found
+            returns:
+                ( LightSet, LineSet of sidewalks, LineSet of traffic volumes )
+        """
+
+        executor = self.executor(self.pool_size)
+        layers = (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER)
+
+        # Query results per layer
+        results = {layer: [] for layer in layers}
+        errors = []
+
+        # One task per box, or per box and layer
+        if self.combined:
+            tasks = [(layers, box) for box in boxes]
+        else:
+            tasks = [((layer,), box) for box in boxes for layer in layers]
+
+        pending = set()
+
+        while tasks or pending:
+            if stop is not None and stop.is_set():
+                for future in pending:
+                    future.cancel()
+                tasks = []
+
+            for task_layers, box in tasks:
+                pending.add(self.__submit(executor, self.__process, task_layers, box, within))
+            tasks = []
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            # Layers to query for each child of a split tile
+            children = {}
+
+            for future in done:
+                if future.cancelled():
+                    continue
+
+                try:
+                    fetched = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+
+                for layer, features, split in fetched:
+                    if features is not None:
+                        results[layer].append(features)
+
+                    for child in split:
+                        children.setdefault(child, []).append(layer)
+
+            tasks = [(tuple(child_layers), child) for child, child_layers in children.items()]
+
+        # The first failure is raised once every query is done so no task outlives the request
+        if errors:
+            raise errors[0]
+
+        # Join the per box sets and remove duplicates in case bounding boxes overlap
+        lights = LightSet.concat(results[LIGHTS_LAYER]).unique()
+        sidewalks = LineSet.concat(results[SIDEWALKS_LAYER]).unique()
+        volumes = LineSet.concat(results[VOLUMES_LAYER]).unique()
+
+        return lights, sidewalks, volumes
+
+    def prefetch(self, boxes, within=None):
+        """
+            purpose:
+                Start collecting BOXES in the background to fill the tile cache ahead of a collect that will
+                likely need them. A later collect shares the tiles still being fetched instead of querying them
+                again, see OpenDataLondon.claim_tiles. Without a cache nothing is started
+            params:
+                boxes, within = see collect
+            returns:
+                prefetch: Prefetch object, or None without a cache
+        """
+
+        if self.data_source.cache is None:
+            return None
+
+        prefetch = Prefetch()
+
+        # Not an executor task; collect waits on its own tasks and would hold a worker meanwhile
+        def run():
+            try:
+                prefetch.future.set_result(self.collect(boxes, within, prefetch.stopped))
+            except Exception as e:
+                prefetch.future.set_exception(e)
+
+        Thread(target=run, name='opendata-prefetch', daemon=True).start()
+
+        return prefetch
+
+    def __process(self, layers, box, within=None):
+        """
+            purpose:
+                Executor task; get the data of some layers for one box
+            parameters:
+                layers: Sequence of LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+                box: bounding box or Tile for query
+                within: optional; area of interest, see collect
+            return:
+                results: List of (layer, features, children), see OpenDataLondon.fetch_tile_layers
+        """
+
+        # A single layer goes through the layer query even in combined mode
+        if len(layers) == 1:
+            layer = layers[0]
+
+            if isinstance(box, Tile):
+                return [(layer,) + self.data_source.fetch_tile(layer, box, within)]
+
             # Unpack tuple of coordinates
-            container.append( self.data_source.get_traffic_volumes_inbox(*box) )
-        return container
\ No newline at end of file
+            return [(layer, self.data_source.get_inbox(layer, *box), [])]
+
+        if isinstance(box, Tile):
+            return self.data_source.fetch_tile_layers(layers, box, within)
+
+        features = self.data_source.get_inbox_layers(layers, *box)
+
+        return [(layer, features[layer], []) for layer in layers]
+
+    def collect_routes(self, routes, count_lights=False):
+        """
+            purpose:
+                Collect only the data near each route through corridor queries, one query per route and layer
+                run by the shared executor. See OpenDataLondon.get_corridor
+            params:
+                routes = list of WalkingRoute objects
+                count_lights = optional; default False. If true, street lights are counted per route instead of
+                               downloaded
+            returns:
+                ( LightSet or list of light counts per route, LineSet of sidewalks, LineSet of traffic volumes )
+        """
+
+        executor = self.executor(self.pool_size)
+
+        if count_lights:
+            lights = [self.__submit(executor, self.data_source.count_corridor, LIGHTS_LAYER, route) for route in routes]
+        else:
+            lights = [self.__submit(executor, self.data_source.get_corridor, LIGHTS_LAYER, route) for route in routes]
+
+        sidewalks = [self.__submit(executor, self.data_source.get_corridor, SIDEWALKS_LAYER, route) for route in routes]
+        volumes = [self.__submit(executor, self.data_source.get_corridor, VOLUMES_LAYER, route) for route in routes]
+
+        # Wait for every query before raising the first failure, like collect
+        wait(lights + sidewalks + volumes)
+
+        lights = [future.result() for future in lights]
+        if not count_lights:
+            lights = LightSet.concat(lights).unique()
+
+        # Routes share streets, remove the duplicates
+        sidewalks = LineSet.concat(future.result() for future in sidewalks).unique()
+        volumes = LineSet.concat(future.result() for future in volumes).unique()
+
+        return lights, sidewalks, volumes
+
+class AsyncDataPool:
+    """
+        purpose:
+            Alternative to DataThreadPool that issues every box and layer query as a task on one asyncio event loop.
+            Queries start as soon as a slot frees up, so one slow box does not hold back the boxes behind it.
+            The loop runs in a background thread and is shared by all requests of the process, which also caps
+            the number of queries in flight to the OpenData server. Responses are parsed on the default executor
+            of the loop, so parsing one does not hold up the others
+    """
+
+    def __init__(self, cache=None, concurrency=15, timeout=READ_TIMEOUT, splits=None, stream=False, wire='json'):
+        """
+            parameters:
+                cache: optional; LRUCache for the features of each Tile, see OpenDataLondon
+                concurrency: optional; maximum number of queries in flight
+                timeout: optional; seconds each query may take once it is in flight
+                splits: optional; TileSplits for tiles with too many features for one query, see OpenDataLondon
+                stream: optional; default False. If true, responses are decoded while they are read, see FeatureStream
+                wire: optional; default 'json'. Encoding of the responses, see OpenDataLondon
+        """
+
+        self.data_source = OpenDataLondon(cache, splits=splits, stream=stream, wire=wire)
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        # Wire format of each layer, settled on first use, see __wire_format
+        self.__formats = {}
+
+        self.__loop = None
+        self.__lock = Lock()
+
+        # Created on the event loop on first use
+        self.__session = None
+        self.__semaphore = None
+
+    def __event_loop(self):
+        # Start the background event loop on first use
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                Thread(target=self.__loop.run_forever, daemon=True).start()
+
+            return self.__loop
+
+    async def __wire_format(self, layer):
+        # With the auto format the layer is asked once, by a blocking request that runs on the default executor
+        if layer not in self.__formats:
+            self.__formats[layer] = await asyncio.get_running_loop().run_in_executor(None, self.data_source.wire_format, layer)
+
+        return self.__formats[layer]
+
+    async def __get(self, url, layer, wire):
+        import aiohttp
+
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.__semaphore:
+            return await asyncio.wait_for(self.__request(url, layer, wire), self.timeout)
+
+    async def __request(self, url, layer, wire):
+        async with self.__session.get(url) as response:
+            if wire == 'pbf':
+                return await self.__parse(parse_pbf, layer, await response.read())
+
+            if not self.data_source.stream:
+                body = await response.read()
+                return await self.__parse(lambda: dequantize_response(layer, json.loads(body)))
+
+            import ijson
+
+            # Decode while reading, see FeatureStream. The events arrive with the data, so only these stay on the loop
+            stream = FeatureStream(layer)
+
+            async for prefix, event, value in ijson.parse_async(response.content, use_float=True, buf_size=STREAM_CHUNK):
+                stream.feed(prefix, event, value)
+
+            return await self.__parse(dequantize_response, layer, stream.response())
+
+    @staticmethod
+    async def __parse(function, *args):
+        # Run FUNCTION on the default executor of the running loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def __fetch(self, layer, box, within=None):
+        """
+            purpose:
+                Task; get the data of one layer for one box or Tile, from the cache when possible. Split tiles
+                are fetched through their children
+            return:
+                (layer, parts): parts is a list of LightSet for street lights, else of LineSet
+        """
+
+        wire = await self.__wire_format(layer)
+
+        if not isinstance(box, Tile):
+            api_response = await self.__get(self.data_source.box_url(layer, *box, wire), layer, wire)
+            return layer, [await self.__parse(parse_features, layer, api_response['features'])]
+
+        children = self.data_source.split_children(layer, box, within)
+
+        if children is None:
+            features = self.data_source.cached_tile(layer, box)
+            if features is not None:
+                return layer, [features]
+
+            api_response = await self.__get(self.data_source.box_url(layer, *box, wire), layer, wire)
+            features, children = await self.__parse(self.data_source.tile_response, layer, box, api_response, within)
+
+            if features is not None:
+                return layer, [features]
+
+        results = await asyncio.gather(*[self.__fetch(layer, child, within) for child in children])
+
+        return layer, list(chain.from_iterable(parts for layer, parts in results))
+
+    async def collect_async(self, boxes, within=None):
+        """
+            purpose:
+                Coroutine version of collect; must run on the pool's event loop
+        """
+
+        results = await asyncio.gather(*[self.__fetch(layer, box, within) for box in boxes
+                                            for layer in (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER)])
+
+        def parts(of_layer):
+            return chain.from_iterable(parts for layer, parts in results if layer == of_layer)
+
+        lights = LightSet.concat(parts(LIGHTS_LAYER)).unique()
+        sidewalks = LineSet.concat(parts(SIDEWALKS_LAYER)).unique()
+        volumes = LineSet.concat(parts(VOLUMES_LAYER)).unique()
+
+        return lights, sidewalks, volumes
+
+    def collect(self, boxes, within=None):
+        """
+            purpose:
+                Same as DataThreadPool.collect. Blocks the calling thread until every query is done
+            params:
+                boxes = list of Tile objects, or of (Coordinate, Coordinate) boxes, that defines the API query area
+                within = optional; (ne, sw) corners of the area of interest, see DataThreadPool.collect
+            returns:
+                ( LightSet, LineSet of sidewalks, LineSet of traffic volumes )
+        """
+
+        return asyncio.run_coroutine_threadsafe(self.collect_async(boxes, within), self.__event_loop()).result()
+
+    def close(self):
+        """
+            purpose:
+                Close the connections and stop the event loop
+        """
+
+        with self.__lock:
+            if self.__loop is None:
+                return
+
+            if self.__session is not None:
+                asyncio.run_coroutine_threadsafe(self.__session.close(), self.__loop).result()
+                self.__session = None
+
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__loop = None
@@ -0,0 +1,314 @@
+"""
+    file: pbf.py
+    purpose:
+        Decode the protocol buffer (f=pbf) responses of ArcGIS layer queries, the Esri FeatureCollection format,
+        into numpy columns. Only the messages of feature queries are read, see FEATURE_RESULT
+"""
+
+import struct
+
+import numpy as np
+
+# Field numbers of the FeatureCollectionPBuffer messages that are read
+QUERY_RESULT = 2            # FeatureCollectionPBuffer.queryResult
+FEATURE_RESULT = 1          # QueryResult.featureResult
+EXCEEDED_LIMIT = 9          # FeatureResult.exceededTransferLimit
+TRANSFORM = 12              # FeatureResult.transform
+FIELDS = 13                 # FeatureResult.fields
+FEATURES = 15               # FeatureResult.features
+FIELD_NAME = 1              # Field.name
+ATTRIBUTES = 1              # Feature.attributes
+GEOMETRY = 2                # Feature.geometry
+LENGTHS = 2                 # Geometry.lengths
+COORDS = 3                  # Geometry.coords
+ORIGIN = 1                  # Transform.quantizeOriginPostion
+SCALE = 2                   # Transform.scale
+TRANSLATE = 3               # Transform.translate
+
+# Transform origins
+UPPER_LEFT = 0
+
+def _varint(buf, pos):
+    """
+        purpose:
+            Read a base 128 varint
+        return:
+            (value, position after it)
+    """
+
+    result = 0
+    shift = 0
+
+    while True:
+        byte = buf[pos]
+        pos += 1
+
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+
+        shift += 7
+
+def _skip(buf, pos, wire):
+    """
+        purpose:
+            Read the value of a field
+        return:
+            (value, position after it). Value is an int for varints, a (start, end) byte range for length
+            delimited fields and the raw bytes for fixed width fields
+    """
+
+    if wire == 0:
+        return _varint(buf, pos)
+    if wire == 2:
+        length, pos = _varint(buf, pos)
+        return (pos, pos + length), pos + length
+    if wire == 1:
+        return buf[pos:pos + 8], pos + 8
+    if wire == 5:
+        return buf[pos:pos + 4], pos + 4
+
+    raise ValueError('Unsupported protocol buffer wire type {}'.format(wire))
+
+def _fields(buf, start=0, end=None):
+    """
+        purpose:
+            Walk the fields of one message
+        parameters:
+            buf: bytes of the response
+            start, end: optional; byte range of the message
+        return:
+            generator of (field number, wire type, value), see _skip
+    """
+
+    pos = start
+    end = len(buf) if end is None else end
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        value, pos = _skip(buf, pos, key & 7)
+
+        yield key >> 3, key & 7, value
+
+def _message(buf, number, start=0, end=None):
+    # Byte range of the first field NUMBER of a message, None if missing
+    for field, wire, value in _fields(buf, start, end):
+        if field == number and wire == 2:
+            return value
+
+    return None
+
+def _value(buf, start, end):
+    """
+        purpose:
+            Read a Value message, the attribute of a feature. It holds a single field
+        return:
+            value: str, float, int or bool. None if empty
+    """
+
+    if start >= end:
+        return None
+
+    key, pos = _varint(buf, start)
+    number = key >> 3
+    value, _ = _skip(buf, pos, key & 7)
+
+    if number == 1:
+        return buf[value[0]:value[1]].decode('utf-8')
+    if number == 2:
+        return struct.unpack('<f', value)[0]
+    if number == 3:
+        return struct.unpack('<d', value)[0]
+    if number in (4, 8):
+        # Zigzag encoded
+        return (value >> 1) ^ -(value & 1)
+    if number in (5, 6, 7):
+        return value
+    if number == 9:
+        return bool(value)
+
+    return None
+
+def decode_varints(data, zigzag=False):
+    """
+        purpose:
+            Decode a run of packed varints at once
+        parameters:
+            data: bytes of the packed values
+            zigzag: optional; default False. If true, the values are sint64
+        return:
+            values: (N,) uint64 array, int64 when ZIGZAG
+    """
+
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64 if zigzag else np.uint64)
+
+    # The last byte of each varint has its high bit clear
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+
+    # Every byte contributes 7 bits, shifted by its position within its varint
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    values = np.add.reduceat((data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+
+    if not zigzag:
+        return values
+
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def undelta(deltas, counts):
+    """
+        purpose:
+            Undo the delta encoding of the vertices of several geometries. The first vertex of each geometry is
+            relative to the origin, every other one to the vertex before it
+        parameters:
+            deltas: (V,2) array of vertex deltas of all geometries
+            counts: (N,) int array of the vertices of each geometry
+        return:
+            vertices: (V,2) array
+    """
+
+    totals = np.cumsum(deltas, axis=0)
+
+    # Running total up to the first vertex of each geometry
+    starts = np.cumsum(counts) - counts
+    before = np.zeros((len(counts), 2), dtype=totals.dtype)
+    before[starts > 0] = totals[starts[starts > 0] - 1]
+
+    return totals - np.repeat(before, counts, axis=0)
+
+def dequantize(quantized, scale, translate, upper_left=True):
+    """
+        purpose:
+            Turn quantized integer vertices back into map units with the transform of the response
+        parameters:
+            quantized: (V,2) array of vertices
+            scale: (x, y) map units per step
+            translate: (x, y) map units of the origin
+            upper_left: optional; default True. If true, y steps go down from the origin
+        return:
+            (x, y): (V,) float arrays
+    """
+
+    x = translate[0] + quantized[:, 0] * scale[0]
+
+    if upper_left:
+        return x, translate[1] - quantized[:, 1] * scale[1]
+
+    return x, translate[1] + quantized[:, 1] * scale[1]
+
+def decode_features(buf):
+    """
+        purpose:
+            Decode the response of a layer query made with f=pbf
+        parameters:
+            buf: bytes of the response
+        return:
+            result: dict with
+                exceededTransferLimit - bool
+                attributes - dict of field name to the list of values of every feature
+                coords - (V,2) float array of the (x, y) vertices of the first part of every feature
+                offsets - (N+1,) int array; the vertices of feature i are coords[offsets[i]:offsets[i+1]]
+    """
+
+    query_result = _message(buf, QUERY_RESULT)
+    result = _message(buf, FEATURE_RESULT, *query_result) if query_result is not None else None
+
+    if result is None:
+        raise ValueError('Response is not the result of a feature query')
+
+    exceeded = False
+    names = []
+    features = []
+    scale = (1.0, 1.0)
+    translate = (0.0, 0.0)
+    origin = UPPER_LEFT
+
+    for number, wire, value in _fields(buf, *result):
+        if number == FEATURES:
+            features.append(value)
+        elif number == FIELDS:
+            name = _message(buf, FIELD_NAME, *value)
+            names.append(buf[name[0]:name[1]].decode('utf-8') if name is not None else '')
+        elif number == EXCEEDED_LIMIT:
+            exceeded = bool(value)
+        elif number == TRANSFORM:
+            for part, _, part_value in _fields(buf, *value):
+                if part == ORIGIN:
+                    origin = part_value
+                elif part in (SCALE, TRANSLATE):
+                    # x and y of Scale and Translate are their first two doubles
+                    pair = [0.0, 0.0]
+                    for axis, _, number_bytes in _fields(buf, *part_value):
+                        if axis in (1, 2):
+                            pair[axis - 1] = struct.unpack('<d', number_bytes)[0]
+
+                    if part == SCALE:
+                        scale = tuple(pair)
+                    else:
+                        translate = tuple(pair)
+
+    attributes = {name: [] for name in names}
+    columns = [attributes[name] for name in names]
+
+    # Packed coordinates of every feature, decoded together once all are found. Only numbers that are cheap to
+    # read in Python are taken per feature; numpy calls cost more than a small feature takes to walk
+    packed = []
+    sizes = np.zeros(len(features), dtype=np.int64)
+    firsts = np.full(len(features), -1, dtype=np.int64)
+
+    # Features are walked inline rather than through _fields, they are most of the response
+    for i, (start, end) in enumerate(features):
+        column = 0
+        pos = start
+
+        while pos < end:
+            key, pos = _varint(buf, pos)
+            value, pos = _skip(buf, pos, key & 7)
+
+            if key == ATTRIBUTES << 3 | 2:
+                columns[column].append(_value(buf, *value))
+                column += 1
+            elif key == GEOMETRY << 3 | 2:
+                part_pos, part_end = value
+
+                while part_pos < part_end:
+                    part_key, part_pos = _varint(buf, part_pos)
+                    part_value, part_pos = _skip(buf, part_pos, part_key & 7)
+
+                    if part_key == COORDS << 3 | 2:
+                        packed.append(buf[part_value[0]:part_value[1]])
+                        sizes[i] = part_value[1] - part_value[0]
+                    elif part_key == LENGTHS << 3 | 2 and part_value[1] > part_value[0]:
+                        # Vertices of the first part
+                        firsts[i] = _varint(buf, part_value[0])[0]
+
+    data = b''.join(packed)
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) < 0x80)
+
+    # Varints end in a byte below 0x80, so the values of each feature are the ends within its bytes
+    counts = np.diff(np.searchsorted(ends, np.concatenate([[0], np.cumsum(sizes)]))) // 2
+
+    # Like the JSON parsers, only the first part of each feature is kept
+    kept = np.where(firsts >= 0, np.minimum(firsts, counts), counts)
+
+    # Coordinates are delta encoded within each feature
+    quantized = undelta(decode_varints(data, zigzag=True).reshape(-1, 2), counts)
+    starts = np.cumsum(counts) - counts
+
+    x, y = dequantize(quantized, scale, translate, origin == UPPER_LEFT)
+
+    offsets = np.zeros(len(features) + 1, dtype=np.int64)
+    np.cumsum(kept, out=offsets[1:])
+
+    # Positions of the kept vertices within all vertices
+    keep = np.repeat(starts - offsets[:-1], kept) + np.arange(offsets[-1])
+
+    return {
+        'exceededTransferLimit': exceeded,
+        'attributes': attributes,
+        'coords': np.column_stack([x, y])[keep],
+        'offsets': offsets,
+    }
@@ -0,0 +1,184 @@
+"""
+    file:
+        snapshot.py
+    purpose:
+        Local city wide copy of the OpenData layers. Street lights, sidewalks and traffic volumes change rarely,
+        so they are downloaded once and bounding box queries are answered from memory
+
+        Download a snapshot from the backend directory: python -m app.metrics.snapshot snapshot.npz
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.metrics.opendata import OpenDataLondon, LightSet, LineSet, LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER
+
+# Features requested per page, below the 1000 element request limit
+PAGE_SIZE = 500
+
+class Snapshot:
+    """
+        purpose:
+            All features of the three OpenData layers, as of one download
+        properties:
+            lights - LightSet
+            sidewalks - LineSet of sidewalks
+            volumes - LineSet of traffic volumes
+            version - String identifying the download; changes whenever the data does
+    """
+
+    def __init__(self, lights, sidewalks, volumes, version):
+        self.lights = lights
+        self.sidewalks = sidewalks
+        self.volumes = volumes
+        self.version = version
+
+    @classmethod
+    def download(cls, source=None, page_size=PAGE_SIZE, verbose=False):
+        """
+            purpose:
+                Page through the full dataset of every layer
+            parameters:
+                source: optional; OpenDataLondon object to download with
+                page_size: optional; number of features per request
+                verbose: optional; default False. If true, progress is printed
+            return:
+                snapshot: Snapshot object
+        """
+
+        if source is None:
+            source = OpenDataLondon()
+
+        layers = {}
+
+        for layer in (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER):
+
+            # Every ID is listed up front, then the features are requested in pages of IDs
+            ids = source.get_object_ids(layer)
+            pages = [source.get_by_ids(layer, ids[i:i + page_size]) for i in range(0, len(ids), page_size)]
+
+            if layer == LIGHTS_LAYER:
+                layers[layer] = LightSet.concat(pages).unique()
+            else:
+                layers[layer] = LineSet.concat(pages).unique()
+
+            if verbose:
+                print('Layer {}: {} features'.format(layer, len(layers[layer])))
+
+        return cls(layers[LIGHTS_LAYER], layers[SIDEWALKS_LAYER], layers[VOLUMES_LAYER], time.strftime('%Y%m%dT%H%M%S'))
+
+    def save(self, path):
+        """
+            purpose:
+                Write the snapshot as one numpy archive of flat arrays
+            parameters:
+                path: File to write
+        """
+
+        # Float32 would round coordinates to about a meter, keep the full precision
+        np.savez_compressed(path,
+            version=np.array(self.version),
+            light_ids=self.lights.ids, light_x=self.lights.x, light_y=self.lights.y,
+            sidewalk_ids=self.sidewalks.ids, sidewalk_lengths=self.sidewalks.lengths,
+            sidewalk_coords=self.sidewalks.coords, sidewalk_offsets=self.sidewalks.offsets,
+            volume_ids=self.volumes.ids, volume_lengths=self.volumes.lengths, volume_volumes=self.volumes.volumes,
+            volume_coords=self.volumes.coords, volume_offsets=self.volumes.offsets)
+
+    @classmethod
+    def load(cls, path):
+        """
+            purpose:
+                Read a snapshot written by save
+            parameters:
+                path: File to read
+            return:
+                snapshot: Snapshot object
+        """
+
+        with np.load(path) as data:
+            lights = LightSet(data['light_ids'], data['light_x'], data['light_y'])
+            sidewalks = LineSet(data['sidewalk_ids'], data['sidewalk_lengths'], data['sidewalk_coords'], data['sidewalk_offsets'])
+            volumes = LineSet(data['volume_ids'], data['volume_lengths'], data['volume_coords'], data['volume_offsets'], data['volume_volumes'])
+
+            return cls(lights, sidewalks, volumes, str(data['version']))
+
+    def __repr__(self):
+        return 'Snapshot( {}: {} lights, {} sidewalks, {} traffic volumes )'.format(self.version, len(self.lights), len(self.sidewalks), len(self.volumes))
+
+class SnapshotDataSource:
+    """
+        purpose:
+            Drop in replacement for DataThreadPool that answers bounding box queries from a Snapshot in memory
+    """
+
+    def __init__(self, snapshot):
+        """
+            parameters:
+                snapshot: Snapshot object
+        """
+
+        self.snapshot = snapshot
+
+        # Line bounding boxes only depend on the snapshot, compute them once
+        self.__sidewalk_bounds = snapshot.sidewalks.bounds()
+        self.__volume_bounds = snapshot.volumes.bounds()
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @classmethod
+    def load(cls, path):
+        return cls(Snapshot.load(path))
+
+    def __boxes(self, boxes):
+        # (minx, miny, maxx, maxy) of each box; boxes may be given with their corners in any order
+        corners = np.array([(a.lon, a.lat, b.lon, b.lat) for a, b in boxes], dtype=float).reshape(-1, 4)
+        return (np.minimum(corners[:, 0], corners[:, 2]), np.minimum(corners[:, 1], corners[:, 3]),
+                np.maximum(corners[:, 0], corners[:, 2]), np.maximum(corners[:, 1], corners[:, 3]))
+
+    def __lines_in(self, bounds, boxes):
+        # Lines whose bounding box intersects any box, like esriSpatialRelIntersects on an envelope
+        minx, miny, maxx, maxy = bounds
+        hit = np.zeros(len(minx), dtype=bool)
+
+        for bx0, by0, bx1, by1 in zip(*boxes):
+            hit |= (minx <= bx1) & (maxx >= bx0) & (miny <= by1) & (maxy >= by0)
+
+        return np.flatnonzero(hit)
+
+    def collect(self, boxes, within=None):
+        """
+            purpose:
+                Same as DataThreadPool.collect, answered from memory
+            params:
+                boxes = list of (Coordinate, Coordinate) opposite corners of each query box, see split_box
+                within = optional; unused, a snapshot has no transfer limit to split tiles for
+            returns:
+                ( LightSet, LineSet of sidewalks, LineSet of traffic volumes )
+        """
+
+        boxes = self.__boxes(boxes)
+
+        lights = self.snapshot.lights
+        hit = np.zeros(len(lights), dtype=bool)
+
+        for bx0, by0, bx1, by1 in zip(*boxes):
+            hit |= (lights.x >= bx0) & (lights.x <= bx1) & (lights.y >= by0) & (lights.y <= by1)
+
+        return (lights.select(np.flatnonzero(hit)),
+                self.snapshot.sidewalks.select(self.__lines_in(self.__sidewalk_bounds, boxes)),
+                self.snapshot.volumes.select(self.__lines_in(self.__volume_bounds, boxes)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download a city wide OpenData snapshot')
+    parser.add_argument('path', help='File to write the snapshot to, e.g. snapshot.npz')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Features per request')
+    args = parser.parse_args()
+
+    snapshot = Snapshot.download(page_size=args.page_size, verbose=True)
+    snapshot.save(args.path)
+
+    print(snapshot)
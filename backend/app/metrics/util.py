@@ -3,16 +3,33 @@
     purpose: Encapsulate utility functions for the metrics module
 """
 
-from shapely.geometry import Point
+import numpy as np
+import requests
+import shapely
+
+from requests.adapters import HTTPAdapter
+from shapely.geometry import CAP_STYLE, JOIN_STYLE, Point
+from shapely.strtree import STRtree
 
 # Global variable used to keep a constant buffer across all polygons
 POLYGON_BUFFER = 0.00025
 
+# Ends and corners of a route buffer, see RouteShape
+CAP_STYLES = ('round', 'flat', 'square')
+JOIN_STYLES = ('round', 'mitre', 'bevel')
+
+# Default HTTP timeouts in seconds
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+
 class Coordinate:
     """
-        purpose: Define a coordinate
+        purpose: Define a coordinate. The shapely Point is only built when asked for and then kept, so lat and lon
+                 are not changed afterwards; build a new Coordinate instead
     """
 
+    __slots__ = ('lat', 'lon', '_point')
+
     def __init__(self, x, y):
         """
             parameters: 
@@ -23,8 +40,240 @@ class Coordinate:
         self.lat = x
         self.lon = y
 
-        # Shapely Point object
-        self.point = Point(self.lat, self.lon) # Standard is LAT = y, LON = x
+        self._point = None
+
+    @property
+    def point(self):
+        # Shapely Point object, built on first use
+        if self._point is None:
+            self._point = Point(self.lat, self.lon) # Standard is LAT = y, LON = x
+        return self._point
+
+    @property
+    def latlng(self):
+        return (self.lat, self.lon)
+
+    @property
+    def lnglat(self):
+        return (self.lon, self.lat)
+
+    # Representative format
+    def __repr__(self):
+        return 'Coordinate( {}, {} )'.format(self.lat, self.lon)
+
+def make_points(x, y):
+    """
+        purpose:
+            Build shapely Points from coordinate arrays
+        parameters:
+            x: (N,) float array
+            y: (N,) float array
+        return:
+            points: List of N shapely Points
+    """
+
+    return list(shapely.points(x, y))
+
+def make_lines(coords, offsets):
+    """
+        purpose:
+            Build shapely LineStrings from a flat vertex array
+        parameters:
+            coords: (V,2) float array of vertices
+            offsets: (N+1,) int array; the vertices of line i are coords[offsets[i]:offsets[i+1]]
+        return:
+            lines: List of N shapely LineStrings
+    """
+
+    counts = np.diff(offsets)
+
+    if len(counts) == 0:
+        return []
+
+    return list(shapely.linestrings(coords[offsets[0]:offsets[-1]], indices=np.repeat(np.arange(len(counts)), counts)))
+
+class RouteShape:
+    """
+        purpose:
+            How a route line is turned into the polygon features are matched against. Simplifying the line first
+            and drawing the round parts of the buffer with fewer segments both give polygons with fewer vertices,
+            which every intersects and intersection check against them is faster for, at some cost in accuracy.
+            Compare the settings with benchmarks/shapes.py
+        properties:
+            tolerance - Simplification tolerance in degrees, 0 keeps every vertex. Topology is preserved
+            resolution - Segments per quarter circle of the round ends and corners of the buffer
+            cap_style - One of CAP_STYLES; shape of the ends of the buffer
+            join_style - One of JOIN_STYLES; shape of the corners of the buffer
+            distance - Buffer distance in degrees
+    """
+
+    def __init__(self, tolerance=0.0, resolution=16, cap_style='round', join_style='round', distance=POLYGON_BUFFER):
+        if cap_style not in CAP_STYLES:
+            raise ValueError('Unknown cap style {}, expected one of {}'.format(cap_style, CAP_STYLES))
+        if join_style not in JOIN_STYLES:
+            raise ValueError('Unknown join style {}, expected one of {}'.format(join_style, JOIN_STYLES))
+
+        self.tolerance = float(tolerance)
+        self.resolution = int(resolution)
+        self.cap_style = cap_style
+        self.join_style = join_style
+        self.distance = distance
+
+    def buffer(self, line):
+        """
+            purpose:
+                Polygon of a route line
+            parameters:
+                line: shapely LineString of (LON, LAT)
+            return:
+                polygon: shapely Polygon
+        """
+
+        if self.tolerance > 0:
+            line = line.simplify(self.tolerance, preserve_topology=True)
+
+        # Styles by number, which shapely 1.x and 2.x both take
+        return line.buffer(self.distance, self.resolution, cap_style=getattr(CAP_STYLE, self.cap_style),
+                           join_style=getattr(JOIN_STYLE, self.join_style))
+
+    @property
+    def separable(self):
+        """
+            purpose:
+                Whether the polygon of a line is the union of the polygons of its parts, so that a route can be
+                scored through the segments it shares with others. Only round ends and corners on a line that is
+                not simplified meet where the parts join, like the corner of the whole line
+        """
+
+        return self.tolerance == 0 and self.cap_style == 'round' and self.join_style == 'round'
+
+    def __repr__(self):
+        return 'RouteShape( tolerance {}, resolution {}, {} caps, {} joins )'.format(self.tolerance, self.resolution,
+                                                                                   self.cap_style, self.join_style)
+
+# Shape of routes that are not given one, the plain buffer of the full line
+ROUTE_SHAPE = RouteShape()
+
+def decode_polyline(text, precision=5):
+    """
+        purpose:
+            Decode an encoded polyline, like the overview polyline of a Google route, with array math instead of
+            a loop over its characters
+        parameters:
+            text: encoded polyline string
+            precision: optional; decimal places of the encoded coordinates
+        return:
+            coords: (N,2) float array of (LON, LAT)
+    """
+
+    chunks = np.frombuffer(text.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+
+    if len(chunks) == 0:
+        return np.zeros((0, 2))
+
+    # Every value is a run of 5 bit chunks, least significant first; all but its last chunk have bit 0x20 set
+    last = (chunks & 0x20) == 0
+    starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+    shifts = 5 * (np.arange(len(chunks)) - np.repeat(starts, np.diff(np.append(starts, len(chunks)))))
+
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # Values are (LAT, LON) deltas from the previous vertex
+    coords = np.cumsum(values.reshape(-1, 2), axis=0) / 10 ** precision
+
+    return np.ascontiguousarray(coords[:, ::-1])
+
+def encode_polyline(coords, precision=5):
+    """
+        purpose:
+            Encode vertices as a polyline string, the inverse of decode_polyline
+        parameters:
+            coords: (N,2) float array of (LON, LAT)
+            precision: optional; decimal places kept
+        return:
+            text: encoded polyline string
+    """
+
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+
+    scaled = np.round(coords[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    # 5 bit chunks of every value, up to the last one that is not zero, as many columns as the largest needs
+    width = max((int(values.max(initial=0)).bit_length() + 4) // 5, 1)
+    shifts = 5 * np.arange(width)
+    rest = values[:, None] >> shifts[None, :]
+    chunks = (rest & 0x1f) | np.where(rest >> 5 > 0, 0x20, 0)
+    keep = (rest > 0) | (shifts == 0)[None, :]
+
+    return (chunks[keep] + 63).astype(np.uint8).tobytes().decode('ascii')
+
+class SpatialIndex:
+    """
+        purpose:
+            Bulk loaded STRtree over a list of geometries. Queries return positions into that list so
+            callers can map candidates back to the objects the geometries came from
+    """
+
+    def __init__(self, geometries):
+        """
+            parameters:
+                geometries: List of shapely geometries to index
+        """
+
+        self.geometries = list(geometries)
+
+        # STRtree cannot be built over an empty list
+        self.tree = STRtree(self.geometries) if self.geometries else None
+
+    def query(self, geometry):
+        """
+            purpose:
+                Find the geometries whose envelope intersects the envelope of GEOMETRY
+            parameters:
+                geometry: shapely geometry to query with
+            return:
+                candidates: Sorted list of positions into the indexed geometries
+        """
+
+        if self.tree is None:
+            return []
+
+        return np.sort(self.tree.query(geometry)).tolist()
+
+    def __len__(self):
+        return len(self.geometries)
+
+class PooledSession(requests.Session):
+    """
+        purpose:
+            requests Session that keeps a pool of alive connections per host, so repeated calls skip the TCP and
+            TLS handshakes. At most POOL_SIZE requests are in flight per host and the rest wait for a free
+            connection. The connection pools may be used from several threads, but requests does not promise the
+            same of the Session itself: threads sharing one only send requests, and its headers, cookies and
+            adapters are not changed while they do
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        """
+            parameters:
+                pool_size: optional; connections kept per host. Match it to the number of concurrent callers
+                connect_timeout: optional; seconds to wait for a connection
+                read_timeout: optional; seconds to wait for the server to send data
+        """
+
+        super().__init__()
+
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
 
-        self.latlng = (self.lat, self.lon)
-        self.lnglat = (self.lon, self.lat)
\ No newline at end of file
+    def request(self, method, url, **kwargs):
+        # Apply the default timeouts unless the caller picked its own
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,112 @@
+"""
+    file: formats.py
+    purpose:
+        Compare the wire formats of the OpenData layer queries: bytes on the wire and time to decode them. The
+        responses of every tile of the city, in every format, are recorded once into a zip fixture and then
+        decoded from it, so the decode times do not depend on the network
+
+        Run from the backend directory: python -m benchmarks.formats FIXTURE [--url URL]
+        Without --url the fixture is recorded from the local stand in server over the synthetic city. Pass the
+        OpenData map service URL to record the real London data instead
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+import zipfile
+
+from app.metrics import opendata
+from app.metrics.map import split_tiles
+from app.metrics.opendata import LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER, OpenDataLondon
+from app.metrics.util import Coordinate, PooledSession
+from benchmarks import server, synthetic
+
+LAYERS = (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER)
+FORMATS = ('json', 'compact', 'pbf')
+
+# Decodes per response when timing
+ROUNDS = 3
+
+def record(path, url):
+    """
+        purpose:
+            Query every tile of the city for every layer in every format and store the responses
+        parameters:
+            path: zip file to write
+            url: URL of the map service
+    """
+
+    server.use(url)
+
+    tiles = split_tiles(Coordinate(*synthetic.CITY_NE), Coordinate(*synthetic.CITY_SW))
+    session = PooledSession()
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as fixture:
+        for wire in FORMATS:
+            source = OpenDataLondon(session=session, wire=wire)
+
+            for layer in LAYERS:
+                for i, tile in enumerate(tiles):
+                    with session.get(source.box_url(layer, *tile)) as api_result:
+                        fixture.writestr('{}/{}/{}'.format(wire, layer, i), api_result.content)
+
+def decode(wire, layer, body, stream=False):
+    # Features of one recorded response, decoded the way OpenDataLondon.query_json does
+    if wire == 'pbf':
+        return opendata.parse_pbf(layer, body)['features']
+
+    if stream:
+        return opendata.dequantize_response(layer, opendata.stream_response(layer, io.BytesIO(body)))['features']
+
+    return opendata.parse_features(layer, opendata.dequantize_response(layer, json.loads(body))['features'])
+
+def compare(path):
+    """
+        purpose:
+            Print the size and decode time of every format of the fixture at PATH
+    """
+
+    with zipfile.ZipFile(path) as fixture:
+        responses = {}
+        for name in fixture.namelist():
+            wire, layer, _ = name.split('/')
+            responses.setdefault((wire, int(layer)), []).append(fixture.read(name))
+
+    # JSON formats are also decoded while streaming when ijson is installed
+    try:
+        import ijson  # noqa: F401
+        runs = [(wire, False) for wire in FORMATS] + [('json', True), ('compact', True)]
+    except ImportError:
+        runs = [(wire, False) for wire in FORMATS]
+
+    print('{:>16} {:>7} {:>10} {:>10} {:>9}'.format('format', 'layer', 'KB', 'ms', 'features'))
+
+    for wire, stream in runs:
+        for layer in LAYERS:
+            bodies = responses[(wire, layer)]
+
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                features = [decode(wire, layer, body, stream) for body in bodies]
+            elapsed = (time.perf_counter() - start) / ROUNDS
+
+            print('{:>16} {:>7} {:>10.0f} {:>10.1f} {:>9}'.format(wire + (' stream' if stream else ''), layer,
+                  sum(map(len, bodies)) / 1024, elapsed * 1000, sum(len(f) for f in features)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the wire formats of the OpenData layer queries')
+    parser.add_argument('fixture', help='zip of recorded responses; recorded first when it does not exist')
+    parser.add_argument('--url', help='map service to record from; default the local stand in server')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fixture):
+        if args.url is None:
+            httpd, url = server.serve()
+            record(args.fixture, url)
+            httpd.shutdown()
+        else:
+            record(args.fixture, args.url)
+
+    compare(args.fixture)
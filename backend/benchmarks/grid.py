@@ -0,0 +1,43 @@
+"""
+    file: grid.py
+    purpose:
+        Compare scoring routes from the precomputed SafetyGrid against compute_all over the features, on the
+        synthetic city: time per collect sized request and how far the grid metrics are from the exact ones
+
+        Run from the backend directory: python -m benchmarks.grid
+"""
+
+import time
+
+from app.metrics.algorithm import RatingAlgorithms
+from app.metrics.grid import SafetyGrid
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LightSet, LineSet
+from app.metrics.snapshot import Snapshot
+from benchmarks import synthetic
+
+if __name__ == "__main__":
+    snapshot = Snapshot(LightSet.from_json(synthetic.street_lights()), LineSet.from_json(synthetic.sidewalks()),
+                        LineSet.from_json(synthetic.traffic_volumes(), volumes=True), 'synthetic')
+    routes = [WalkingRoute(route) for route in synthetic.walking_routes(4)]
+
+    start = time.perf_counter()
+    grid = SafetyGrid.build(snapshot)
+    print('{} built in {:.2f}s, {:.1f} MB'.format(grid, time.perf_counter() - start,
+          (grid.lights.nbytes + grid.sidewalks.nbytes + grid.traffic.nbytes) / 2**20))
+
+    algos = RatingAlgorithms('numpy')
+
+    # The feature path gets the whole city, like a snapshot data source would hand it over
+    start = time.perf_counter()
+    exact = algos.compute_all(routes, snapshot.lights, snapshot.sidewalks, snapshot.volumes)
+    print('features: {:.1f} ms'.format((time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    approx = algos.compute_grid(routes, grid)
+    print('    grid: {:.1f} ms'.format((time.perf_counter() - start) * 1000))
+
+    for name in ('lights', 'sidewalks', 'traffic'):
+        errors = [abs(getattr(a, name) - getattr(e, name)) / max(abs(getattr(e, name)), 1e-9) for a, e in zip(approx, exact)]
+        print('{:>10}: max relative difference {:.1%}, exact {}'.format(name, max(errors),
+              ['{:.3g}'.format(getattr(e, name)) for e in exact]))
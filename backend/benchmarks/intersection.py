@@ -0,0 +1,69 @@
+"""
+    file: intersection.py
+    purpose:
+        Compare the per feature polygon loop that sidewalk_density and traffic_density used to run against the
+        IntersectionEngine on a full city sidewalk and traffic layer
+
+        Run from the backend directory: python -m benchmarks.intersection
+"""
+
+import time
+
+from app.metrics.algorithm import IntersectionEngine, RatingAlgorithms
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LineSet
+from benchmarks import synthetic
+
+def naive_sidewalk_density(routes, sidewalks):
+    # Every sidewalk against every route, no envelope rejection and no prepared geometry
+    ratio = [0] * len(routes)
+
+    for rid, route in enumerate(routes):
+        for line in sidewalks.lines:
+            if route.polygon.intersects(line):
+                ratio[rid] += route.polygon.intersection(line).length
+
+        ratio[rid] /= route.line.length
+
+    return ratio
+
+def naive_traffic_density(routes, roads):
+    avg_volumes = [0] * len(routes)
+
+    for rid, route in enumerate(routes):
+        for volume, line in zip(roads.volumes, roads.lines):
+            if route.polygon.intersects(line):
+                avg_volumes[rid] += volume * route.polygon.intersection(line).length / route.line.length
+
+    return avg_volumes
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    sidewalks = LineSet.from_json(synthetic.sidewalks())
+    volumes = LineSet.from_json(synthetic.traffic_volumes(), volumes=True)
+
+    # Build the LineStrings up front so both sides are timed on geometry work only
+    sidewalks.lines, volumes.lines
+
+    print('{} sidewalks, {} traffic volumes'.format(len(sidewalks), len(volumes)))
+
+    algos = RatingAlgorithms()
+
+    for count in (3, 4):
+        routes = [WalkingRoute(route) for route in synthetic.walking_routes(count)]
+
+        (naive_s, naive_v), before = timed(lambda: (naive_sidewalk_density(routes, sidewalks), naive_traffic_density(routes, volumes)))
+
+        def engine_run():
+            engine = IntersectionEngine(routes)
+            return algos.sidewalk_density(routes, sidewalks, engine=engine), algos.traffic_density(routes, volumes, engine=engine)
+
+        (engine_s, engine_v), after = timed(engine_run)
+
+        drift = max(abs(a - b) for a, b in zip(naive_s + naive_v, engine_s + engine_v))
+
+        print('{} routes: naive {:.3f}s, engine {:.3f}s, {:.1f}x faster, max difference {:.2e}'.format(count, before, after, before / after, drift))
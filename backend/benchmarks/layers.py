@@ -0,0 +1,46 @@
+"""
+    file: layers.py
+    purpose:
+        Compare one request per box and layer against one map service request per box for all layers, on the
+        local stand in for the OpenData server. Each request pays a fixed server side cost, like the real server
+
+        Run from the backend directory: python -m benchmarks.layers
+"""
+
+import time
+
+from app.metrics.map import WalkingRoute, max_bounding_box, split_tiles
+from app.metrics.opendata import DataThreadPool
+from benchmarks import server, synthetic
+
+# Server side cost of a request in seconds
+LATENCY = 0.02
+
+# Collects per mode; the first one warms the connection pool
+ROUNDS = 5
+
+if __name__ == "__main__":
+    httpd, url = server.serve(LATENCY)
+    server.use(url)
+
+    routes = [WalkingRoute(route) for route in synthetic.walking_routes(4)]
+    tiles = split_tiles(*max_bounding_box(routes))
+
+    print('{} tiles, {} ms per request'.format(len(tiles), LATENCY * 1000))
+
+    for name, combined in (('separate', False), ('combined', True)):
+        # No cache, so every round queries every tile
+        pool = DataThreadPool(combined=combined)
+        pool.collect(tiles)
+
+        server.reset()
+        start = time.perf_counter()
+        for _ in range(ROUNDS - 1):
+            lights, sidewalks, volumes = pool.collect(tiles)
+        elapsed = (time.perf_counter() - start) / (ROUNDS - 1)
+
+        print('{:>9}: {:.3f}s per collect, {} requests, {:.0f} KB, {} lights {} sidewalks {} volumes'.format(
+            name, elapsed, server.Handler.requests // (ROUNDS - 1), server.Handler.sent / (ROUNDS - 1) / 1024,
+            len(lights), len(sidewalks), len(volumes)))
+
+    httpd.shutdown()
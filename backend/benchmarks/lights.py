@@ -0,0 +1,46 @@
+"""
+    file: lights.py
+    purpose:
+        Compare the polygon and numpy light backends of RatingAlgorithms.street_light_density on a full city
+        street light layer
+
+        Run from the backend directory: python -m benchmarks.lights
+"""
+
+import time
+
+from app.metrics.algorithm import RatingAlgorithms, points_near_polyline, route_vertices
+from app.metrics.util import POLYGON_BUFFER
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LightSet
+from benchmarks import synthetic
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    lights = LightSet.from_json(synthetic.street_lights())
+    routes = [WalkingRoute(route) for route in synthetic.walking_routes(4)]
+
+    print('{} street lights, {} routes'.format(len(lights), len(routes)))
+
+    for backend in ('polygon', 'numpy'):
+        density, elapsed = timed(RatingAlgorithms(backend).street_light_density, routes, lights)
+        print('{:>8}: {:.1f} ms, {}'.format(backend, elapsed * 1000, ['{:.2f}'.format(d) for d in density]))
+
+    # The numpy kernel alone
+    coords = lights.coords
+    vertices = [route_vertices(route) for route in routes]
+    _, elapsed = timed(lambda: [points_near_polyline(coords, v, POLYGON_BUFFER) for v in vertices])
+    print('  kernel: {:.1f} ms on a prebuilt array'.format(elapsed * 1000))
+
+    results = {}
+    for backend in ('polygon', 'numpy'):
+        _, inrange, _ = RatingAlgorithms(backend).street_light_density(routes, lights, verbose=True)
+        results[backend] = [set(light.id for light in route) for route in inrange]
+
+    # Lights right on the buffer edge can differ, the polygon only approximates the round buffer
+    mismatches = sum(len(a ^ b) for a, b in zip(results['polygon'], results['numpy']))
+    print('lights matched differently: {}'.format(mismatches))
@@ -0,0 +1,62 @@
+"""
+    file: objects.py
+    purpose:
+        Time and memory of building StreetLight, Sidewalk and TrafficVolume objects for the data of one collect.
+        The eager run touches every Coordinate point, point list and polygon right after construction, which is
+        what construction used to cost before they became lazy
+
+        Run from the backend directory: python -m benchmarks.objects
+"""
+
+import time
+import tracemalloc
+
+from app.metrics.map import WalkingRoute, max_bounding_box, split_tiles
+from app.metrics.opendata import DataThreadPool
+from benchmarks import server, synthetic
+
+def build(collected, eager):
+    # Objects of every collected feature, optionally with their lazy parts built
+    objects = [list(features) for features in collected]
+
+    if eager:
+        for light in objects[0]:
+            light.coord.point
+        for line in objects[1] + objects[2]:
+            [coord.point for coord in line.points]
+            line.polygon
+
+    return objects
+
+def measure(collected, eager):
+    start = time.perf_counter()
+    build(collected, eager)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    objects = build(collected, eager)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak, objects
+
+if __name__ == "__main__":
+    httpd, url = server.serve()
+    server.use(url)
+
+    routes = [WalkingRoute(route) for route in synthetic.walking_routes(4)]
+    collected = DataThreadPool().collect(split_tiles(*max_bounding_box(routes)))
+
+    httpd.shutdown()
+
+    print('{} lights, {} sidewalks, {} volumes'.format(*map(len, collected)))
+
+    for name, eager in (('eager', True), ('lazy', False)):
+        elapsed, peak, objects = measure(collected, eager)
+        print('{:>6}: {:.1f} ms, peak {:.1f} MB'.format(name, elapsed * 1000, peak / 2**20))
+
+    # What the lazy objects cost once the polygons are needed after all
+    start = time.perf_counter()
+    for line in objects[1] + objects[2]:
+        line.polygon
+    print('  lazy polygons on first use: {:.1f} ms'.format((time.perf_counter() - start) * 1000))
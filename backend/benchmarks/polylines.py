@@ -0,0 +1,54 @@
+"""
+    file: polylines.py
+    purpose:
+        Time of turning route polylines into vertices and LineStrings, the part of building a WalkingRoute that
+        comes before its buffer: decode_polyline into an array against the polyline package into tuples,
+        and encode_polyline against polyline.encode
+
+        Run from the backend directory: python -m benchmarks.polylines
+"""
+
+import time
+
+from shapely.geometry import LineString
+
+from app.metrics.util import decode_polyline, encode_polyline
+from benchmarks import shapes, synthetic
+
+# Routes per batch, the size of a busy minute of requests
+BATCH = 200
+
+def timed(function, texts):
+    start = time.perf_counter()
+    for text in texts:
+        function(text)
+    return time.perf_counter() - start
+
+def arrays(text):
+    coords = decode_polyline(text)
+    return coords[:, ::-1], LineString(coords)
+
+if __name__ == "__main__":
+    # Detailed routes have the vertex count of real Google polylines
+    texts = [shapes.detailed(route)['overview_polyline']['points'] for route in synthetic.walking_routes(4)] * (BATCH // 4)
+    coords = [decode_polyline(text) for text in texts]
+
+    print('{} polylines, {} vertices'.format(len(texts), sum(map(len, coords))))
+    print('decode_polyline: {:.1f} ms'.format(timed(arrays, texts) * 1000))
+    print('encode_polyline: {:.1f} ms'.format(timed(encode_polyline, coords) * 1000))
+
+    # The pure Python package WalkingRoute used before, when it is installed
+    try:
+        import polyline
+    except ImportError:
+        polyline = None
+
+    if polyline is not None:
+        def tuples(text):
+            points = polyline.decode(text)
+            return points, LineString([(lon, lat) for lat, lon in points])
+
+        points = [polyline.decode(text) for text in texts]
+
+        print('polyline.decode: {:.1f} ms'.format(timed(tuples, texts) * 1000))
+        print('polyline.encode: {:.1f} ms'.format(timed(polyline.encode, points) * 1000))
@@ -0,0 +1,61 @@
+"""
+    file: segments.py
+    purpose:
+        Compare scoring alternative routes once per shared segment, as compute_all does, against scoring every
+        route on its own with the single metric functions, on the synthetic city. Prints how much of the routes
+        is shared, the time of both and the largest difference between their metrics
+
+        Run from the backend directory: python -m benchmarks.segments [--backend polygon|numpy]
+"""
+
+import argparse
+import time
+
+from app.metrics.algorithm import LIGHT_BACKENDS, RatingAlgorithms, route_segments
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LightSet, LineSet
+from benchmarks import synthetic
+
+# Runs per measurement, the fastest is kept
+ROUNDS = 5
+
+def fastest(function):
+    function()
+
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare segment and per route scoring')
+    parser.add_argument('--backend', choices=LIGHT_BACKENDS, default='polygon', help='Light backend of RatingAlgorithms')
+    args = parser.parse_args()
+
+    lights = LightSet.from_json(synthetic.street_lights())
+    sidewalks = LineSet.from_json(synthetic.sidewalks())
+    volumes = LineSet.from_json(synthetic.traffic_volumes(), volumes=True)
+
+    # Shapely geometry is built once up front, like after a collect
+    lights.points, sidewalks.lines, volumes.lines
+
+    algos = RatingAlgorithms(args.backend)
+
+    for count in (1, 2, 4):
+        routes = [WalkingRoute(route) for route in synthetic.walking_routes(count)]
+        segments, _ = route_segments(routes)
+
+        def each():
+            return (algos.street_light_density(routes, lights), algos.sidewalk_density(routes, sidewalks),
+                    algos.traffic_density(routes, volumes))
+
+        metrics = algos.compute_all(routes, lights, sidewalks, volumes)
+        difference = max(abs(getattr(m, name) - values[rid]) / values[rid] for rid, m in enumerate(metrics)
+                             for name, values in zip(('lights', 'sidewalks', 'traffic'), each()))
+
+        print('{} routes: {} segments, {} of {} vertices scored; per route {:.1f} ms, segments {:.1f} ms, max difference {:.1e}'.format(
+              count, len(segments), sum(len(s.points) for s in segments), sum(len(r.points) for r in routes),
+              fastest(each) * 1000, fastest(lambda: algos.compute_all(routes, lights, sidewalks, volumes)) * 1000, difference))
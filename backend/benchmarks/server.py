@@ -0,0 +1,285 @@
+"""
+    file: server.py
+    purpose:
+        Local HTTP stand in for the OpenData map service, answering envelope queries on single layers and on the
+        map service from the synthetic city. Layer queries honour quantizationParameters, maxAllowableOffset and
+        f=pbf like the real server. Point the app at it with use(url)
+"""
+
+import json
+import struct
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from shapely.geometry import LineString
+
+import app.metrics.opendata as opendata
+from benchmarks import synthetic
+
+def _bounds(feature):
+    # (minx, miny, maxx, maxy) of a point or polyline feature
+    geometry = feature['geometry']
+
+    if 'x' in geometry:
+        return geometry['x'], geometry['y'], geometry['x'], geometry['y']
+
+    path = np.array(geometry['paths'][0])
+    return path[:, 0].min(), path[:, 1].min(), path[:, 0].max(), path[:, 1].max()
+
+def generalize(features, offset):
+    """
+        purpose:
+            Drop the vertices of polyline features that move them by at most OFFSET, like maxAllowableOffset
+    """
+
+    generalized = []
+
+    for feature in features:
+        paths = [list(LineString(path).simplify(offset).coords) for path in feature['geometry']['paths']]
+        generalized.append(dict(feature, geometry={'paths': paths}))
+
+    return generalized
+
+def quantize(features, quantization):
+    """
+        purpose:
+            Quantize features like quantizationParameters in edit mode with an upper left origin
+        return:
+            (features with integer coordinates, transform). Paths are delta encoded
+    """
+
+    tolerance = quantization['tolerance']
+    x0, y0 = quantization['extent']['xmin'], quantization['extent']['ymax']
+
+    def step(x, y):
+        return int(round((x - x0) / tolerance)), int(round((y0 - y) / tolerance))
+
+    quantized = []
+
+    for feature in features:
+        geometry = feature['geometry']
+
+        if 'x' in geometry:
+            x, y = step(geometry['x'], geometry['y'])
+            quantized.append(dict(feature, geometry={'x': x, 'y': y}))
+            continue
+
+        paths = []
+        for path in geometry['paths']:
+            steps = [step(x, y) for x, y in path]
+            paths.append([list(steps[0])] + [[x - px, y - py] for (px, py), (x, y) in zip(steps, steps[1:])])
+
+        quantized.append(dict(feature, geometry={'paths': paths}))
+
+    transform = {'originPosition': 'upperLeft', 'scale': [tolerance, tolerance, 0, 0], 'translate': [x0, y0, 0, 0]}
+
+    return quantized, transform
+
+def _varint(value):
+    out = bytearray()
+
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _field(number, wire, payload):
+    # Key and payload of one field; length delimited payloads are prefixed with their size
+    key = _varint(number << 3 | wire)
+
+    if wire == 2:
+        return key + _varint(len(payload)) + payload
+    if wire == 0:
+        return key + _varint(payload)
+
+    return key + payload
+
+def _value(value):
+    # Value message of an attribute
+    if isinstance(value, float):
+        return _field(3, 1, struct.pack('<d', value))
+
+    return _field(8, 0, _zigzag(int(value)))
+
+def encode_pbf(features, transform, exceeded):
+    """
+        purpose:
+            Encode quantized features as an Esri FeatureCollection protocol buffer, the f=pbf response
+    """
+
+    names = list(features[0]['attributes']) if features else []
+
+    encoded = []
+    for feature in features:
+        geometry = feature['geometry']
+
+        if 'x' in geometry:
+            lengths, deltas = [1], [geometry['x'], geometry['y']]
+        else:
+            # Paths are already delta encoded within each path; continue the deltas across paths
+            lengths = [len(path) for path in geometry['paths']]
+            deltas, last = [], (0, 0)
+            for path in geometry['paths']:
+                deltas += [path[0][0] - last[0], path[0][1] - last[1]] + [d for vertex in path[1:] for d in vertex]
+                last = tuple(np.sum(path, axis=0))
+
+        packed_lengths = b''.join(_varint(length) for length in lengths)
+        packed_coords = b''.join(_varint(_zigzag(int(d))) for d in deltas)
+
+        body = b''.join(_field(1, 2, _value(feature['attributes'][name])) for name in names)
+        body += _field(2, 2, _field(2, 2, packed_lengths) + _field(3, 2, packed_coords))
+
+        encoded.append(_field(15, 2, body))
+
+    scale = _field(1, 1, struct.pack('<d', transform['scale'][0])) + _field(2, 1, struct.pack('<d', transform['scale'][1]))
+    translate = _field(1, 1, struct.pack('<d', transform['translate'][0])) + _field(2, 1, struct.pack('<d', transform['translate'][1]))
+
+    result = _field(1, 2, b'OBJECTID')
+    result += _field(9, 0, int(exceeded))
+    result += _field(12, 2, _field(1, 0, 0) + _field(2, 2, scale) + _field(3, 2, translate))
+    result += b''.join(_field(13, 2, _field(1, 2, name.encode('utf-8'))) for name in names)
+    result += b''.join(encoded)
+
+    return _field(1, 2, b'1.0') + _field(2, 2, _field(1, 2, result))
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients may keep the connection alive
+    protocol_version = 'HTTP/1.1'
+
+    features = {
+        opendata.LIGHTS_LAYER: synthetic.street_lights(),
+        opendata.SIDEWALKS_LAYER: synthetic.sidewalks(),
+        opendata.VOLUMES_LAYER: synthetic.traffic_volumes(),
+    }
+    bounds = {layer: np.array([_bounds(f) for f in features]) for layer, features in features.items()}
+
+    # Seconds the server spends on every request before answering, set by serve
+    latency = 0.0
+
+    # Requests and response bytes served
+    requests = 0
+    sent = 0
+
+    def layer(self, layer, query):
+        """
+            purpose:
+                Answer an envelope query on one layer, or count its features with returnCountOnly
+            return:
+                response: JSON response of the layer
+        """
+
+        x0, y0, x1, y1 = map(float, query['geometry'].split(','))
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+
+        bounds = self.bounds[layer]
+        hit = (bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) & (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0)
+        features = [self.features[layer][i] for i in np.flatnonzero(hit)]
+
+        if query.get('returnCountOnly') == 'true':
+            return {'count': len(features)}
+
+        response = {'features': features[:opendata.MAX_RECORD_COUNT]}
+        if len(features) > opendata.MAX_RECORD_COUNT:
+            response['exceededTransferLimit'] = True
+
+        return response
+
+    def encode(self, layer, response, query):
+        """
+            purpose:
+                Apply the output parameters of a layer query to its response
+            return:
+                body: bytes
+        """
+
+        features = response['features']
+
+        if 'maxAllowableOffset' in query and layer != opendata.LIGHTS_LAYER:
+            features = generalize(features, float(query['maxAllowableOffset']))
+
+        if 'quantizationParameters' in query:
+            features, transform = quantize(features, json.loads(query['quantizationParameters']))
+
+            if query.get('f') == 'pbf':
+                return encode_pbf(features, transform, response.get('exceededTransferLimit', False))
+
+            response = dict(response, features=features, transform=transform)
+
+        return json.dumps(response).encode()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        time.sleep(self.latency)
+
+        # Map service query over several layers, layer description or a layer query
+        if url.path.endswith('/MapServer/query'):
+            layers = [layer_def['layerId'] for layer_def in json.loads(query['layerDefs'])]
+            body = json.dumps({'layers': [dict(self.layer(layer, query), id=layer) for layer in layers]}).encode()
+        elif not url.path.endswith('/query'):
+            body = json.dumps({'id': int(url.path.split('/')[-1]), 'supportedQueryFormats': 'JSON, geoJSON, PBF'}).encode()
+        else:
+            layer = int(url.path.split('/')[-2])
+            response = self.layer(layer, query)
+            body = json.dumps(response).encode() if 'count' in response else self.encode(layer, response, query)
+
+        Handler.requests += 1
+        Handler.sent += len(body)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(latency=0.0):
+    """
+        purpose:
+            Start the stand in server on a free local port
+        parameters:
+            latency: optional; seconds of server side work per request
+        return:
+            (server, url of the map service)
+    """
+
+    Handler.latency = latency
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://localhost:{}/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer'.format(server.server_address[1])
+
+def use(url):
+    """
+        purpose:
+            Send the OpenData queries of this process to the map service at URL
+    """
+
+    opendata.OPENDATA_URL = url
+
+def reset():
+    """
+        purpose:
+            Zero the request counters
+    """
+
+    Handler.requests = 0
+    Handler.sent = 0
@@ -0,0 +1,106 @@
+"""
+    file: sessions.py
+    purpose:
+        Compare a fresh connection per request, like the module level requests.get, against a PooledSession on a
+        local HTTPS stand in for the OpenData server. Every fresh connection pays the TCP and TLS handshakes
+
+        Run from the backend directory: python -m benchmarks.sessions
+        Requires the openssl command line tool to create a throwaway certificate
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from app.metrics.util import PooledSession
+from benchmarks import synthetic
+
+# Same shape as a request: 3 layers for 25 boxes over 15 threads
+REQUESTS = 75
+THREADS = 15
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients may keep the connection alive
+    protocol_version = 'HTTP/1.1'
+
+    body = json.dumps({'features': synthetic.street_lights()[:200]}).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(directory):
+    """
+        purpose:
+            Start the stand in server on a free local port with a self signed certificate
+        return:
+            (server, url, certificate path)
+    """
+
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost', '-keyout', key, '-out', cert],
+                   check=True, capture_output=True)
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'https://localhost:{}/query'.format(server.server_address[1]), cert
+
+def run(get, url, cert):
+    """
+        purpose:
+            Issue REQUESTS calls from THREADS threads
+        return:
+            (total seconds, mean seconds per call)
+    """
+
+    latencies = []
+
+    def call(_):
+        start = time.perf_counter()
+        get(url, verify=cert).json()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as executor:
+        list(executor.map(call, range(REQUESTS)))
+
+    return time.perf_counter() - start, sum(latencies) / len(latencies)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        server, url, cert = serve(directory)
+
+        session = PooledSession(THREADS)
+
+        # First pass warms the pool, as a long running worker would be
+        run(session.get, url, cert)
+
+        for name, get in (('requests.get', requests.get), ('PooledSession', session.get)):
+            total, mean = run(get, url, cert)
+            print('{:>13}: {} calls in {:.3f}s, {:.1f} ms mean latency'.format(name, REQUESTS, total, mean * 1000))
+
+        server.shutdown()
@@ -0,0 +1,119 @@
+"""
+    file: shapes.py
+    purpose:
+        Accuracy against speed of the RouteShape settings: for each simplification tolerance and buffer style,
+        the vertices of the polygons that are intersected (those of the segments compute_all scores, whole routes for
+        shapes that are not separable), the time of compute_all with the polygon light backend and how far
+        every metric drifts from the full resolution buffer
+
+        Run from the backend directory: python -m benchmarks.shapes [--routes ROUTES]
+        ROUTES is a JSON list of recorded Google directions routes, e.g. json.dump of gmaps.directions(...).
+        Without it the synthetic routes are used, with vertices added every few metres and moved by up to a
+        couple of metres, like the detail of a real polyline. Shared streets get the same detail in every route
+"""
+
+import argparse
+import json
+import random
+import time
+
+from app.metrics.algorithm import RatingAlgorithms, route_segments
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LightSet, LineSet
+from app.metrics.util import RouteShape, decode_polyline, encode_polyline
+from benchmarks import synthetic
+
+# Settings compared against the first one, the full resolution buffer
+SHAPES = [
+    RouteShape(),
+    RouteShape(resolution=8),
+    RouteShape(resolution=4),
+    RouteShape(resolution=2),
+    RouteShape(tolerance=0.00001),
+    RouteShape(tolerance=0.00005),
+    RouteShape(tolerance=0.0001),
+    RouteShape(cap_style='flat'),
+    RouteShape(cap_style='square', join_style='mitre'),
+    RouteShape(join_style='bevel'),
+    RouteShape(tolerance=0.00005, resolution=4),
+]
+
+METRICS = ('lights', 'sidewalks', 'traffic')
+
+# Runs per measurement, the fastest is kept
+ROUNDS = 5
+
+def detailed(route_json, step=0.00005, noise=0.00002):
+    """
+        purpose:
+            Copy of a route with a vertex every STEP degrees, each moved by up to NOISE degrees
+    """
+
+    points = decode_polyline(route_json['overview_polyline']['points'])[:, ::-1].tolist()
+
+    detail = [points[0]]
+    for (lat0, lon0), (lat1, lon1) in zip(points, points[1:]):
+        # The same street gets the same vertices whichever route walks it
+        rand = random.Random(repr((lat0, lon0, lat1, lon1)))
+        count = max(int(max(abs(lat1 - lat0), abs(lon1 - lon0)) / step), 1)
+
+        for i in range(1, count):
+            detail.append((lat0 + (lat1 - lat0) * i / count + rand.uniform(-noise, noise),
+                           lon0 + (lon1 - lon0) * i / count + rand.uniform(-noise, noise)))
+        detail.append((lat1, lon1))
+
+    return dict(route_json, overview_polyline={'points': encode_polyline([(lon, lat) for lat, lon in detail])})
+
+def fastest(function):
+    function()
+
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare RouteShape settings')
+    parser.add_argument('--routes', help='JSON list of recorded Google directions routes; default detailed synthetic routes')
+    args = parser.parse_args()
+
+    if args.routes:
+        with open(args.routes) as f:
+            route_jsons = json.load(f)
+    else:
+        route_jsons = [detailed(route) for route in synthetic.walking_routes(4)]
+
+    lights = LightSet.from_json(synthetic.street_lights())
+    sidewalks = LineSet.from_json(synthetic.sidewalks())
+    volumes = LineSet.from_json(synthetic.traffic_volumes(), volumes=True)
+
+    # Shapely geometry is built once up front, like after a collect
+    lights.points, sidewalks.lines, volumes.lines
+
+    algos = RatingAlgorithms('polygon')
+    exact = None
+
+    routes = [WalkingRoute(route) for route in route_jsons]
+    print('{} routes, {} vertices, {} segments'.format(len(routes), sum(len(r.points) for r in routes), len(route_segments(routes)[0])))
+    print('{:<70} {:>9} {:>8} {:>8} {:>10} {:>8}'.format('shape', 'vertices', 'ms', 'lights', 'sidewalks', 'traffic'))
+
+    for shape in SHAPES:
+        routes = [WalkingRoute(route, shape) for route in route_jsons]
+
+        metrics = algos.compute_all(routes, lights, sidewalks, volumes)
+        elapsed = fastest(lambda: algos.compute_all(routes, lights, sidewalks, volumes))
+
+        if exact is None:
+            exact = metrics
+
+        # Largest relative drift of each metric over the routes
+        drift = [max(abs(getattr(m, name) - getattr(e, name)) / max(abs(getattr(e, name)), 1e-9) for m, e in zip(metrics, exact))
+                     for name in METRICS]
+
+        segments, _ = route_segments(routes)
+        vertices = sum(len(segment.polygon.exterior.coords) for segment in segments)
+
+        print('{:<70} {:>9} {:>8.1f} {:>7.2%} {:>9.2%} {:>7.2%}'.format(repr(shape), vertices, elapsed * 1000, *drift))
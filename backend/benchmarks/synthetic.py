@@ -0,0 +1,166 @@
+"""
+    file: synthetic.py
+    purpose: Generate city sized OpenData and Google Maps payloads for the benchmarks without touching the network
+"""
+
+import random
+
+from app.metrics.util import encode_polyline
+
+# Rough extent of London, ON in decimal degrees
+CITY_SW = (42.93, -81.35)
+CITY_NE = (43.03, -81.15)
+
+# Distance between parallel streets and the offset of a sidewalk from the road centerline
+BLOCK = 0.0015
+SIDEWALK_OFFSET = 0.0001
+
+# Kilometers per degree at London's latitude
+KM_PER_LAT = 111.0
+KM_PER_LON = 81.5
+
+def _streets():
+    """
+        purpose:
+            Walk the street grid
+        return:
+            generator of ((lon, lat), (lon, lat), horizontal) road centerline segments, one per block edge
+    """
+
+    rows = int((CITY_NE[0] - CITY_SW[0]) / BLOCK)
+    cols = int((CITY_NE[1] - CITY_SW[1]) / BLOCK)
+
+    for r in range(rows + 1):
+        for c in range(cols + 1):
+            lat = CITY_SW[0] + r * BLOCK
+            lon = CITY_SW[1] + c * BLOCK
+
+            if c < cols:
+                yield (lon, lat), (lon + BLOCK, lat), True
+            if r < rows:
+                yield (lon, lat), (lon, lat + BLOCK), False
+
+def _path(a, b, steps=4):
+    """
+        purpose:
+            Split a straight street segment into a few vertices like the OpenData layers do
+    """
+
+    return [[a[0] + (b[0] - a[0]) * i / steps, a[1] + (b[1] - a[1]) * i / steps] for i in range(steps + 1)]
+
+def _km(path):
+    # Planar approximation is good enough for generating lengths
+    return sum((((x1 - x0) * KM_PER_LON) ** 2 + ((y1 - y0) * KM_PER_LAT) ** 2) ** 0.5 for (x0, y0), (x1, y1) in zip(path, path[1:]))
+
+def street_lights(seed=0, per_block=3):
+    """
+        purpose:
+            OpenData street light features (layer 19) placed along one side of every street
+        return:
+            list of feature json
+    """
+
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, horizontal in _streets():
+        for _ in range(per_block):
+            t = rand.random()
+            x = a[0] + (b[0] - a[0]) * t + (0 if horizontal else SIDEWALK_OFFSET)
+            y = a[1] + (b[1] - a[1]) * t + (SIDEWALK_OFFSET if horizontal else 0)
+            features.append({"attributes": {"OBJECTID": len(features) + 1}, "geometry": {"x": x, "y": y}})
+
+    return features
+
+def sidewalks(seed=0, coverage=0.8):
+    """
+        purpose:
+            OpenData sidewalk features (layer 4) on both sides of a random COVERAGE share of the streets
+        return:
+            list of feature json
+    """
+
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, horizontal in _streets():
+        for side in (-1, 1):
+            if rand.random() > coverage:
+                continue
+
+            dx, dy = (0, side * SIDEWALK_OFFSET) if horizontal else (side * SIDEWALK_OFFSET, 0)
+            path = _path((a[0] + dx, a[1] + dy), (b[0] + dx, b[1] + dy))
+
+            features.append({"attributes": {"OBJECTID": len(features) + 1, "Shape.STLength()": _km(path) * 1000},
+                             "geometry": {"paths": [path]}})
+
+    return features
+
+def traffic_volumes(seed=0):
+    """
+        purpose:
+            OpenData traffic volume features (layer 21), one per road centerline segment
+        return:
+            list of feature json
+    """
+
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, _ in _streets():
+        path = _path(a, b)
+        features.append({"attributes": {"OBJECTID": len(features) + 1, "Shape.STLength()": _km(path) * 1000,
+                                        "VolumeCount": rand.choice([500, 2000, 8000, 20000])},
+                         "geometry": {"paths": [path]}})
+
+    return features
+
+def walking_routes(count=4, seed=0, blocks=(25, 20)):
+    """
+        purpose:
+            Google Maps directions routes between the same two intersections. Every route walks the grid
+            with its own turn pattern so the alternatives overlap the way Google's usually do
+        parameters:
+            count: Number of alternative routes
+            blocks: (east, north) number of blocks between the origin and destination
+        return:
+            list of route json as returned by googlemaps.Client.directions
+    """
+
+    rand = random.Random(seed)
+    routes = []
+
+    origin = (CITY_SW[0] + 20 * BLOCK, CITY_SW[1] + 30 * BLOCK)
+
+    # Shared staircase between the two intersections
+    base = ['E'] * blocks[0] + ['N'] * blocks[1]
+    rand.shuffle(base)
+
+    for _ in range(count):
+        moves = list(base)
+
+        # Reshuffle one stretch so each alternative leaves and rejoins the shared path at different corners
+        i = rand.randrange(len(moves) - 12)
+        stretch = moves[i:i + 12]
+        rand.shuffle(stretch)
+        moves[i:i + 12] = stretch
+
+        lat, lon = origin
+        points = [(lat, lon)]
+        for move in moves:
+            if move == 'E':
+                lon += BLOCK
+            else:
+                lat += BLOCK
+            points.append((round(lat, 5), round(lon, 5)))
+
+        km = (blocks[0] * BLOCK * KM_PER_LON) + (blocks[1] * BLOCK * KM_PER_LAT)
+
+        routes.append({
+            "bounds": {"northeast": {"lat": lat, "lng": lon}, "southwest": {"lat": origin[0], "lng": origin[1]}},
+            "legs": [{"distance": {"text": "{:.1f} km".format(km), "value": int(km * 1000)},
+                      "duration": {"value": int(km * 720)}}],
+            "overview_polyline": {"points": encode_polyline([(lon, lat) for lat, lon in points])},
+        })
+
+    return routes
@@ -0,0 +1,139 @@
+"""
+    file: city.py
+    purpose:
+        Small street grid with OpenData features and Google Maps routes on it, shared by the tests. Every
+        street has a road centerline, lights on one side and sidewalks on some of its sides
+"""
+
+import random
+
+from app.metrics.map import Tile, WalkingRoute
+from app.metrics.util import encode_polyline
+
+# South west corner of the grid in (LON, LAT), the distance between parallel streets and the blocks per side
+ORIGIN = (-81.26, 42.97)
+BLOCK = 0.0015
+BLOCKS = 12
+
+# Level -2 tile that holds the whole grid, away from its edges
+TILE = Tile(-2032, 1074, -2)
+
+# Offset of sidewalks and lights from the road centerline
+SIDEWALK_OFFSET = 0.0001
+
+# Kilometers per degree at London's latitude
+KM_PER_LAT = 111.0
+KM_PER_LON = 81.5
+
+def streets():
+    # ((LON, LAT), (LON, LAT), horizontal) of every block edge
+    for r in range(BLOCKS + 1):
+        for c in range(BLOCKS + 1):
+            lon, lat = ORIGIN[0] + c * BLOCK, ORIGIN[1] + r * BLOCK
+
+            if c < BLOCKS:
+                yield (lon, lat), (lon + BLOCK, lat), True
+            if r < BLOCKS:
+                yield (lon, lat), (lon, lat + BLOCK), False
+
+def path(a, b, steps=4):
+    return [[a[0] + (b[0] - a[0]) * i / steps, a[1] + (b[1] - a[1]) * i / steps] for i in range(steps + 1)]
+
+def km(points):
+    return sum((((x1 - x0) * KM_PER_LON) ** 2 + ((y1 - y0) * KM_PER_LAT) ** 2) ** 0.5
+                   for (x0, y0), (x1, y1) in zip(points, points[1:]))
+
+def street_lights(seed=0, per_block=3):
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, horizontal in streets():
+        for _ in range(per_block):
+            t = rand.random()
+            features.append({"attributes": {"OBJECTID": len(features) + 1},
+                             "geometry": {"x": a[0] + (b[0] - a[0]) * t + (0 if horizontal else SIDEWALK_OFFSET),
+                                          "y": a[1] + (b[1] - a[1]) * t + (SIDEWALK_OFFSET if horizontal else 0)}})
+
+    return features
+
+def sidewalks(seed=0, coverage=0.8):
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, horizontal in streets():
+        for side in (-1, 1):
+            if rand.random() > coverage:
+                continue
+
+            dx, dy = (0, side * SIDEWALK_OFFSET) if horizontal else (side * SIDEWALK_OFFSET, 0)
+            points = path((a[0] + dx, a[1] + dy), (b[0] + dx, b[1] + dy))
+
+            features.append({"attributes": {"OBJECTID": len(features) + 1, "Shape.STLength()": km(points) * 1000},
+                             "geometry": {"paths": [points]}})
+
+    return features
+
+def traffic_volumes(seed=0):
+    rand = random.Random(seed)
+    features = []
+
+    for a, b, _ in streets():
+        points = path(a, b)
+        features.append({"attributes": {"OBJECTID": len(features) + 1, "Shape.STLength()": km(points) * 1000,
+                                        "VolumeCount": rand.choice([500, 2000, 8000, 20000])},
+                         "geometry": {"paths": [points]}})
+
+    return features
+
+def route_json(points):
+    """
+        purpose:
+            Google Maps directions route through POINTS, in (LON, LAT)
+    """
+
+    lons, lats = zip(*points)
+    distance = km(points)
+
+    return {
+        "bounds": {"northeast": {"lat": max(lats), "lng": max(lons)}, "southwest": {"lat": min(lats), "lng": min(lons)}},
+        "legs": [{"distance": {"text": "{:.1f} km".format(distance), "value": int(distance * 1000)},
+                  "duration": {"value": int(distance * 720)}}],
+        "overview_polyline": {"points": encode_polyline(points)},
+    }
+
+def walking_route(points, shape=None):
+    return WalkingRoute(route_json(points), shape)
+
+def walking_routes(count=4, seed=0, blocks=(8, 6), shape=None):
+    """
+        purpose:
+            Alternative routes between the same two corners, each a staircase over the grid that leaves and
+            rejoins a shared path at different corners
+    """
+
+    rand = random.Random(seed)
+
+    base = ['E'] * blocks[0] + ['N'] * blocks[1]
+    rand.shuffle(base)
+
+    routes = []
+    for _ in range(count):
+        moves = list(base)
+
+        i = rand.randrange(len(moves) - 6)
+        stretch = moves[i:i + 6]
+        rand.shuffle(stretch)
+        moves[i:i + 6] = stretch
+
+        lon, lat = ORIGIN[0] + 2 * BLOCK, ORIGIN[1] + 2 * BLOCK
+        points = [(lon, lat)]
+        for move in moves:
+            if move == 'E':
+                lon += BLOCK
+            else:
+                lat += BLOCK
+            points.append((round(lon, 5), round(lat, 5)))
+
+        routes.append(walking_route(points, shape))
+
+    return routes
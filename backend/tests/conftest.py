@@ -0,0 +1,63 @@
+"""
+    file: conftest.py
+    purpose:
+        Fixtures shared by the tests: OpenData responses recorded in data/, the street grid of city.py and a local
+        OpenData server serving it, see server.py
+"""
+
+import json
+import os
+
+import pytest
+
+from app.metrics import opendata
+from app.metrics.opendata import LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER, LightSet, LineSet
+from tests import city, server
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Responses in data/ of each layer, see data/make_pbf.py
+RESPONSES = {LIGHTS_LAYER: 'lights', SIDEWALKS_LAYER: 'sidewalks', VOLUMES_LAYER: 'volumes'}
+
+@pytest.fixture(params=[LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER])
+def layer(request):
+    return request.param
+
+@pytest.fixture
+def json_response(layer):
+    # f=json response of LAYER
+    with open(os.path.join(DATA, RESPONSES[layer] + '.json')) as f:
+        return json.load(f)
+
+@pytest.fixture
+def pbf_response(layer):
+    # Bytes of the f=pbf response of LAYER, with the features of json_response
+    with open(os.path.join(DATA, RESPONSES[layer] + '.pbf'), 'rb') as f:
+        return f.read()
+
+@pytest.fixture(scope='session')
+def features():
+    # LightSet, and LineSets of sidewalks and traffic volumes of the street grid, with their geometry built
+    lights = LightSet.from_json(city.street_lights())
+    sidewalks = LineSet.from_json(city.sidewalks())
+    volumes = LineSet.from_json(city.traffic_volumes(), volumes=True)
+
+    lights.points, sidewalks.lines, volumes.lines
+
+    return lights, sidewalks, volumes
+
+@pytest.fixture(scope='session')
+def opendata_service():
+    service, url = server.serve()
+    yield url
+    service.shutdown()
+
+@pytest.fixture
+def opendata_server(opendata_service, monkeypatch):
+    # Handler of the local server, with its settings reset, that this test's OpenData queries go to
+    monkeypatch.setattr(opendata, 'OPENDATA_URL', opendata_service)
+    monkeypatch.setattr(server.Handler, 'limit', opendata.MAX_RECORD_COUNT)
+    monkeypatch.setattr(server.Handler, 'requests', [])
+    monkeypatch.setattr(server.Handler, 'failing', [])
+
+    return server.Handler
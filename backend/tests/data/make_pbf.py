@@ -0,0 +1,113 @@
+"""
+    file: make_pbf.py
+    purpose:
+        Write the f=pbf responses of the tests and the f=json responses they stand for. The protocol buffers
+        are serialized by the protobuf library from FeatureCollection.proto, Esri's schema of the format, the
+        way an ArcGIS server quantizes them with the quantizationParameters OpenDataLondon sends. Neither the
+        decoder under test nor the stand in server of the benchmarks is involved
+
+        Only needed to change the fixtures; requires protobuf and grpcio-tools. From this directory:
+            python -m grpc_tools.protoc -I. --python_out=. FeatureCollection.proto
+            python make_pbf.py
+"""
+
+import json
+import os
+
+import FeatureCollection_pb2
+
+FC = FeatureCollection_pb2.FeatureCollectionPBuffer
+OUT = os.path.dirname(os.path.abspath(__file__))
+
+# WIRE_TOLERANCE, and the upper left corner of the extent the coordinates are quantized over
+TOL = 0.00001
+X0, Y0 = -81.2600, 42.9900
+
+def q(x, y):
+    return int(round((x - X0) / TOL)), int(round((Y0 - y) / TOL))
+
+def build(name, geometry_type, fields, features, exceeded):
+    msg = FC(version='1.0')
+    fr = msg.queryResult.featureResult
+    fr.objectIdFieldName = 'OBJECTID'
+    fr.uniqueIdField.name = 'OBJECTID'
+    fr.uniqueIdField.isSystemMaintained = True
+    fr.globalIdFieldName = ''
+    if geometry_type != FC.esriGeometryTypePoint:
+        fr.geometryProperties.shapeLengthFieldName = 'Shape.STLength()'
+        fr.geometryProperties.units = 'esriMeters'
+    fr.serverGens.minServerGen = 81234
+    fr.serverGens.serverGen = 81240
+    fr.geometryType = geometry_type
+    fr.spatialReference.wkid = 4326
+    fr.spatialReference.lastestWkid = 4326
+    fr.exceededTransferLimit = exceeded
+    fr.hasZ = False
+    fr.hasM = False
+    fr.transform.quantizeOriginPostion = FC.upperLeft
+    fr.transform.scale.xScale = TOL
+    fr.transform.scale.yScale = TOL
+    fr.transform.translate.xTranslate = X0
+    fr.transform.translate.yTranslate = Y0
+    for fname, ftype, sqltype in fields:
+        fr.fields.add(name=fname, fieldType=ftype, alias=fname, sqlType=sqltype)
+
+    jfeatures = []
+    for attrs, paths in features:
+        feat = fr.features.add()
+        for (fname, ftype, _), value in zip(fields, attrs):
+            v = feat.attributes.add()
+            if ftype == FC.esriFieldTypeOID:
+                v.uint_value = value
+            elif ftype == FC.esriFieldTypeDouble:
+                v.double_value = value
+            elif ftype == FC.esriFieldTypeInteger:
+                v.sint_value = value
+        if geometry_type == FC.esriGeometryTypePoint:
+            x, y = q(*paths)
+            feat.geometry.coords.extend([x, y])
+            jgeom = {'x': X0 + x * TOL, 'y': Y0 - y * TOL}
+        else:
+            last = (0, 0)
+            jpaths = []
+            for path in paths:
+                feat.geometry.lengths.append(len(path))
+                jp = []
+                for vx, vy in path:
+                    x, y = q(vx, vy)
+                    feat.geometry.coords.extend([x - last[0], y - last[1]])
+                    last = (x, y)
+                    jp.append([X0 + x * TOL, Y0 - y * TOL])
+                jpaths.append(jp)
+            jgeom = {'paths': jpaths}
+        jfeatures.append({'attributes': {f[0]: a for f, a in zip(fields, attrs)}, 'geometry': jgeom})
+    open(os.path.join(OUT, name + '.pbf'), 'wb').write(msg.SerializeToString())
+    response = {'objectIdFieldName': 'OBJECTID', 'geometryType': {0: 'esriGeometryPoint', 2: 'esriGeometryPolyline'}[geometry_type],
+                'spatialReference': {'wkid': 4326, 'latestWkid': 4326},
+                'fields': [{'name': f[0], 'type': FC.FieldType.Name(f[1]), 'alias': f[0]} for f in fields],
+                'features': jfeatures}
+    if exceeded:
+        response['exceededTransferLimit'] = True
+    json.dump(response, open(os.path.join(OUT, name + '.json'), 'w'), indent=1)
+
+OID = ('OBJECTID', FC.esriFieldTypeOID, FC.sqlTypeInteger)
+LEN = ('Shape.STLength()', FC.esriFieldTypeDouble, FC.sqlTypeDouble)
+VOL = ('VolumeCount', FC.esriFieldTypeInteger, FC.sqlTypeInteger)
+
+build('lights', FC.esriGeometryTypePoint, [OID], [
+    ((7,), (-81.24512, 42.98437)),
+    ((3,), (-81.24733, 42.98301)),
+    ((130412,), (-81.25006, 42.98552)),
+    ((12,), (-81.25990, 42.98001)),
+], exceeded=True)
+
+build('sidewalks', FC.esriGeometryTypePolyline, [OID, LEN], [
+    ((4, 120.53812), [[(-81.2451, 42.9843), (-81.2462, 42.9844), (-81.2473, 42.9846)]]),
+    ((9, 64.25), [[(-81.2480, 42.9830), (-81.2481, 42.9836)], [(-81.2490, 42.9830), (-81.2492, 42.9835)]]),
+    ((17, 33.0), [[(-81.2500, 42.9850), (-81.2496, 42.9850)]]),
+], exceeded=False)
+
+build('volumes', FC.esriGeometryTypePolyline, [OID, LEN, VOL], [
+    ((21, 300.0, 15200), [[(-81.2500, 42.9840), (-81.2470, 42.9841), (-81.2440, 42.9843), (-81.2411, 42.9842)]]),
+    ((5, 88.0, 930), [[(-81.2470, 42.9841), (-81.2471, 42.9849)]]),
+], exceeded=False)
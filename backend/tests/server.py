@@ -0,0 +1,119 @@
+"""
+    file: server.py
+    purpose:
+        Local HTTP stand in for the OpenData map service, answering envelope queries on single layers and on the
+        map service from the street grid of city.py. Like the real server it returns at most LIMIT features per
+        query and flags the rest with exceededTransferLimit, and counts features with returnCountOnly
+"""
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from app.metrics.opendata import LIGHTS_LAYER, MAX_RECORD_COUNT, SIDEWALKS_LAYER, VOLUMES_LAYER
+from tests import city
+
+def bounds(feature):
+    # (minx, miny, maxx, maxy) of a point or polyline feature
+    geometry = feature['geometry']
+
+    if 'x' in geometry:
+        return geometry['x'], geometry['y'], geometry['x'], geometry['y']
+
+    path = np.array(geometry['paths'][0])
+    return path[:, 0].min(), path[:, 1].min(), path[:, 0].max(), path[:, 1].max()
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients may keep the connection alive
+    protocol_version = 'HTTP/1.1'
+
+    features = {
+        LIGHTS_LAYER: city.street_lights(),
+        SIDEWALKS_LAYER: city.sidewalks(),
+        VOLUMES_LAYER: city.traffic_volumes(),
+    }
+    bounds = {layer: np.array([bounds(f) for f in features]) for layer, features in features.items()}
+
+    # Most features returned by one query, and the query URLs served
+    limit = MAX_RECORD_COUNT
+    requests = []
+
+    # Envelopes, as (minx, miny, maxx, maxy), whose queries fail with a server error
+    failing = []
+
+    @classmethod
+    def within(cls, layer, envelope):
+        """
+            purpose:
+                Features of a layer whose bounding box intersects an envelope, like esriSpatialRelIntersects
+        """
+
+        x0, y0, x1, y1 = envelope
+        layer_bounds = cls.bounds[layer]
+        hit = (layer_bounds[:, 0] <= x1) & (layer_bounds[:, 2] >= x0) & (layer_bounds[:, 1] <= y1) & (layer_bounds[:, 3] >= y0)
+
+        return [cls.features[layer][i] for i in np.flatnonzero(hit)]
+
+    def layer(self, layer, envelope, query):
+        features = self.within(layer, envelope)
+
+        if query.get('returnCountOnly') == 'true':
+            return {'count': len(features)}
+
+        response = {'features': features[:self.limit]}
+        if len(features) > self.limit:
+            response['exceededTransferLimit'] = True
+
+        return response
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        Handler.requests.append(self.path)
+
+        x0, y0, x1, y1 = map(float, query['geometry'].split(','))
+        envelope = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+        if any(np.allclose(envelope, failing) for failing in self.failing):
+            self.send_error(500)
+            return
+
+        # Map service query over several layers, or a layer query
+        if url.path.endswith('/MapServer/query'):
+            layers = [layer_def['layerId'] for layer_def in json.loads(query['layerDefs'])]
+            body = {'layers': [dict(self.layer(layer, envelope, query), id=layer) for layer in layers]}
+        else:
+            body = self.layer(int(url.path.split('/')[-2]), envelope, query)
+
+        body = json.dumps(body).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def object_ids(layer):
+    # IDs of every feature of a layer, sorted
+    return sorted(feature['attributes']['OBJECTID'] for feature in Handler.features[layer])
+
+def serve():
+    """
+        purpose:
+            Start the stand in server on a free local port
+        return:
+            (server, url of the map service)
+    """
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://localhost:{}/arcgisa/rest/services/OpenData/OpenData_Transportation/MapServer'.format(server.server_address[1])
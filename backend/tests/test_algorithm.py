@@ -0,0 +1,187 @@
+"""
+    file: test_algorithm.py
+    purpose:
+        Splitting routes into their shared segments, and scoring routes through the features located along
+        them, see compute_all, against scoring every route on its own
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from app.metrics.algorithm import LIGHT_BACKENDS, LinearReference, RatingAlgorithms, route_segments
+from app.metrics.map import WalkingRoute
+from app.metrics.opendata import LightSet, LineSet
+from app.metrics.util import CAP_STYLES, JOIN_STYLES, RouteShape, encode_polyline
+from shapely.geometry import LineString
+from tests import city
+
+# Corner two of the routes turn at, in (LON, LAT)
+X, Y = -81.25, 42.98
+
+def walking_route(points):
+    """
+        purpose:
+            Google Maps directions route through POINTS, in (LON, LAT)
+    """
+
+    lons, lats = zip(*points)
+
+    return WalkingRoute({
+        "bounds": {"northeast": {"lat": max(lats), "lng": max(lons)}, "southwest": {"lat": min(lats), "lng": min(lons)}},
+        "legs": [{"distance": {"text": "0.3 km", "value": 300}, "duration": {"value": 216}}],
+        "overview_polyline": {"points": encode_polyline(points)},
+    })
+
+def ring(half, start=0, reverse=False):
+    """
+        purpose:
+            Closed square path of half width HALF around the corner at (X + 0.002, Y), starting at corner START
+    """
+
+    x, y = X + 0.002, Y
+    corners = [(x + half, y - half), (x + half, y + half), (x - half, y + half), (x - half, y - half)]
+    corners = corners[start:] + corners[:start]
+
+    if reverse:
+        corners = corners[::-1]
+
+    return corners + corners[:1]
+
+@pytest.fixture
+def routes():
+    # Two routes sharing their first block, the second turning north at the corner, and the first walked back
+    return [walking_route([(X, Y), (X + 0.002, Y), (X + 0.004, Y)]),
+            walking_route([(X, Y), (X + 0.002, Y), (X + 0.002, Y + 0.002)]),
+            walking_route([(X + 0.004, Y), (X + 0.002, Y), (X, Y)])]
+
+def joined(segments, member):
+    # Vertices of a route again from its segments, in walking order
+    coords = [segments[sid].coords if forward else segments[sid].coords[::-1] for sid, forward in member]
+
+    return np.concatenate([coords[0]] + [c[1:] for c in coords[1:]])
+
+def test_route_segments(routes):
+    segments, members = route_segments(routes)
+
+    # The first block is shared by every route, the third walks the first backwards
+    assert len(segments) == 3
+    assert members[0][0] == members[1][0]
+    assert members[2] == [(sid, not forward) for sid, forward in reversed(members[0])]
+
+    for route, member in zip(routes, members):
+        assert np.array_equal(joined(segments, member), route.coords)
+
+def test_route_segments_city():
+    routes = city.walking_routes(4)
+    segments, members = route_segments(routes)
+
+    for route, member in zip(routes, members):
+        assert np.array_equal(joined(segments, member), route.coords)
+
+    # Every edge walked by several routes is in one segment only
+    edges = [tuple(sorted(map(tuple, pair))) for segment in segments for pair in zip(segment.coords, segment.coords[1:])]
+    assert len(edges) == len(set(edges))
+    assert len(edges) < sum(len(route.coords) - 1 for route in routes)
+
+def test_route_segments_shapes():
+    # Routes are only split among routes of the same separable shape
+    shapes = [RouteShape(), RouteShape(resolution=4), RouteShape(cap_style='flat'), RouteShape(tolerance=0.00005)]
+    routes = [city.walking_routes(2, shape=shape) for shape in shapes]
+    segments, members = route_segments([route for pair in routes for route in pair])
+
+    for rid in (0, 1, 2, 3):
+        assert all(len(segments[sid].coords) < len(routes[0][0].coords) for sid, _ in members[rid])
+    assert not {sid for sid, _ in members[0] + members[1]} & {sid for sid, _ in members[2] + members[3]}
+
+    for rid in (4, 5, 6, 7):
+        route = routes[rid // 2][rid % 2]
+        assert members[rid] == [(members[rid][0][0], True)]
+        assert segments[members[rid][0][0]].polygon is route.polygon
+
+def test_route_segments_empty():
+    assert route_segments([]) == ([], [])
+
+@pytest.mark.parametrize('half', [0.0001, 0.0003, 0.0006])
+@pytest.mark.parametrize('start', range(4))
+@pytest.mark.parametrize('reverse', [False, True])
+def test_ring_features(routes, half, start, reverse):
+    # A ring around the corner is clipped by every segment that meets there, some parts going around through
+    # the start of the ring
+    path = ring(half, start, reverse)
+
+    sidewalks = LineSet.from_json([{"attributes": {"OBJECTID": 1, "Shape.STLength()": 80}, "geometry": {"paths": [path]}}])
+    volumes = LineSet.from_json([{"attributes": {"OBJECTID": 1, "Shape.STLength()": 80, "VolumeCount": 100},
+                                  "geometry": {"paths": [path]}}], volumes=True)
+
+    algos = RatingAlgorithms()
+    metrics = algos.compute_all(routes, LightSet.from_json([]), sidewalks, volumes)
+
+    assert [m.sidewalks for m in metrics] == pytest.approx(algos.sidewalk_density(routes, sidewalks))
+    assert [m.traffic for m in metrics] == pytest.approx(algos.traffic_density(routes, volumes))
+
+def test_linear_reference():
+    # Lights a quarter and three quarters along a line, a sidewalk beside its first half
+    line = LineString([(X, Y), (X + 0.004, Y)])
+    lights = LightSet([1, 2], [X + 0.001, X + 0.003], [Y + 0.0001, Y - 0.0001])
+    sidewalks = LineSet([1], [0.16], [(X, Y + 0.0001), (X + 0.002, Y + 0.0001)], [0, 2])
+
+    reference = LinearReference.locate(line, lights, [0, 1], sidewalks, [(0, sidewalks.lines[0])], LineSet(volumes=[]), [])
+
+    assert reference.light_count() == 2
+    assert reference.longest_unlit() == pytest.approx(0.002)
+    assert reference.sidewalk_length() == pytest.approx(0.002)
+    assert reference.longest_without_sidewalk() == pytest.approx(0.002)
+
+    # Walked from its end, then joined with itself: the same lights and sidewalk are not counted twice
+    backward = reference.reversed()
+    assert backward.lights[1] == pytest.approx([0.003, 0.001])
+    assert backward.sidewalks[1] == pytest.approx(np.array([[0.002, 0.004]]))
+
+    joined = LinearReference.join([reference, backward])
+    assert joined.length == pytest.approx(0.008)
+    assert joined.light_count() == 2
+    assert joined.sidewalk_length() == pytest.approx(0.002)
+    assert joined.longest_without_sidewalk() == pytest.approx(0.004)
+
+@pytest.mark.parametrize('backend', LIGHT_BACKENDS)
+def test_compute_all(features, backend):
+    lights, sidewalks, volumes = features
+    routes = city.walking_routes(4)
+
+    algos = RatingAlgorithms(backend)
+    metrics = algos.compute_all(routes, lights, sidewalks, volumes)
+
+    assert [m.lights for m in metrics] == pytest.approx(algos.street_light_density(routes, lights))
+    assert [m.sidewalks for m in metrics] == pytest.approx(algos.sidewalk_density(routes, sidewalks))
+    assert [m.traffic for m in metrics] == pytest.approx(algos.traffic_density(routes, volumes))
+
+def test_compute_all_reversed(features):
+    # Walking the routes the other way reads the same features off the same segments backwards
+    lights, sidewalks, volumes = features
+    routes = city.walking_routes(4)
+    reverse = [city.walking_route(route.coords[::-1]) for route in routes]
+
+    algos = RatingAlgorithms()
+    forward = algos.compute_all(routes, lights, sidewalks, volumes)
+    backward = algos.compute_all(reverse, lights, sidewalks, volumes)
+
+    for f, b in zip(forward, backward):
+        assert (b.lights, b.sidewalks, b.traffic) == pytest.approx((f.lights, f.sidewalks, f.traffic))
+        assert (b.dark_gap, b.sidewalk_gap) == pytest.approx((f.dark_gap, f.sidewalk_gap))
+
+@pytest.mark.parametrize('cap_style', CAP_STYLES)
+@pytest.mark.parametrize('join_style', JOIN_STYLES)
+@pytest.mark.parametrize('tolerance', [0, 0.00005])
+def test_compute_all_shapes(features, cap_style, join_style, tolerance):
+    # Scoring through segments leaves the metrics of every shape as they are on the polygons of the routes
+    lights, sidewalks, volumes = features
+    routes = city.walking_routes(4, shape=RouteShape(tolerance, cap_style=cap_style, join_style=join_style))
+
+    algos = RatingAlgorithms()
+    metrics = algos.compute_all(routes, lights, sidewalks, volumes)
+
+    assert [m.lights for m in metrics] == pytest.approx(algos.street_light_density(routes, lights))
+    assert [m.sidewalks for m in metrics] == pytest.approx(algos.sidewalk_density(routes, sidewalks))
+    assert [m.traffic for m in metrics] == pytest.approx(algos.traffic_density(routes, volumes))
@@ -0,0 +1,267 @@
+"""
+    file: test_cache.py
+    purpose:
+        Caches of the metrics module, see cache.py
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import time
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from app.metrics import cache as cache_module
+from app.metrics.algorithm import RouteMetrics
+from app.metrics.cache import DirectionsCache, LRUCache, MetricsCache
+from tests import city
+
+class Clock:
+    """
+        purpose:
+            Stand in for the time module of cache.py, moved forward by hand
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, 'time', clock)
+
+    return clock
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def test_lru_ttl(clock):
+    cache = LRUCache(ttl=10)
+    cache.put('a', 1)
+
+    clock.now += 10
+    assert cache.get('a') == 1
+
+    clock.now += 0.5
+    assert 'a' not in cache
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 1}
+
+def test_lru_max_entries():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    # Reading a makes b the least recently used
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_lru_max_bytes():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put('a', 'x' * 4)
+    cache.put('b', 'x' * 4)
+    cache.put('c', 'x' * 4)
+
+    assert 'a' not in cache and 'b' in cache and 'c' in cache
+    assert cache.nbytes == 8
+
+    # Replacing an entry frees its old size, a value larger than the cache is not stored
+    cache.put('b', 'x')
+    assert cache.nbytes == 5
+
+    cache.put('d', 'x' * 11)
+    assert 'd' not in cache and cache.nbytes == 5
+
+def test_lru_max_bytes_needs_sizeof():
+    with pytest.raises(ValueError):
+        LRUCache(max_bytes=10)
+
+def test_directions_single_flight():
+    # Callers that miss a trip while it is fetched share the one fetch
+    cache = DirectionsCache()
+    key = cache.key((42.98, -81.24), (42.99, -81.25))
+    release = Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait()
+        return ['route']
+
+    with ThreadPoolExecutor(4) as executor:
+        results = [executor.submit(cache.get, key, fetch) for _ in range(4)]
+
+        try:
+            wait_for(lambda: cache.stats()['waits'] == 3)
+        finally:
+            release.set()
+
+        assert [result.result() for result in results] == [['route']] * 4
+
+    assert len(calls) == 1
+    assert cache.get(key, fetch) == ['route']
+    assert len(calls) == 1
+
+def test_directions_failure_shared():
+    # A failed fetch is handed to the callers waiting for it, and the next miss fetches again
+    cache = DirectionsCache()
+    key = cache.key('1673 Richmond St', '3020 Gore Rd')
+    release = Event()
+
+    def fail():
+        release.wait()
+        return None
+
+    with ThreadPoolExecutor(2) as executor:
+        results = [executor.submit(cache.get, key, fail) for _ in range(2)]
+
+        try:
+            wait_for(lambda: cache.stats()['waits'] == 1)
+        finally:
+            release.set()
+
+        assert [result.result() for result in results] == [None, None]
+
+    assert cache.get(key, lambda: ['route']) == ['route']
+
+def test_directions_key():
+    cache = DirectionsCache(precision=3)
+
+    # Trips a few metres apart share a key, addresses are matched ignoring case and spacing
+    assert cache.key((42.98012, -81.24049), (42.99, -81.25)) == cache.key((42.9804, -81.2401), (42.99, -81.25))
+    assert cache.key((42.98, -81.24), (42.99, -81.25)) != cache.key((42.981, -81.24), (42.99, -81.25))
+    assert cache.key(' 1673  Richmond St', '3020 Gore Rd') == cache.key('1673 richmond st', '3020 GORE RD')
+
+def test_directions_stale_refresh(clock):
+    cache = DirectionsCache(ttl=10, stale=100)
+    key = cache.key((42.98, -81.24), (42.99, -81.25))
+    release = Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait()
+        return ['route {}'.format(len(calls))]
+
+    assert cache.get(key, fetch) == ['route 1']
+
+    # A stale entry is served at once while one background refresh replaces it
+    clock.now += 11
+    try:
+        assert cache.get(key, fetch) == ['route 1']
+        assert cache.get(key, fetch) == ['route 1']
+        assert cache.stats()['refreshes'] == 1 and cache.stats()['stale_hits'] == 2
+    finally:
+        release.set()
+
+    wait_for(lambda: cache.get(key, fetch) == ['route 2'])
+
+    assert len(calls) == 2 and cache.stats()['refreshes'] == 1
+
+def test_directions_failed_refresh(clock):
+    # A refresh that fails keeps the stale entry, and a later stale hit tries again
+    cache = DirectionsCache(ttl=10, stale=100)
+    key = cache.key((42.98, -81.24), (42.99, -81.25))
+
+    cache.get(key, lambda: ['route'])
+    clock.now += 11
+
+    assert cache.get(key, lambda: None) == ['route']
+    wait_for(lambda: cache.get(key, lambda: ['new route']) == ['new route'])
+
+    assert cache.stats()['refreshes'] >= 2
+
+def test_directions_expired(clock):
+    cache = DirectionsCache(ttl=10, stale=100)
+    key = cache.key((42.98, -81.24), (42.99, -81.25))
+
+    cache.get(key, lambda: ['route'])
+
+    # Once the stale window is over the entry is fetched again before returning
+    clock.now += 111
+    assert cache.get(key, lambda: ['new route']) == ['new route']
+    assert cache.stats()['refreshes'] == 0 and cache.stats()['expirations'] == 1
+
+def test_directions_max_entries():
+    cache = DirectionsCache(max_entries=2)
+    keys = [cache.key((42.98 + i / 100, -81.24), (42.99, -81.25)) for i in range(3)]
+
+    for i, key in enumerate(keys):
+        cache.get(key, lambda: ['route {}'.format(i)])
+
+    assert keys[0] not in cache.entries
+    assert cache.get(keys[2], lambda: None) == ['route 2']
+    assert cache.stats()['evictions'] == 1
+
+def metrics(route, lights=10.0):
+    return RouteMetrics(route, lights, 0.5, 2000.0, 0.1, 0.2)
+
+def test_metrics_cached():
+    cache = MetricsCache()
+    route, other = city.walking_routes(2)
+
+    assert cache.get(route, 'v1') is None
+    cache.put(route, metrics(route), 'v1')
+
+    assert cache.get(route, 'v1') == (10.0, 0.5, 2000.0, 0.1, 0.2)
+    assert cache.get(other, 'v1') is None
+
+    # Routes with the same polyline share an entry
+    assert cache.get(city.walking_routes(1)[0], 'v1') == (10.0, 0.5, 2000.0, 0.1, 0.2)
+
+def test_metrics_version():
+    cache = MetricsCache()
+    route, other = city.walking_routes(2)
+
+    cache.get(route, 'v1')
+    cache.put(route, metrics(route), 'v1')
+
+    # A new data version drops every entry computed from the old one
+    assert cache.get(other, 'v2') is None
+    assert cache.get(route, 'v2') is None
+    assert cache.stats()['entries'] == 0 and cache.stats()['version'] == 'v2'
+
+    # Metrics computed from the old data while the version changed are not stored
+    cache.put(route, metrics(route), 'v1')
+    assert cache.get(route, 'v2') is None
+
+    cache.put(route, metrics(route, 20.0), 'v2')
+    assert cache.get(route, 'v2')[0] == 20.0
+
+def test_metrics_ttl(clock):
+    cache = MetricsCache(ttl=10)
+    route = city.walking_routes(1)[0]
+
+    cache.get(route)
+    cache.put(route, metrics(route))
+
+    clock.now += 10
+    assert cache.get(route) is not None
+
+    clock.now += 1
+    assert cache.get(route) is None
+
+def test_metrics_max_entries():
+    cache = MetricsCache(max_entries=2)
+    routes = city.walking_routes(3)
+
+    for route in routes:
+        cache.get(route)
+        cache.put(route, metrics(route))
+
+    assert cache.get(routes[0]) is None
+    assert cache.get(routes[1]) is not None and cache.get(routes[2]) is not None
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,101 @@
+"""
+    file: test_datapool.py
+    purpose:
+        Collecting the OpenData layers of many boxes on the shared executor of DataThreadPool, against the local
+        OpenData server of server.py
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+from threading import Event
+
+import pytest
+
+from app.metrics.cache import LRUCache
+from app.metrics.map import TileSplits
+from app.metrics.opendata import LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER, DataThreadPool
+from tests import city
+from tests.server import object_ids
+
+LAYERS = (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER)
+
+# Most features the local server returns for one query, below the features of each layer of the street grid
+LIMIT = 100
+
+def assert_complete(collected):
+    for layer, features in zip(LAYERS, collected):
+        assert sorted(features.ids.tolist()) == object_ids(layer)
+
+@pytest.mark.parametrize('combined', [False, True])
+def test_collect_tiles(opendata_server, combined):
+    opendata_server.limit = LIMIT
+    pool = DataThreadPool(splits=TileSplits(limit=LIMIT), combined=combined)
+
+    # Tiles over the limit are split, and features on the edges of several tiles are returned once
+    assert_complete(pool.collect(city.TILE.children()))
+
+@pytest.mark.parametrize('combined', [False, True])
+def test_collect_boxes(opendata_server, combined):
+    pool = DataThreadPool(combined=combined)
+    boxes = [tuple(tile) for tile in city.TILE.children()]
+
+    assert_complete(pool.collect(boxes))
+
+    # One request per box, and per layer unless combined
+    assert len(opendata_server.requests) == len(boxes) * (1 if combined else len(LAYERS))
+
+def test_stats(opendata_server):
+    pool = DataThreadPool()
+    boxes = city.TILE.children()
+    before = DataThreadPool.stats()
+
+    pool.collect(boxes)
+    after = DataThreadPool.stats()
+
+    assert after['queued'] == 0 and after['active'] == 0
+    assert after['completed'] - before['completed'] == len(boxes) * len(LAYERS)
+
+def test_shared_executor(opendata_server):
+    DataThreadPool(pool_size=4).collect(city.TILE.children())
+    executor = DataThreadPool.executor()
+
+    # Pools of any size queue their tasks on the executor of the process
+    DataThreadPool(pool_size=2).collect(city.TILE.children())
+
+    assert DataThreadPool.executor() is executor
+    assert DataThreadPool.stats()['workers'] == executor._max_workers
+
+def test_failure_after_every_task(opendata_server):
+    boxes = city.TILE.children()
+    failing = boxes[0]
+    opendata_server.failing = [(failing.sw.lon, failing.sw.lat, failing.ne.lon, failing.ne.lat)]
+
+    # The error page of the failing box is not JSON
+    with pytest.raises(ValueError):
+        DataThreadPool().collect(boxes)
+
+    # The other queries were still made, and none is left running
+    assert len(opendata_server.requests) == len(boxes) * len(LAYERS)
+    assert DataThreadPool.stats()['active'] == 0
+
+def test_stop(opendata_server):
+    stop = Event()
+    stop.set()
+
+    lights, sidewalks, volumes = DataThreadPool().collect(city.TILE.children(), stop=stop)
+
+    assert len(lights) == len(sidewalks) == len(volumes) == 0
+    assert opendata_server.requests == []
+
+def test_prefetch(opendata_server):
+    pool = DataThreadPool(cache=LRUCache())
+    boxes = city.TILE.children()
+
+    assert DataThreadPool().prefetch(boxes) is None
+
+    assert_complete(pool.prefetch(boxes).result(timeout=30))
+    requests = len(opendata_server.requests)
+
+    # The collect after it is served from the tiles the prefetch cached
+    assert_complete(pool.collect(boxes))
+    assert len(opendata_server.requests) == requests
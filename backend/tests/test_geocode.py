@@ -0,0 +1,56 @@
+"""
+    file: test_geocode.py
+    purpose:
+        Address lookups of the GeocodeStore, including by prefix
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import pytest
+
+from app.metrics.geocode import GeocodeStore
+
+LAYER_URL = 'https://maps.london.ca/arcgisa/rest/services/OpenData/OpenData_Address/MapServer/0'
+
+@pytest.fixture
+def store():
+    store = GeocodeStore(':memory:')
+    store.put_many([('100 Oxford St E', 42.98, -81.24), ('100 Oxford St E Unit 1', 42.98, -81.24),
+                    ('100 Oxford St W', 42.99, -81.26), ('200 Wharncliffe Rd N', 42.97, -81.27),
+                    ('300 Dundas St Unit 1', 42.98, -81.25), ('300 Dundas St Unit 2', 42.98, -81.25)], LAYER_URL)
+
+    return store
+
+def test_exact(store):
+    assert store.get('100 Oxford Street East, London, ON') == (42.98, -81.24)
+
+def test_prefix_of_one_location(store):
+    # Neither address is stored as it is; both units of 300 Dundas St share their location
+    assert store.complete('300 Dundas St', limit=3) == ['300 dundas st unit 1', '300 dundas st unit 2']
+    assert store.get('300 Dundas St') == (42.98, -81.25)
+    assert store.get('200 Wharncliffe') == (42.97, -81.27)
+
+def test_prefix_is_whole_words(store):
+    assert store.get('200 Wharncl') is None
+
+def test_prefix_of_several_locations(store):
+    assert store.get('100 Oxford Street') is None
+
+def test_prefix_of_google_addresses():
+    # Google only geocodes the addresses asked for, so the store cannot tell if a prefix is ambiguous
+    store = GeocodeStore(':memory:')
+    store.put('100 Oxford St E', 42.98, -81.24)
+
+    assert store.get('100 Oxford St') is None
+    assert store.get('100 Oxford St E') == (42.98, -81.24)
+
+def test_reopened(tmp_path):
+    path = str(tmp_path / 'geocode.sqlite')
+
+    GeocodeStore(path).put_many([('100 Oxford St E', 42.98, -81.24), ('100 Oxford St W', 42.99, -81.26)], LAYER_URL)
+    GeocodeStore(path).put('300 Dundas St', 42.98, -81.25)
+
+    store = GeocodeStore(path)
+    assert store.get('100 Oxford St') is None
+    assert store.get('300 Dundas') is None
+    assert store.complete('100 oxford') == ['100 oxford st e', '100 oxford st w']
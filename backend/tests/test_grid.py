@@ -0,0 +1,60 @@
+"""
+    file: test_grid.py
+    purpose:
+        Scoring routes from the cells of a SafetyGrid, see compute_grid, against scoring them from the features
+        along them, see compute_all
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from app.metrics.algorithm import RatingAlgorithms, route_vertices
+from app.metrics.grid import SafetyGrid
+from app.metrics.snapshot import Snapshot
+from tests import city
+
+# Relative error of the grid metrics; cells are counted whole when their centre is within the buffer
+TOLERANCE = 0.05
+
+@pytest.fixture(scope='module')
+def grid(features):
+    return SafetyGrid.build(Snapshot(*features, 'city'))
+
+def test_build_totals(features, grid):
+    lights, sidewalks, volumes = features
+
+    # Every light falls in one cell and every line is split between the cells it crosses
+    assert grid.lights.sum() == len(lights)
+    assert grid.sidewalks.sum() == pytest.approx(sum(line.length for line in sidewalks.lines), rel=1e-5)
+    assert grid.traffic.sum() == pytest.approx(sum(line.length * volume for line, volume in zip(volumes.lines, volumes.volumes)), rel=1e-5)
+    assert grid.version == 'city'
+
+def test_compute_grid(features, grid):
+    lights, sidewalks, volumes = features
+    routes = city.walking_routes(8)
+
+    algos = RatingAlgorithms()
+    expected = algos.compute_all(routes, lights, sidewalks, volumes)
+    metrics = algos.compute_grid(routes, grid)
+
+    assert [m.lights for m in metrics] == pytest.approx([m.lights for m in expected], rel=TOLERANCE)
+    assert [m.sidewalks for m in metrics] == pytest.approx([m.sidewalks for m in expected], rel=TOLERANCE)
+    assert [m.traffic for m in metrics] == pytest.approx([m.traffic for m in expected], rel=TOLERANCE)
+
+def test_outside_grid(grid):
+    # Cells beyond the data are empty, and routes past the edge of the grid only read the cells on it
+    route = city.walking_route([(city.ORIGIN[0] - 0.1, city.ORIGIN[1] - 0.1), (city.ORIGIN[0] - 0.09, city.ORIGIN[1] - 0.1)])
+
+    assert grid.totals(route_vertices(route)) == (0, 0.0, 0.0)
+
+def test_save_load(grid, tmp_path):
+    path = str(tmp_path / 'grid.npz')
+    grid.save(path)
+    loaded = SafetyGrid.load(path)
+
+    assert loaded.origin == grid.origin and loaded.cell == grid.cell and loaded.version == grid.version
+    assert np.array_equal(loaded.lights, grid.lights)
+    assert np.array_equal(loaded.sidewalks, grid.sidewalks)
+    assert np.array_equal(loaded.traffic, grid.traffic)
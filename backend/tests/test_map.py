@@ -0,0 +1,57 @@
+"""
+    file: test_map.py
+    purpose:
+        Geocoding both ends of a trip and asking Google for the routes between them, see GMapsAPI
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import pytest
+
+from app.metrics.map import GMapsAPI
+from tests import city
+
+class Client:
+    """
+        purpose:
+            Stand in for googlemaps.Client. Geocodes the addresses it knows and records the Directions calls
+    """
+
+    def __init__(self, locations):
+        self.locations = locations
+        self.directions_calls = []
+
+    def geocode(self, address):
+        if address not in self.locations:
+            raise ValueError('ZERO_RESULTS')
+
+        lat, lng = self.locations[address]
+        return [{'geometry': {'location': {'lat': lat, 'lng': lng}}}]
+
+    def directions(self, origin, destination, **kwargs):
+        self.directions_calls.append((origin, destination))
+        return [city.route_json([(-81.26, 42.97), (-81.25, 42.97)])]
+
+@pytest.fixture
+def maps():
+    maps = GMapsAPI('key')
+    maps.gmaps = Client({'1673 Richmond St': (43.025454, -81.283798)})
+
+    return maps
+
+def test_locate(maps):
+    assert maps.locate('1673 Richmond St', [42.98821, -81.140668]) == ((43.025454, -81.283798), [42.98821, -81.140668])
+
+def test_ungeocoded(maps):
+    # An address Google can't geocode is passed on to the Directions call as it is
+    assert maps.locate('1673 Richmond St', 'Nowhere') == ((43.025454, -81.283798), 'Nowhere')
+
+    routes = maps.walking_routes('Nowhere', '1673 Richmond St')
+
+    assert len(routes) == 1
+    assert maps.gmaps.directions_calls == [('Nowhere', (43.025454, -81.283798))]
+
+def test_coordinates(maps):
+    maps.walking_routes([43.025454, -81.283798], (42.98821, -81.140668))
+
+    assert maps.gmaps.directions_calls == [((43.025454, -81.283798), (42.98821, -81.140668))]
@@ -0,0 +1,147 @@
+"""
+    file: test_opendata.py
+    purpose:
+        Decoding OpenData responses while they are read, see FeatureStream, against parsing the whole response,
+        and the width of the corridors features are counted in
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import copy
+import io
+import json
+
+import numpy as np
+import pytest
+
+from app.metrics.opendata import (LIGHTS_LAYER, METERS_PER_DEGREE, SIDEWALKS_LAYER, WIRE_TOLERANCE, OpenDataLondon,
+                                  corridor_meters, dequantize_response, parse_features, stream_response)
+from app.metrics.util import POLYGON_BUFFER, Coordinate
+from tests import city
+
+# Upper left corner of the compact responses, in (LON, LAT)
+ORIGIN = (-81.26, 42.99)
+
+def streamed(layer, api_response):
+    pytest.importorskip('ijson')
+
+    return stream_response(layer, io.BytesIO(json.dumps(api_response).encode()))
+
+def compact(features):
+    """
+        purpose:
+            Compact JSON response of FEATURES: coordinates quantized from ORIGIN, relative to the vertex before
+            along each path
+    """
+
+    def quantize(x, y):
+        return round((x - ORIGIN[0]) / WIRE_TOLERANCE), round((ORIGIN[1] - y) / WIRE_TOLERANCE)
+
+    features = copy.deepcopy(features)
+
+    for feature in features:
+        geometry = feature['geometry']
+
+        if 'paths' not in geometry:
+            geometry['x'], geometry['y'] = quantize(geometry['x'], geometry['y'])
+            continue
+
+        for path in geometry['paths']:
+            last = (0, 0)
+            for vertex in path:
+                q = quantize(*vertex)
+                vertex[:] = q[0] - last[0], q[1] - last[1]
+                last = q
+
+    return {'features': features, 'transform': {'originPosition': 'upperLeft', 'scale': [WIRE_TOLERANCE, WIRE_TOLERANCE, 0, 0],
+                                                'translate': [ORIGIN[0], ORIGIN[1], 0, 0]}}
+
+def assert_same(got, expected):
+    assert got.ids.tolist() == expected.ids.tolist()
+    assert np.allclose(got.coords, expected.coords)
+
+    if hasattr(expected, 'offsets'):
+        assert got.offsets.tolist() == expected.offsets.tolist()
+        assert got.lengths == pytest.approx(expected.lengths)
+        assert (got.volumes is None) == (expected.volumes is None)
+        if expected.volumes is not None:
+            assert got.volumes.tolist() == expected.volumes.tolist()
+
+def test_stream(layer, json_response):
+    api_response = streamed(layer, json_response)
+
+    assert api_response['exceededTransferLimit'] == json_response.get('exceededTransferLimit', False)
+    assert_same(api_response['features'], parse_features(layer, json_response['features']))
+
+def test_stream_compact(layer, json_response):
+    response = compact(json_response['features'])
+
+    got = dequantize_response(layer, streamed(layer, response))['features']
+
+    assert_same(got, dequantize_response(layer, response)['features'])
+    assert np.abs(got.coords - parse_features(layer, json_response['features']).coords).max() < WIRE_TOLERANCE
+
+@pytest.mark.parametrize('geometry', [None, {}, 'missing'])
+def test_stream_no_geometry(layer, json_response, geometry):
+    # Features without a geometry are skipped as a whole, so ids stay aligned with the coordinates
+    features = copy.deepcopy(json_response['features'])
+
+    if geometry == 'missing':
+        del features[1]['geometry']
+    else:
+        features[1]['geometry'] = geometry
+
+    got = streamed(layer, {'features': features})['features']
+
+    assert_same(got, parse_features(layer, features[:1] + features[2:]))
+
+def test_stream_no_attribute():
+    # A sidewalk without its length
+    features = [{"attributes": {"OBJECTID": 1}, "geometry": {"paths": [[[-81.25, 42.98], [-81.24, 42.98]]]}},
+                {"attributes": {"OBJECTID": 2, "Shape.STLength()": 81.5}, "geometry": {"paths": [[[-81.25, 42.98], [-81.24, 42.98]]]}}]
+
+    got = streamed(SIDEWALKS_LAYER, {'features': features})['features']
+
+    assert_same(got, parse_features(SIDEWALKS_LAYER, features[1:]))
+
+def test_stream_empty(layer):
+    api_response = streamed(layer, {'features': []})
+
+    assert len(api_response['features']) == 0
+    assert api_response['exceededTransferLimit'] is False
+
+def test_stream_error():
+    # Errors have no features, so callers can tell them from an empty result
+    api_response = streamed(LIGHTS_LAYER, {'error': {'code': 400, 'message': 'Invalid query'}})
+
+    assert 'features' not in api_response
+
+class Unreachable:
+    # Session of a server that can't be reached
+    def get(self, url, **kwargs):
+        raise ConnectionError(url)
+
+def test_wire_format_unreachable():
+    # The auto format falls back to compact JSON, which every layer supports
+    source = OpenDataLondon(session=Unreachable(), wire='auto')
+
+    assert source.wire_format(LIGHTS_LAYER) == 'compact'
+    assert 'quantizationParameters' in source.box_url(LIGHTS_LAYER, Coordinate(42.99, -81.24), Coordinate(42.98, -81.25))
+
+def test_corridor_meters_heading():
+    # Across a street heading east the buffer reaches north, where a degree is longest
+    y = 42.98
+
+    assert corridor_meters(np.array([(-81.25, y), (-81.24, y)]), POLYGON_BUFFER) == pytest.approx(POLYGON_BUFFER * METERS_PER_DEGREE)
+    assert corridor_meters(np.array([(-81.25, y), (-81.25, y + 0.01)]), POLYGON_BUFFER) == \
+        pytest.approx(POLYGON_BUFFER * METERS_PER_DEGREE * np.cos(np.radians(y + 0.005)), rel=1e-3)
+
+def test_corridor_meters_area():
+    # A corridor of that half width covers about the area of the route polygon
+    for route in city.walking_routes(2):
+        east = METERS_PER_DEGREE * np.cos(np.radians(route.coords[:, 1].mean()))
+
+        area = route.polygon.area * east * METERS_PER_DEGREE
+        length = np.hypot(*(np.diff(route.coords, axis=0) * (east, METERS_PER_DEGREE)).T).sum()
+
+        assert corridor_meters(route.coords, POLYGON_BUFFER) == pytest.approx(area / (2 * length), rel=0.01)
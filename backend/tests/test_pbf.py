@@ -0,0 +1,65 @@
+"""
+    file: test_pbf.py
+    purpose:
+        Decoding of f=pbf responses against the f=json response of the same features, see data/make_pbf.py
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from app.metrics import pbf
+from app.metrics.opendata import LIGHTS_LAYER, WIRE_TOLERANCE, parse_features, parse_pbf
+
+def test_decode_varints():
+    # Examples of the protocol buffers encoding documentation
+    assert pbf.decode_varints(b'\x01\x96\x01\xac\x02\x00').tolist() == [1, 150, 300, 0]
+    assert pbf.decode_varints(b'').tolist() == []
+
+def test_decode_varints_large():
+    data = b'\x7f\x80\x01\xff\xff\x03\xff\xff\xff\xff\xff\xff\xff\xff\x7f'
+
+    assert pbf.decode_varints(data).tolist() == [127, 128, 65535, 2 ** 63 - 1]
+
+def test_decode_varints_zigzag():
+    # sint64 values 0, -1, 1, -2, 2147483647, -2147483648
+    data = b'\x00\x01\x02\x03\xfe\xff\xff\xff\x0f\xff\xff\xff\xff\x0f'
+
+    assert pbf.decode_varints(data, zigzag=True).tolist() == [0, -1, 1, -2, 2147483647, -2147483648]
+
+def test_decode_features(json_response, pbf_response):
+    features = json_response['features']
+
+    result = pbf.decode_features(pbf_response)
+
+    assert result['exceededTransferLimit'] == json_response.get('exceededTransferLimit', False)
+    assert set(result['attributes']) == set(features[0]['attributes'])
+
+    for name, values in result['attributes'].items():
+        assert values == pytest.approx([feature['attributes'][name] for feature in features])
+
+    # Only the first path of every feature
+    first = [feature['geometry']['paths'][0] if 'paths' in feature['geometry'] else [[0, 0]] for feature in features]
+    assert np.diff(result['offsets']).tolist() == [len(path) for path in first]
+
+def test_parse_pbf(layer, json_response, pbf_response):
+    api_response = parse_pbf(layer, pbf_response)
+    expected = parse_features(layer, json_response['features'])
+
+    assert api_response['exceededTransferLimit'] == json_response.get('exceededTransferLimit', False)
+
+    got = api_response['features']
+    assert got.ids.tolist() == expected.ids.tolist()
+    assert np.abs(got.coords - expected.coords).max() < WIRE_TOLERANCE / 100
+
+    if layer != LIGHTS_LAYER:
+        assert got.offsets.tolist() == expected.offsets.tolist()
+        assert got.lengths == pytest.approx(expected.lengths)
+        assert (got.volumes is None) == (expected.volumes is None)
+        if expected.volumes is not None:
+            assert got.volumes.tolist() == expected.volumes.tolist()
+
+def test_not_a_feature_query():
+    with pytest.raises(ValueError):
+        pbf.decode_features(b'')
@@ -0,0 +1,159 @@
+"""
+    file: test_tiles.py
+    purpose:
+        Tiles of the global grid that OpenData queries are cached by, see Tile and split_tiles, and the tiles
+        split because they hold more features than one query returns, see TileSplits
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import pytest
+
+from app.metrics.map import TILE_SIZE, Tile, TileSplits, split_tiles
+from app.metrics.opendata import LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER, OpenDataLondon
+from app.metrics.util import Coordinate
+from tests import city
+from tests.server import object_ids
+
+# Most features the local server returns for one query, a few hundred less than each layer of the street grid
+LIMIT = 100
+
+def test_corners():
+    tile = Tile(-8126, 4297)
+
+    assert tile.sw.latlng == pytest.approx((42.97, -81.26))
+    assert tile.ne.latlng == pytest.approx((42.98, -81.25))
+    assert [c.latlng for c in tile] == [tile.ne.latlng, tile.sw.latlng]
+
+def test_children():
+    tile = Tile(-8126, 4297)
+    children = tile.children()
+
+    assert len(set(children)) == 4
+    assert all(child.size == TILE_SIZE / 2 for child in children)
+    assert sum(child.area for child in children) == pytest.approx(tile.area)
+
+    # Every child lies within its parent
+    for child in children:
+        assert tile.sw.lat <= child.sw.lat and child.ne.lat <= tile.ne.lat
+        assert tile.sw.lon <= child.sw.lon and child.ne.lon <= tile.ne.lon
+
+def test_same_area_same_tile():
+    # Boxes of different requests map onto the same tiles, so their results can be cached
+    a = split_tiles(Coordinate(42.985, -81.245), Coordinate(42.975, -81.255))
+    b = split_tiles(Coordinate(42.981, -81.249), Coordinate(42.979, -81.251))
+
+    assert set(b) <= set(a)
+    assert Tile(-8126, 4297) == Tile(-8126, 4297) and hash(Tile(-8126, 4297)) == hash(Tile(-8126, 4297))
+    assert Tile(-8126, 4297) != Tile(-8126, 4297, 1)
+
+def test_split_tiles_cover():
+    ne, sw = Coordinate(42.985, -81.245), Coordinate(42.975, -81.255)
+
+    for level in (-2, 0, 2):
+        tiles = split_tiles(ne, sw, level)
+
+        assert all(tile.level == level and tile.intersects(ne, sw) for tile in tiles)
+        assert min(tile.sw.lat for tile in tiles) <= sw.lat and max(tile.ne.lat for tile in tiles) >= ne.lat
+        assert min(tile.sw.lon for tile in tiles) <= sw.lon and max(tile.ne.lon for tile in tiles) >= ne.lon
+
+        # No tile more than needed in either direction
+        rows = {tile.row for tile in tiles}
+        cols = {tile.col for tile in tiles}
+        assert len(tiles) == len(rows) * len(cols)
+        size = tiles[0].size
+        assert max(rows) * size <= ne.lat and (min(rows) + 1) * size > sw.lat
+        assert max(cols) * size <= ne.lon and (min(cols) + 1) * size > sw.lon
+
+def test_split_remembered():
+    splits = TileSplits()
+    tile = Tile(-8126, 4297)
+
+    assert not splits.is_split(LIGHTS_LAYER, tile)
+    assert splits.split(LIGHTS_LAYER, tile)
+
+    assert splits.is_split(LIGHTS_LAYER, tile)
+    assert not splits.is_split(SIDEWALKS_LAYER, tile)
+    assert not any(splits.is_split(LIGHTS_LAYER, child) for child in tile.children())
+    assert len(splits) == 1
+
+def test_split_max_level():
+    splits = TileSplits(limit=1, densities={LIGHTS_LAYER: 1e12}, max_level=2)
+    tile = Tile(0, 0, 2)
+
+    assert not splits.split(LIGHTS_LAYER, tile)
+    assert not splits.is_split(LIGHTS_LAYER, tile)
+    assert splits.is_split(LIGHTS_LAYER, Tile(0, 0, 1))
+
+def test_estimate_density():
+    # 100 features per level 0 tile
+    splits = TileSplits(limit=LIMIT, densities={LIGHTS_LAYER: LIMIT / TILE_SIZE ** 2})
+    tile = Tile(-8126, 4297)
+
+    assert splits.estimate(LIGHTS_LAYER, tile) == pytest.approx(LIMIT)
+    assert splits.estimate(LIGHTS_LAYER, tile.children()[0]) == pytest.approx(LIMIT / 4)
+    assert splits.estimate(SIDEWALKS_LAYER, tile) is None
+
+    # Split before any query, down to the level whose tiles are estimated below the limit
+    assert splits.is_split(LIGHTS_LAYER, tile)
+    assert not splits.is_split(LIGHTS_LAYER, tile.children()[0])
+    assert not splits.is_split(SIDEWALKS_LAYER, tile)
+
+def test_measured_density():
+    splits = TileSplits(limit=LIMIT, densities={LIGHTS_LAYER: LIMIT / TILE_SIZE ** 2})
+    tile = Tile(-8126, 4297)
+    child = tile.children()[0]
+
+    splits.measure(LIGHTS_LAYER, tile, 2 * LIMIT)
+    splits.measure(LIGHTS_LAYER, child, 10)
+
+    # The smallest measured tile that covers a tile gives its density, the layer density is used elsewhere
+    assert splits.estimate(LIGHTS_LAYER, tile) == pytest.approx(2 * LIMIT)
+    assert splits.estimate(LIGHTS_LAYER, tile.children()[1]) == pytest.approx(LIMIT / 2)
+    assert splits.estimate(LIGHTS_LAYER, child) == pytest.approx(10)
+    assert splits.estimate(LIGHTS_LAYER, child.children()[0]) == pytest.approx(2.5)
+    assert splits.estimate(LIGHTS_LAYER, Tile(-8125, 4297)) == pytest.approx(LIMIT)
+
+    assert splits.is_split(LIGHTS_LAYER, tile)
+    assert not splits.is_split(LIGHTS_LAYER, child)
+
+@pytest.mark.parametrize('layer', [LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER])
+def test_split_on_transfer_limit(opendata_server, layer):
+    opendata_server.limit = LIMIT
+    splits = TileSplits(limit=LIMIT)
+    source = OpenDataLondon(splits=splits)
+
+    assert len(object_ids(layer)) > LIMIT
+
+    # Truncated tiles are fetched through their children until every feature is returned
+    assert sorted(source.get_tile(layer, city.TILE).unique().ids.tolist()) == object_ids(layer)
+    assert splits.is_split(layer, city.TILE)
+
+    first = len(opendata_server.requests)
+    opendata_server.requests.clear()
+
+    # Known splits go straight to the children; only the tiles that were not split are queried again
+    assert sorted(source.get_tile(layer, city.TILE).unique().ids.tolist()) == object_ids(layer)
+    assert len(opendata_server.requests) == first - len(splits)
+
+def test_measure_tiles(opendata_server):
+    opendata_server.limit = LIMIT
+    splits = TileSplits(limit=LIMIT)
+    source = OpenDataLondon(splits=splits)
+    layers = (LIGHTS_LAYER, SIDEWALKS_LAYER, VOLUMES_LAYER)
+
+    source.measure_tiles(layers, [city.TILE], workers=3)
+
+    assert len(opendata_server.requests) == len(layers)
+    assert all('returnCountOnly=true' in request for request in opendata_server.requests)
+
+    for layer in layers:
+        assert splits.estimate(layer, city.TILE) == len(object_ids(layer))
+        assert splits.is_split(layer, city.TILE)
+
+    # Measured tiles are split before their first query, so the whole grid is never asked for
+    opendata_server.requests.clear()
+    assert sorted(source.get_tile(LIGHTS_LAYER, city.TILE).unique().ids.tolist()) == object_ids(LIGHTS_LAYER)
+
+    envelope = '{}%2C{}%2C{}%2C{}'.format(city.TILE.ne.lon, city.TILE.ne.lat, city.TILE.sw.lon, city.TILE.sw.lat)
+    assert not any(envelope in request for request in opendata_server.requests)
@@ -0,0 +1,40 @@
+"""
+    file: test_util.py
+    purpose:
+        Encoded polylines of Google routes, see decode_polyline and encode_polyline
+
+        Run from the backend directory: python -m pytest tests
+"""
+
+import random
+
+import numpy as np
+
+from app.metrics.util import decode_polyline, encode_polyline
+
+# Example of the encoded polyline algorithm format documentation, with its points in (LON, LAT)
+TEXT = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+COORDS = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+
+def test_decode():
+    assert np.allclose(decode_polyline(TEXT), COORDS)
+
+def test_encode():
+    assert encode_polyline(COORDS) == TEXT
+
+def test_empty():
+    assert decode_polyline('').shape == (0, 2)
+    assert encode_polyline([]) == ''
+
+def test_precision():
+    assert encode_polyline([(-81.2497501, 42.9849233)], precision=6) == 'u|q~pAj|a~yC'
+    assert np.allclose(decode_polyline('u|q~pAj|a~yC', precision=6), [(-81.24975, 42.984923)])
+
+def test_round_trip():
+    rand = random.Random(0)
+
+    # Long jumps, repeated vertices and both signs, at the five decimals the format keeps
+    coords = np.round([(rand.uniform(-180, 180), rand.uniform(-90, 90)) for _ in range(200)], 5)
+    coords[50:53] = coords[49]
+
+    assert np.allclose(decode_polyline(encode_polyline(coords)), coords, atol=1e-9)